@@ -1,22 +1,42 @@
-from flask import Flask, request, send_from_directory
+from flask import Flask, Response, request, send_from_directory, stream_with_context
+import os
 import signal
+from functools import wraps
 
-from project_utils import read_config, catch_error, init_or_resume_mongo, json_response, log
-from services import Services
-from submission_service import RateLimitExceeded, InvalidToken, OutOfTimeWindow
+from project_utils import read_config, catch_error, json_response, json_loads, json_dumps, log
+from services import Startup
+from submission_service import RateLimitExceeded, InvalidToken, OutOfTimeWindow, parse_flag_lines
+from server import make_server
+import metrics
+import logger
 
 
+COLUMNAR_MEDIA_TYPE = "application/vnd.adkihon.columnar+json"
+
 app = Flask(__name__)
 config = read_config()
+logger.configure(config)
 app.config.update(config['flask'])
-init_or_resume_mongo(config)
-adServices = Services(config)
+
+
+def startup_failed():
+    # the process exits with an error, so that the container is restarted (see docker-compose.yml);
+    # os._exit because this runs in the startup's thread
+    log("Exiting: the startup failed")
+    logger.ASYNC_LOG.stop()
+    os._exit(1)
+
+
+# the DB is initialized and the services are started in background, see requires_services and /api/ready
+startup = Startup(config, onFailure=startup_failed)
+startup.start()
 
 
 def signal_handler(sig, frame):
     # note: you will not be able to see the log with Ctrl-C, you should use docker stop
     log("Received SIGINT: stopping services after completion of pending jobs or timeout")
-    adServices.stop()
+    if startup.services is not None:
+        startup.services.stop()
     log("Goodbye")
     exit(0)
 
@@ -24,6 +44,16 @@ def signal_handler(sig, frame):
 signal.signal(signal.SIGINT, signal_handler)
 
 
+def requires_services(func):
+    # the endpoints which need the services answer 503 until the startup has completed
+    @wraps(func)
+    def waitStartup(*args, **kwargs):
+        if not startup.ready.is_set():
+            return json_response({"error": "Starting up, retry later"}, status_code=503)
+        return func(startup.services, *args, **kwargs)
+    return waitStartup
+
+
 @app.route('/')
 def index():
     return send_from_directory('static', 'index.html')
@@ -34,19 +64,64 @@ def favicon():
     return send_from_directory('static', 'logo.jpg', mimetype='image/jpg')
 
 
+@app.route('/api/ready')
+@catch_error
+def ready():
+    # readiness of the platform, with the duration of the startup phases completed so far
+    msg = {"ready": startup.ready.is_set(), "failed": startup.failed, "phases": dict(startup.phases)}
+    return json_response(msg, status_code=200 if startup.ready.is_set() else 503)
+
+
 @app.route('/api/getStats')
 @catch_error
-def get_stats():
-    teams = adServices.scoreboardCache.getStats()
-    msg = {"teams": teams, "roundNum": adServices.checkScheduler.roundNum,
-           "flagLifetime": adServices.checkScheduler.flagLifetime}
+@requires_services
+def get_stats(adServices):
+    # the teams are already encoded by the scoreboard cache, only the round info is added to them; the columnar
+    # format is chosen with ?format=columnar or with its media type in the Accept header
+    columnar = request.args.get('format') == 'columnar' or COLUMNAR_MEDIA_TYPE in request.headers.get('Accept', '')
+    teams = adServices.scoreboardCache.getEncodedStats(columnar=columnar)
+    msg = (b'{"columns":' if columnar else b'{"teams":') + teams + \
+        b',"roundNum":' + str(adServices.checkScheduler.roundNum).encode() + \
+        b',"flagLifetime":' + str(adServices.checkScheduler.flagLifetime).encode() + b'}'
     return json_response(msg, status_code=200)
 
 
+@app.route('/api/slowestCheckers')
+@catch_error
+@requires_services
+def slowest_checkers(adServices):
+    # the slowest checkers' actions of a round (by default, the last completed one)
+    try:
+        round_num = int(request.args.get('round', adServices.checkScheduler.roundNum - 1))
+        limit = int(request.args.get('limit', 10))
+    except ValueError:
+        return json_response({"error": "round and limit must be integers"}, status_code=400)
+    return json_response({"round": round_num, "slowest": adServices.checkScheduler.tracer.slowest(round_num, limit)},
+                         status_code=200)
+
+
+@app.route('/api/attacks')
+@catch_error
+@requires_services
+def attacks(adServices):
+    # attack statistics, maintained by the event dispatcher
+    return json_response(adServices.eventDispatcher.attackStats.getEncoded(), status_code=200)
+
+
+@app.route('/metrics')
+@catch_error
+def get_metrics():
+    return Response(metrics.render(), status=200, content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
 @app.route('/api/flagSubmit', methods=['POST'])
 @catch_error
-def flag_submit():
-    data = request.get_json(force=True, silent=True)
+@requires_services
+def flag_submit(adServices):
+    try:
+        data = json_loads(request.get_data())
+    except ValueError:
+        data = None
     if data is None:
         return json_response({"error": "Input data is not json"}, status_code=400)
     else:
@@ -69,6 +144,33 @@ def flag_submit():
         return json_response(msg, status_code=200)
 
 
+@app.route('/api/flagStream', methods=['POST'])
+@catch_error
+@requires_services
+def flag_stream(adServices):
+    # NDJSON in and out: a flag for each line of the body, a verdict for each line of the response
+    token = request.headers.get('X-Team-Token')
+    if token is None:
+        return json_response({"error": "X-Team-Token header missing"}, status_code=400)
+    try:
+        verdicts = adServices.submissionService.submitFlagStream(token, parse_flag_lines(request.stream))
+    except InvalidToken:
+        return json_response({"error": "Invalid token"}, status_code=400)
+    except OutOfTimeWindow:
+        return json_response({"error": "Too early or too late to submit a flag"}, status_code=400)
+
+    def generate():
+        # the response has already started, so errors can only be reported in the stream
+        try:
+            for verdict in verdicts:
+                yield json_dumps(verdict) + b"\n"
+        except Exception as e:
+            log(f"Exception in flag_stream: {e.__class__.__name__} {str(e)}\n")
+            yield json_dumps({"error": "Generic error"}) + b"\n"
+    return Response(stream_with_context(generate()), status=200, mimetype='application/x-ndjson')
+
+
 if __name__ == "__main__":
-    log("Starting server")
-    app.run(host='0.0.0.0', port=config['flask']['port'])
+    log(f"Starting server ({config['flask'].get('server', 'development')} mode)")
+    server = make_server(app, config['flask'])
+    server.run()
@@ -0,0 +1,152 @@
+import threading
+
+import numpy as np
+from dateutil import parser
+
+from event_queue import EVENT_ATTACK, AttackEvent
+from mongo_utils import get_teams, get_attack_stats, save_attack_stats, count_stolen_flags, get_flags_by_data
+from project_utils import json_dumps, log
+from game_clock import Clock, REAL_CLOCK
+
+
+class AttackStats:
+    # who steals from whom: a (attacker, victim, service) matrix of stolen flags, the first blood of each service
+    # and the flags stolen in each round, updated by the EventDispatcher with the attack events of each batch,
+    # so that they're never computed from the stolen flags of the teams. They're persisted in the attack_stats
+    # collection every attack_stats_persist_interval seconds; at start they're loaded from there, or rebuilt
+    # from the stolen flags if some attacks were dispatched after the last save
+    def __init__(self, config: dict, clock: Clock = REAL_CLOCK):
+        misc = config['misc']
+        self.clock = clock
+        self.teamIds = sorted(team['id'] for team in config['teams'])
+        self.teamNames = {team['id']: team['name'] for team in config['teams']}
+        self.teamIndex = {team_id: i for i, team_id in enumerate(self.teamIds)}
+        self.serviceIds = sorted(service['id'] for service in config['services'])
+        self.serviceNames = {service['id']: service['name'] for service in config['services']}
+        self.serviceIndex = {service_id: j for j, service_id in enumerate(self.serviceIds)}
+        self.startTime = parser.parse(misc['start_time']).timestamp()
+        self.roundTime = misc['round_time']
+        self.persistInterval = misc.get('attack_stats_persist_interval', 10)
+        self.lastPersist = clock.time()
+        # incremented at each change, never reset, to know when they must be saved or encoded again
+        self.version = 0
+        self.reset()
+        self.persistedVersion = 0
+        self.encoded = None
+        self.encodedVersion = -1
+        self.mutex = threading.Lock()
+
+    def reset(self):
+        self.matrix = np.zeros((len(self.teamIds), len(self.teamIds), len(self.serviceIds)), dtype=np.int64)
+        # service_id: (timestamp, attacker, victim)
+        self.firstBlood = {}
+        self.flagsPerRound = {}
+        self.total = 0
+
+    def roundOf(self, timestamp: int) -> int:
+        # round 1 starts at start_time, as in the CheckScheduler
+        return int((timestamp - self.startTime) // self.roundTime) + 1
+
+    def record(self, events: list):
+        # events: a batch of dispatched events, only the attacks are counted
+        attacks = [event for event in events if getattr(event, "type", None) == EVENT_ATTACK]
+        if len(attacks) == 0:
+            return
+        with self.mutex:
+            for event in attacks:
+                i = self.teamIndex.get(event.team)
+                j = self.teamIndex.get(event.attacked_team)
+                k = self.serviceIndex.get(event.service)
+                if i is None or j is None or k is None:
+                    log(f"Error: {event} is an invalid attack event")
+                    continue
+                # as for the points, the current time is taken if the event has no timestamp
+                timestamp = event.timestamp if event.timestamp is not None else int(self.clock.time())
+                self.matrix[i, j, k] += 1
+                first = self.firstBlood.get(event.service)
+                if first is None or timestamp < first[0]:
+                    self.firstBlood[event.service] = (timestamp, event.team, event.attacked_team)
+                roundNum = self.roundOf(timestamp)
+                self.flagsPerRound[roundNum] = self.flagsPerRound.get(roundNum, 0) + 1
+                self.total += 1
+            self.version += 1
+
+    def toDocument(self) -> dict:
+        return {"team_ids": self.teamIds, "service_ids": self.serviceIds, "matrix": self.matrix.tolist(),
+                "first_blood": [[service_id, *first] for service_id, first in self.firstBlood.items()],
+                "flags_per_round": [[roundNum, count] for roundNum, count in sorted(self.flagsPerRound.items())],
+                "total": self.total}
+
+    def fromDocument(self, doc: dict):
+        self.matrix = np.array(doc['matrix'], dtype=np.int64).reshape(self.matrix.shape)
+        self.firstBlood = {service_id: (timestamp, attacker, victim)
+                           for service_id, timestamp, attacker, victim in doc['first_blood']}
+        self.flagsPerRound = {roundNum: count for roundNum, count in doc['flags_per_round']}
+        self.total = doc['total']
+        self.version += 1
+
+    def rebuild(self, db):
+        # from the stolen flags of the teams, resolving each flag to its owner and service
+        self.reset()
+        teams = list(get_teams(db))
+        flags = get_flags_by_data(db, {atk['flag_data'] for team in teams for atk in team['stolen_flags']})
+        events = []
+        for team in teams:
+            for atk in team['stolen_flags']:
+                flag = flags.get(atk['flag_data'])
+                if flag is None:
+                    log(f"Error: stolen flag {atk['flag_data']} doesn't exist")
+                    continue
+                events.append(AttackEvent(team['team_id'], flag['service_id'], flag['team_id'], atk['timestamp']))
+        self.record(events)
+
+    def load(self, db):
+        doc = get_attack_stats(db)
+        stolen = count_stolen_flags(db)
+        with self.mutex:
+            upToDate = doc is not None and doc['total'] == stolen and doc['team_ids'] == self.teamIds \
+                and doc['service_ids'] == self.serviceIds
+            if upToDate:
+                self.fromDocument(doc)
+        if not upToDate:
+            self.rebuild(db)
+            log(f"Attack statistics rebuilt from {stolen} stolen flags")
+        self.persistedVersion = self.version if upToDate else 0
+
+    def persist(self, db, force: bool = False):
+        # saves the statistics if they changed, at most once every persist interval unless forced
+        if self.version == self.persistedVersion:
+            return
+        if not force and self.clock.time() - self.lastPersist < self.persistInterval:
+            return
+        with self.mutex:
+            doc = self.toDocument()
+            version = self.version
+        save_attack_stats(db, doc)
+        self.persistedVersion = version
+        self.lastPersist = self.clock.time()
+
+    def snapshot(self) -> dict:
+        teams = [self.teamNames[team_id] for team_id in self.teamIds]
+        with self.mutex:
+            return {
+                "teams": teams,
+                # for each service, row i and column j are the flags stolen by teams[i] from teams[j]
+                "matrix": {self.serviceNames[service_id]: self.matrix[:, :, k].tolist()
+                           for k, service_id in enumerate(self.serviceIds)},
+                "first_blood": {self.serviceNames[service_id]: {"attacker": self.teamNames[attacker],
+                                                                "victim": self.teamNames[victim],
+                                                                "timestamp": timestamp,
+                                                                "round": self.roundOf(timestamp)}
+                                for service_id, (timestamp, attacker, victim) in self.firstBlood.items()},
+                "flags_per_round": [[roundNum, count] for roundNum, count in sorted(self.flagsPerRound.items())],
+                "total": self.total
+            }
+
+    def getEncoded(self) -> bytes:
+        # encoded once for each version, like the teams of the ScoreboardCache
+        version = self.version
+        if self.encodedVersion != version:
+            self.encoded = json_dumps(self.snapshot())
+            self.encodedVersion = version
+        return self.encoded
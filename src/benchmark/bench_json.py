@@ -0,0 +1,72 @@
+import json
+import random
+import time
+
+import project_utils
+from checker_lib import OK, MUMBLE, CORRUPT, DOWN, ERROR, gen_flag
+from bench_utils import summarize, print_report
+
+"""
+Encode/decode cost of the JSON backends on a scoreboard of 50 teams x 10 services (shaped like the output
+of ScoreboardCache.getTeams) and on a flag submission, plus the cost of the /api/getStats body when the teams
+are pre-encoded by the scoreboard cache and only the round info is added at each request.
+"""
+
+N_TEAMS = 50
+N_SERVICES = 10
+ITERATIONS = 2000
+
+
+def make_scoreboard():
+    services = [f"service_{i}" for i in range(N_SERVICES)]
+    statuses = [OK, MUMBLE, CORRUPT, DOWN, ERROR]
+    return [{"ip_addr": f"10.0.0.{i + 1}", "name": f"team_{i}", "last_pts_update": int(time.time()),
+             "points": {s: {"atk_pts": random.randint(0, 500), "def_pts": -random.randint(0, 500),
+                            "sla_pts": random.randint(-200, 200)} for s in services},
+             "overall_score": random.randint(0, 100000),
+             "service_status": {s: random.choice(statuses) for s in services}}
+            for i in range(N_TEAMS)]
+
+
+def measure(func, arg):
+    latencies = []
+    start = time.perf_counter()
+    for _ in range(ITERATIONS):
+        op_start = time.perf_counter()
+        func(arg)
+        latencies.append(time.perf_counter() - op_start)
+    return summarize(latencies, time.perf_counter() - start)
+
+
+def main():
+    teams = make_scoreboard()
+    stats = {"teams": teams, "roundNum": 100, "flagLifetime": 5}
+    submission = {"token": "c2e192800a294acbb2ac7dd188502edb", "flags": [gen_flag("flag", 30) for _ in range(20)]}
+    encoded_teams = project_utils.json_dumps(teams)
+
+    def pre_encoded_stats(_):
+        return b'{"teams":' + encoded_teams + b',"roundNum":' + str(100).encode() + b',"flagLifetime":' + \
+            str(5).encode() + b'}'
+
+    results = {
+        "stdlib dumps scoreboard": measure(lambda obj: json.dumps(obj).encode(), stats),
+        "stdlib loads scoreboard": measure(json.loads, json.dumps(stats).encode()),
+        "stdlib dumps submission": measure(lambda obj: json.dumps(obj).encode(), submission),
+        "stdlib loads submission": measure(json.loads, json.dumps(submission).encode()),
+    }
+    if project_utils.orjson is not None:
+        orjson = project_utils.orjson
+        results.update({
+            "orjson dumps scoreboard": measure(orjson.dumps, stats),
+            "orjson loads scoreboard": measure(orjson.loads, orjson.dumps(stats)),
+            "orjson dumps submission": measure(orjson.dumps, submission),
+            "orjson loads submission": measure(orjson.loads, orjson.dumps(submission)),
+        })
+    else:
+        print("orjson is not installed: only the standard library backend is measured")
+    results["pre-encoded scoreboard"] = measure(pre_encoded_stats, None)
+    print_report(f"JSON encoding, {N_TEAMS} teams x {N_SERVICES} services, {len(encoded_teams)} bytes", results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+import random
+import time
+
+from scoring_engine import ScoringEngine
+from checker_lib import OK, MUMBLE, CORRUPT, DOWN, ERROR
+from bench_utils import summarize, print_report
+
+"""
+Cost of computing the overall scores and ranks of 100 teams x 20 services: a per-team loop over the points dicts,
+like the previous ScoreboardCache, the scoring engine with the load of the arrays from the team documents
+(the first load counts all the checks, the following ones only the new checks), the scoring engine with the points
+updated by the dispatcher's increments (as in the platform, see ScoreboardCache.followEvents), and the vectorised
+scores alone; the cost of applying the increments of a batch of events is measured too, it's paid by the dispatcher.
+"""
+
+N_TEAMS = 100
+N_SERVICES = 20
+CHECKS_PER_SERVICE = 50
+ITERATIONS = 500
+MISC = {"atk_weight": 10, "def_weight": 10, "sla_weight": 80, "base_score": 1000}
+
+
+def make_teams():
+    statuses = [OK, MUMBLE, CORRUPT, DOWN, ERROR]
+    return [{"team_id": i,
+             "points": [{"service_id": s, "atk_pts": random.randint(0, 500), "def_pts": -random.randint(0, 500),
+                         "sla_pts": random.randint(-50, 50)} for s in range(N_SERVICES)],
+             "checks": [{"service_id": s, "status": random.choice(statuses), "timestamp": 0}
+                        for s in range(N_SERVICES) for _ in range(CHECKS_PER_SERVICE)]}
+            for i in range(N_TEAMS)]
+
+
+def loop_scores(teams):
+    scores = []
+    for team in teams:
+        score = MISC['base_score']
+        for points in team['points']:
+            score += points['atk_pts'] * MISC['atk_weight']
+            score += points['def_pts'] * MISC['def_weight']
+            score += points['sla_pts'] * MISC['sla_weight']
+        scores.append(score)
+    ranking = sorted(scores, reverse=True)
+    return scores, [ranking.index(score) + 1 for score in scores]
+
+
+def measure(func, arg):
+    latencies = []
+    start = time.perf_counter()
+    for _ in range(ITERATIONS):
+        op_start = time.perf_counter()
+        func(arg)
+        latencies.append(time.perf_counter() - op_start)
+    return summarize(latencies, time.perf_counter() - start)
+
+
+def main():
+    teams = make_teams()
+    engine = ScoringEngine({"misc": MISC}, {s: {"name": f"service_{s}"} for s in range(N_SERVICES)})
+    first_load = time.perf_counter()
+    engine.load(teams)
+    first_load = time.perf_counter() - first_load
+
+    def load_and_score(teams):
+        engine.load(teams)
+        return engine.scores()
+
+    def load_checks_and_score(teams):
+        engine.load(teams, withPoints=False)
+        return engine.scores()
+
+    # the increments of a batch of 1000 events: a check for each team and service, and 200 stolen flags
+    increments = {(i, s): {"sla_pts": 1} for i in range(N_TEAMS) for s in range(N_SERVICES) if (i + s) % 2 == 0}
+    for _ in range(200):
+        attacker, attacked, service = random.randrange(N_TEAMS), random.randrange(N_TEAMS), random.randrange(N_SERVICES)
+        increments.setdefault((attacker, service), {})["atk_pts"] = 1
+        increments.setdefault((attacked, service), {})["def_pts"] = -1
+
+    results = {
+        "python loop (scores and ranks)": measure(loop_scores, teams),
+        "engine load + scores": measure(load_and_score, teams),
+        "engine load, points from events + scores": measure(load_checks_and_score, teams),
+        "engine scores": measure(lambda _: engine.scores(), None),
+        "engine points of a batch of events": measure(engine.addPoints, increments),
+    }
+    print_report(f"Scoring, {N_TEAMS} teams x {N_SERVICES} services", results)
+    print(f"First load, with {N_TEAMS * N_SERVICES * CHECKS_PER_SERVICE} checks: {first_load * 1000:.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
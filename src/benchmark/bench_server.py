@@ -0,0 +1,110 @@
+import mongomock
+import http.client
+import logging
+import json
+import random
+import threading
+import time
+
+import project_utils
+from mongo_utils import get_db_manager, insert_flag
+from checker_lib import gen_flag, gen_seed
+from server import make_server
+from bench_utils import make_config, summarize, print_report
+
+"""
+Requests per second of /api/getStats and /api/flagSubmit, served by the development server and by the
+production server (waitress), with concurrent keep-alive clients; the whole app runs in this process,
+on top of mongomock, with checkers scheduled in background as in a real game.
+"""
+
+N_TEAMS = 50
+N_SERVICES = 10
+N_CLIENTS = 16
+DURATION = 5
+FLAGS_PER_SUBMISSION = 5
+BASE_PORT = 18080
+
+
+def run_clients(port: int, method: str, path: str, body_factory, duration: float, n_clients: int):
+    latencies = []
+    statuses = {}
+    mutex = threading.Lock()
+
+    def client():
+        conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+        local_latencies, local_statuses = [], {}
+        deadline = time.perf_counter() + duration
+        while time.perf_counter() < deadline:
+            body = body_factory()
+            start = time.perf_counter()
+            try:
+                conn.request(method, path, body=body, headers={"Content-Type": "application/json"})
+                res = conn.getresponse()
+                res.read()
+                status = res.status
+            except (http.client.HTTPException, OSError):
+                conn.close()
+                conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+                status = "conn_error"
+            local_latencies.append(time.perf_counter() - start)
+            local_statuses[status] = local_statuses.get(status, 0) + 1
+        conn.close()
+        with mutex:
+            latencies.extend(local_latencies)
+            for status, count in local_statuses.items():
+                statuses[status] = statuses.get(status, 0) + count
+
+    threads = [threading.Thread(target=client) for _ in range(n_clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return summarize(latencies, duration), statuses
+
+
+@mongomock.patch(servers=(('mock.mongodb.com', 27017),))
+def main():
+    now = time.time()
+    config = make_config(N_TEAMS, N_SERVICES, start_time=now - 1, end_time=now + 3600, round_time=10)
+    config['misc']['rate_limit_seconds'] = 0.001
+    config['misc']['scoreboard_cache_update_latency'] = 1
+    # app.py reads the configuration at import time
+    project_utils.read_config = lambda: config
+    import app
+    app.startup.ready.wait()
+    # the access log of the development server would flood the report
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    db, _ = get_db_manager(config['mongo'])
+    flags = []
+    for team in config['teams']:
+        for service in config['services']:
+            flag = gen_flag(config['misc']['flag_header'], config['misc']['flag_body_len'])
+            insert_flag(db, flag, gen_seed(), 0, team['id'], service['id'])
+            flags.append(flag)
+    tokens = [team['token'] for team in config['teams']]
+
+    def submission_body():
+        sample = random.sample(flags, FLAGS_PER_SUBMISSION - 1)
+        sample.append(gen_flag(config['misc']['flag_header'], config['misc']['flag_body_len']))
+        return json.dumps({"token": random.choice(tokens), "flags": sample})
+
+    results, all_statuses = {}, {}
+    for i, server_name in enumerate(["development", "waitress"]):
+        flask_config = dict(config['flask'], server=server_name, port=BASE_PORT + i, threads=N_CLIENTS)
+        server = make_server(app.app, flask_config, host='127.0.0.1')
+        threading.Thread(target=server.run, daemon=True).start()
+        time.sleep(0.5)
+        for path, method, body_factory in [("/api/getStats", "GET", lambda: None),
+                                           ("/api/flagSubmit", "POST", submission_body)]:
+            case = f"{server_name} {path}"
+            results[case], all_statuses[case] = run_clients(BASE_PORT + i, method, path, body_factory,
+                                                            DURATION, N_CLIENTS)
+    app.startup.services.stop()
+    print_report(f"HTTP server, {N_TEAMS} teams x {N_SERVICES} services, {N_CLIENTS} clients", results)
+    for case, statuses in all_statuses.items():
+        print(f"{case}: status codes {statuses}")
+
+
+if __name__ == "__main__":
+    main()
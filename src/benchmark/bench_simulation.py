@@ -0,0 +1,113 @@
+import mongomock
+import argparse
+import random
+import threading
+import time
+
+from bson import BSON
+
+import project_utils
+from services import Services
+from game_clock import SimulatedClock
+from submission_service import RateLimitExceeded, OutOfTimeWindow
+from mongo_utils import get_db_manager, get_flag_for_round, NotExistentDocument
+from bench_utils import make_config
+
+"""
+Simulation of a whole game with a virtual clock, which runs "speed" times faster than real time: checkers are
+stubs (benchmark/stub_checker.py) and each team is also a synthetic attacker, which steals some of the flags of
+the current round; at some milestone rounds it reports rounds per second, DB size and scoreboard build time.
+Usage: python bench_simulation.py [--teams N] [--services N] [--rounds N] [--round-time S] [--speed X]
+"""
+
+STUB_CHECKER = "benchmark/stub_checker.py"
+# fraction of the flags of the current round stolen by each attacker
+STEAL_FRACTION = 0.1
+
+
+def db_size(db):
+    # size in bytes of the BSON documents of each collection
+    return {name: sum(len(BSON.encode(doc)) for doc in db.get_collection(name).find())
+            for name in ["team", "service", "flag"]}
+
+
+def attacker(services: Services, config: dict, team: dict, stop: threading.Event):
+    db, _ = get_db_manager(config['mongo'], services.checkScheduler.mongoClient)
+    clock = services.clock
+    victims = [t['id'] for t in config['teams'] if t['id'] != team['id']]
+    last_round = 0
+    while not stop.is_set():
+        round_num = services.checkScheduler.roundNum
+        if round_num == last_round:
+            clock.sleep(config['misc']['round_time'] / 10)
+            continue
+        last_round = round_num
+        flags = []
+        for victim in victims:
+            for service in config['services']:
+                if random.random() < STEAL_FRACTION:
+                    try:
+                        flags.append(get_flag_for_round(db, round_num, victim, service['id'])['flag_data'])
+                    except NotExistentDocument:
+                        pass
+        for i in range(0, len(flags), config['misc']['max_flags_per_submission']):
+            try:
+                services.submissionService.submitFlags(team['token'],
+                                                       flags[i:i + config['misc']['max_flags_per_submission']])
+            except (RateLimitExceeded, OutOfTimeWindow):
+                pass
+            clock.sleep(services.submissionService.rateLimitSeconds)
+
+
+@mongomock.patch(servers=(('mock.mongodb.com', 27017),))
+def simulate(n_teams: int, n_services: int, n_rounds: int, round_time: int, speed: float, milestones: list):
+    # the game starts at the next second of the simulated clock, to not lose time waiting for it
+    start = int(time.time()) + 1
+    config = make_config(n_teams, n_services, start_time=start, end_time=start + n_rounds * round_time,
+                         round_time=round_time, checker=STUB_CHECKER)
+    clock = SimulatedClock(start=start - 0.5, speed=speed)
+    project_utils.init_or_resume_mongo(config)
+    db, _ = get_db_manager(config['mongo'])
+    real_start = time.perf_counter()
+    services = Services(config, clock)
+    stop = threading.Event()
+    attackers = [threading.Thread(target=attacker, args=(services, config, team, stop)) for team in config['teams']]
+    for thread in attackers:
+        thread.start()
+    print(f"{'round':>8}{'real s':>10}{'rounds/s':>10}{'team KB':>12}{'flag KB':>12}{'scoreboard ms':>15}")
+    milestones = sorted(set(m for m in milestones if m <= n_rounds))
+    while len(milestones) > 0 and services.checkScheduler.is_alive():
+        if services.checkScheduler.roundNum < milestones[0]:
+            time.sleep(0.01)
+            continue
+        round_num = services.checkScheduler.roundNum
+        milestones.pop(0)
+        elapsed = time.perf_counter() - real_start
+        build_start = time.perf_counter()
+        services.scoreboardCache.getTeams()
+        build_ms = (time.perf_counter() - build_start) * 1000
+        size = db_size(db)
+        print(f"{round_num:>8}{elapsed:>10.1f}{round_num / elapsed:>10.2f}{size['team'] / 1024:>12.1f}"
+              f"{size['flag'] / 1024:>12.1f}{build_ms:>15.2f}")
+    services.checkScheduler.join()
+    stop.set()
+    for thread in attackers:
+        thread.join()
+    services.stop()
+    print(f"Simulated {services.checkScheduler.roundNum} rounds in {time.perf_counter() - real_start:.1f}s")
+
+
+def main():
+    args_parser = argparse.ArgumentParser(description="Simulation of a whole game with a virtual clock")
+    args_parser.add_argument("--teams", type=int, default=10)
+    args_parser.add_argument("--services", type=int, default=4)
+    args_parser.add_argument("--rounds", type=int, default=100)
+    args_parser.add_argument("--round-time", type=int, default=60)
+    args_parser.add_argument("--speed", type=float, default=300)
+    args_parser.add_argument("--milestones", type=int, nargs="*", default=[10, 50, 100, 250, 500])
+    args = args_parser.parse_args()
+    simulate(args.teams, args.services, args.rounds, args.round_time, args.speed, args.milestones)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+import mongomock
+import argparse
+import random
+import threading
+import time
+
+import project_utils
+from event_queue import EventQueue
+from event_dispatcher import EventDispatcher
+from submission_service import SubmissionService, RateLimitExceeded
+from scoreboard_cache import ScoreboardCache
+from mongo_utils import get_db_manager, insert_flag
+from checker_lib import gen_flag, gen_seed
+from bench_utils import make_config, summarize, print_report, save_baseline, compare_with_baseline
+
+"""
+Load test of the full submission and scoreboard path: each simulated team submits, as fast as the rate limit allows,
+a realistic mix of valid, duplicate, old, self and garbage flags through SubmissionService.submitFlags, while some
+pollers read the scoreboard through ScoreboardCache.getStats, and the EventDispatcher updates the points.
+Usage: python bench_submission.py [--teams N] [--services N] [--duration S] [--pollers N] [--save-baseline]
+"""
+
+BENCHMARK_NAME = "submission"
+ROUND_NUM = 10
+# fractions of each submission; the remaining ones are garbage
+VALID_FRACTION = 0.4
+OLD_FRACTION = 0.15
+SELF_FRACTION = 0.1
+
+
+class MockCheckScheduler:
+    # the submission service only needs the current round number from the scheduler
+    def __init__(self, round_num, flag_lifetime):
+        self.roundNum = round_num
+        self.flagLifetime = flag_lifetime
+
+
+def prepare_flags(db, config):
+    # mapping: {team_id: {"live": [...], "old": [...]}}
+    misc = config['misc']
+    flags = {team['id']: {"live": [], "old": []} for team in config['teams']}
+    for round_num in range(ROUND_NUM - misc['flag_lifetime'] - 2, ROUND_NUM + 1):
+        kind = "live" if round_num >= ROUND_NUM - misc['flag_lifetime'] else "old"
+        for team in config['teams']:
+            for service in config['services']:
+                flag = gen_flag(misc['flag_header'], misc['flag_body_len'])
+                insert_flag(db, flag, gen_seed(), round_num, team['id'], service['id'])
+                flags[team['id']][kind].append(flag)
+    return flags
+
+
+def make_submission(team_id: int, flags: dict, config: dict):
+    misc = config['misc']
+    others = [t for t in flags.keys() if t != team_id]
+    submission = []
+    for _ in range(misc['max_flags_per_submission']):
+        r = random.random()
+        if r < VALID_FRACTION:
+            # valid flags are submitted more times by the same team, so some of them are duplicates
+            submission.append(random.choice(flags[random.choice(others)]['live']))
+        elif r < VALID_FRACTION + OLD_FRACTION:
+            submission.append(random.choice(flags[random.choice(others)]['old']))
+        elif r < VALID_FRACTION + OLD_FRACTION + SELF_FRACTION:
+            submission.append(random.choice(flags[team_id]['live']))
+        elif random.random() < 0.5:
+            # matches the flag regex, but it doesn't exist
+            submission.append(gen_flag(misc['flag_header'], misc['flag_body_len']))
+        else:
+            submission.append("garbage" + gen_seed())
+    return submission
+
+
+@mongomock.patch(servers=(('mock.mongodb.com', 27017),))
+def run(n_teams: int, n_services: int, duration: float, n_pollers: int):
+    now = time.time()
+    config = make_config(n_teams, n_services, start_time=now - 1, end_time=now + 3600)
+    config['misc']['rate_limit_seconds'] = 0.1
+    config['misc']['scoreboard_cache_update_latency'] = 1
+    config['misc']['dispatch_max_delay'] = 0.5
+    project_utils.init_or_resume_mongo(config)
+    db, _ = get_db_manager(config['mongo'])
+    flags = prepare_flags(db, config)
+    eventQueue = EventQueue()
+    eventDispatcher = EventDispatcher(eventQueue, config)
+    eventDispatcher.start()
+    submissionService = SubmissionService(eventQueue, config,
+                                          MockCheckScheduler(ROUND_NUM, config['misc']['flag_lifetime']))
+    scoreboardCache = ScoreboardCache(config)
+    mutex = threading.Lock()
+    submission_latencies, poll_latencies = [], []
+    verdicts = {}
+    stop = threading.Event()
+
+    def submitter(team):
+        latencies, local_verdicts = [], {}
+        while not stop.is_set():
+            submission = make_submission(team['id'], flags, config)
+            start = time.perf_counter()
+            try:
+                msg = submissionService.submitFlags(team['token'], submission)
+            except RateLimitExceeded:
+                msg = {"rate_limited": 1}
+            latencies.append(time.perf_counter() - start)
+            for verdict, count in msg.items():
+                local_verdicts[verdict] = local_verdicts.get(verdict, 0) + count
+            time.sleep(submissionService.rateLimitSeconds)
+        with mutex:
+            submission_latencies.extend(latencies)
+            for verdict, count in local_verdicts.items():
+                verdicts[verdict] = verdicts.get(verdict, 0) + count
+
+    def poller():
+        latencies = []
+        while not stop.is_set():
+            start = time.perf_counter()
+            scoreboardCache.getStats()
+            latencies.append(time.perf_counter() - start)
+            time.sleep(0.01)
+        with mutex:
+            poll_latencies.extend(latencies)
+
+    threads = [threading.Thread(target=submitter, args=(team,)) for team in config['teams']]
+    threads += [threading.Thread(target=poller) for _ in range(n_pollers)]
+    for thread in threads:
+        thread.start()
+    time.sleep(duration)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    eventDispatcher.stopped = True
+    eventDispatcher.join()
+    submitted_flags = sum(v for k, v in verdicts.items() if k.startswith("num_") and k != "num_discarded")
+    results = {"submitFlags": summarize(submission_latencies, duration),
+               "getStats": summarize(poll_latencies, duration)}
+    return results, verdicts, submitted_flags / duration
+
+
+def main():
+    args_parser = argparse.ArgumentParser(description="Load test of flag submission and scoreboard")
+    args_parser.add_argument("--teams", type=int, default=20)
+    args_parser.add_argument("--services", type=int, default=5)
+    args_parser.add_argument("--duration", type=float, default=10)
+    args_parser.add_argument("--pollers", type=int, default=4)
+    args_parser.add_argument("--save-baseline", action="store_true")
+    args = args_parser.parse_args()
+    results, verdicts, flags_per_second = run(args.teams, args.services, args.duration, args.pollers)
+    print_report(f"Submission and scoreboard, {args.teams} teams x {args.services} services, "
+                 f"{args.pollers} pollers, {args.duration}s", results)
+    print(f"Checked flags per second: {flags_per_second:.1f}")
+    print(f"Verdicts: {verdicts}")
+    # baselines are stored per configuration, because they are not comparable among different ones
+    benchmark = f"{BENCHMARK_NAME}_{args.teams}x{args.services}_{args.pollers}p"
+    if args.save_baseline:
+        save_baseline(benchmark, results)
+        print(f"Baseline stored for {benchmark}")
+    else:
+        compare_with_baseline(benchmark, results)
+
+
+if __name__ == "__main__":
+    main()
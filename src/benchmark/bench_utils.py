@@ -0,0 +1,114 @@
+import datetime
+import json
+import math
+import os
+import uuid
+
+
+def to_time_str(timestamp: float):
+    fmt = "%d %b %Y %H:%M:%S"
+    return datetime.datetime.fromtimestamp(timestamp).strftime(fmt)
+
+
+def make_config(n_teams: int, n_services: int, start_time: float, end_time: float, round_time: int = 120,
+                checker: str = "volume/example/example_checker_0.py"):
+    teams = [{"id": i, "host": f"10.0.{i // 250}.{i % 250 + 1}", "name": f"team_{i}", "token": uuid.uuid4().hex}
+             for i in range(n_teams)]
+    services = [{"id": i, "port": 7331 + i, "name": f"service_{i}", "checker": checker}
+                for i in range(n_services)]
+    return {
+        "teams": teams,
+        "services": services,
+        "mongo": {
+            "hostname": "mock.mongodb.com", "port": 27017, "db_name": "ad_kihon", "user": "admin", "password": "admin"
+        },
+        "flask": {
+            "port": 8080
+        },
+        "misc": {
+            "start_time": to_time_str(start_time),
+            "end_time": to_time_str(end_time),
+            "round_time": round_time,
+            "flag_lifetime": 5,
+            "atk_weight": 10,
+            "def_weight": 10,
+            "sla_weight": 80,
+            "flag_header": "flag",
+            "flag_body_len": 30,
+            "rate_limit_seconds": 5,
+            "max_flags_per_submission": 20,
+            "scoreboard_cache_update_latency": 5,
+            "base_score": 1000,
+            "dispatch_max_delay": 0.1
+        }
+    }
+
+
+def percentile(sorted_values: list, p: float):
+    # nearest-rank percentile, values must be already sorted
+    if len(sorted_values) == 0:
+        return 0
+    rank = max(int(math.ceil(p / 100 * len(sorted_values))) - 1, 0)
+    return sorted_values[rank]
+
+
+def summarize(latencies: list, duration: float):
+    # latencies are in seconds, the summary in milliseconds and operations per second
+    latencies = sorted(latencies)
+    return {"count": len(latencies),
+            "throughput": len(latencies) / duration if duration > 0 else 0,
+            "p50_ms": percentile(latencies, 50) * 1000,
+            "p99_ms": percentile(latencies, 99) * 1000,
+            "max_ms": latencies[-1] * 1000 if len(latencies) > 0 else 0}
+
+
+def print_report(title: str, results: dict):
+    # results: {case_name: summary}
+    print(f"## {title}")
+    print(f"{'case':<40}{'count':>10}{'ops/s':>12}{'p50 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for name, summary in results.items():
+        print(f"{name:<40}{summary['count']:>10}{summary['throughput']:>12.1f}"
+              f"{summary['p50_ms']:>10.2f}{summary['p99_ms']:>10.2f}{summary['max_ms']:>10.2f}")
+
+
+BASELINES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines.json")
+# a case regresses if its p99 latency grows, or its throughput drops, by more than this fraction;
+# p99 growths below the absolute tolerance are ignored, because they're noise for cached operations
+REGRESSION_THRESHOLD = 0.2
+REGRESSION_TOLERANCE_MS = 1
+
+
+def load_baselines():
+    if not os.path.exists(BASELINES_PATH):
+        return {}
+    with open(BASELINES_PATH, 'r') as f:
+        return json.load(f)
+
+
+def save_baseline(benchmark: str, results: dict):
+    baselines = load_baselines()
+    baselines[benchmark] = results
+    with open(BASELINES_PATH, 'w') as f:
+        json.dump(baselines, f, indent=2, sort_keys=True)
+
+
+def compare_with_baseline(benchmark: str, results: dict):
+    # prints the relative change of each case with respect to the stored baseline and returns the regressed cases
+    baseline = load_baselines().get(benchmark)
+    if baseline is None:
+        print(f"No baseline stored for {benchmark}: run again with --save-baseline to store one")
+        return []
+    regressions = []
+    print(f"## Comparison with baseline ({benchmark})")
+    for name, summary in results.items():
+        if name not in baseline:
+            continue
+        old = baseline[name]
+        throughput_delta = (summary['throughput'] - old['throughput']) / old['throughput'] if old['throughput'] else 0
+        p99_delta = (summary['p99_ms'] - old['p99_ms']) / old['p99_ms'] if old['p99_ms'] else 0
+        p99_regressed = p99_delta > REGRESSION_THRESHOLD and summary['p99_ms'] - old['p99_ms'] > REGRESSION_TOLERANCE_MS
+        regressed = throughput_delta < -REGRESSION_THRESHOLD or p99_regressed
+        if regressed:
+            regressions.append(name)
+        print(f"{name:<40}ops/s {throughput_delta:+8.1%}   p99 {p99_delta:+8.1%}{'   REGRESSION' if regressed else ''}")
+    return regressions
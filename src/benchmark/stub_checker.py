@@ -0,0 +1,31 @@
+import random
+import time
+
+from checker import AbstractChecker
+from checker_lib import *
+
+
+# stub checker for simulations: no network, a small latency and mostly OK results
+LATENCY = 0.001
+OK_PROBABILITY = 0.9
+
+
+class Checker(AbstractChecker):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+    @staticmethod
+    def result():
+        time.sleep(LATENCY)
+        if random.random() < OK_PROBABILITY:
+            return OK
+        return random.choice([MUMBLE, CORRUPT, DOWN])
+
+    def check(self):
+        return self.result()
+
+    def put(self, flag_data: str, seed: str):
+        return self.result()
+
+    def get(self, flag_data: str, seed: str):
+        return self.result()
@@ -0,0 +1,112 @@
+import threading
+import queue
+import time
+
+from mongo_utils import get_db_manager, push_checks
+from project_utils import log
+from game_clock import Clock, REAL_CLOCK
+import metrics
+
+
+CHECK_FLUSH_SECONDS = metrics.histogram("adkihon_check_flush_seconds", "Latency of the batched writes of checks")
+CHECK_FLUSH_SIZE = metrics.histogram("adkihon_check_flush_size", "Number of checks persisted by each batched write",
+                                     buckets=metrics.SIZE_BUCKETS)
+CHECK_FLUSH_FAILURES = metrics.counter("adkihon_check_flush_failures_total",
+                                       "Batched writes of checks which failed and will be retried")
+# the delay between the retries of a failed write doubles at each failure, up to this value (in seconds)
+MAX_RETRY_DELAY = 30
+
+
+class CheckBuffer(threading.Thread):
+    # write-behind buffer for checkers' results: checker threads only enqueue their check,
+    # and this thread persists the pending checks with a single batched write every flushInterval
+    # seconds, or as soon as flushSize checks are pending; the buffer is bounded, so if the DB
+    # is slower than the checkers, checker threads block on push instead of growing memory.
+    # The SLA points of the checks are already counted by the dispatcher, so a batch which can't be written
+    # is never dropped: it's retried with an exponential backoff, before draining new checks from the buffer
+    def __init__(self, config: dict, clock: Clock = REAL_CLOCK):
+        super().__init__(daemon=True)
+        self.clock = clock
+        _, mongo_client = get_db_manager(config['mongo'])
+        self.mongoClient = mongo_client
+        self.mongoConfig = config['mongo']
+        self.flushInterval = config['misc'].get('check_flush_interval', 1)
+        self.flushSize = config['misc'].get('check_flush_size', 100)
+        self.buffer = queue.Queue(maxsize=config['misc'].get('check_buffer_size', 10000))
+        self.sizeReached = threading.Event()
+        # this mutex is to make sure that a flush on stop doesn't overlap with a periodic one
+        self.flushMutex = threading.Lock()
+        self.stopped = False
+        # checks drained from the buffer whose write failed, and when it can be retried
+        self.pending = []
+        self.retryDelay = 0
+        self.nextRetry = 0
+        # metrics: last and max flush latency in seconds, number of flushes and of persisted checks
+        self.flushLatency = 0
+        self.maxFlushLatency = 0
+        self.numFlushes = 0
+        self.numFlushedChecks = 0
+        metrics.gauge_func("adkihon_check_buffer_depth", "Checks waiting to be persisted", self.depth)
+
+    def push(self, team_id: int, service_id: int, status: str, timestamp: int):
+        self.buffer.put({"team_id": team_id, "service_id": service_id, "status": status, "timestamp": timestamp})
+        if self.stopped:
+            # late checker thread, completed after stop: nobody else will flush its check
+            self.flush(force=True)
+        elif self.buffer.qsize() >= self.flushSize:
+            self.sizeReached.set()
+
+    def depth(self):
+        return self.buffer.qsize()
+
+    def flush(self, force: bool = False):
+        # force: retry a failed write without waiting for the backoff, e.g. on stop
+        with self.flushMutex:
+            if len(self.pending) == 0:
+                while True:
+                    try:
+                        self.pending.append(self.buffer.get(block=False))
+                    except queue.Empty:
+                        break
+            elif not force and self.clock.time() < self.nextRetry:
+                return 0
+            checks = self.pending
+            if len(checks) == 0:
+                return 0
+            start = time.perf_counter()
+            db, _ = get_db_manager(self.mongoConfig, self.mongoClient)
+            try:
+                self.pending = push_checks(db, checks)
+            except Exception as e:
+                log(f"Error: failed to persist {len(checks)} checks: {e.__class__.__name__} {str(e)}")
+            if len(self.pending) > 0:
+                CHECK_FLUSH_FAILURES.inc()
+                self.retryDelay = min(max(2 * self.retryDelay, self.flushInterval), MAX_RETRY_DELAY)
+                self.nextRetry = self.clock.time() + self.retryDelay
+                log(f"Error: {len(self.pending)} checks not persisted, retrying in {self.retryDelay} s")
+                return len(checks) - len(self.pending)
+            self.retryDelay = 0
+            self.flushLatency = time.perf_counter() - start
+            self.maxFlushLatency = max(self.maxFlushLatency, self.flushLatency)
+            self.numFlushes += 1
+            self.numFlushedChecks += len(checks)
+            CHECK_FLUSH_SECONDS.observe(self.flushLatency)
+            CHECK_FLUSH_SIZE.observe(len(checks))
+        return len(checks)
+
+    def run(self) -> None:
+        while not self.stopped:
+            self.clock.wait(self.sizeReached, self.flushInterval)
+            self.sizeReached.clear()
+            self.flush()
+
+    def stop(self):
+        self.stopped = True
+        self.sizeReached.set()
+        if self.is_alive():
+            self.join()
+        # a failed batch is retried before the checks still in the buffer
+        self.flush(force=True)
+        self.flush(force=True)
+        if len(self.pending) > 0 or self.depth() > 0:
+            log(f"Error: {len(self.pending) + self.depth()} checks not persisted on stop")
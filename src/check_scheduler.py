@@ -1,16 +1,35 @@
+import sys
 import threading
 from dateutil import parser
 import datetime
 from importlib import import_module
-import random
 import time
-import schedule
 import math
 
-from event_queue import EventQueue, EVENT_CHECK
-from mongo_utils import get_db_manager, push_check, insert_flag, get_flag_for_round, AlreadyExistentFlagOrSeed, NotExistentDocument
+from event_queue import EventQueue, check_event, decode_events, STATUS_NAMES
+from check_buffer import CheckBuffer
+from stagger_planner import StaggerPlanner
+from checker_tracer import CheckerTracer
+from job_broker import JobBroker, BrokerServer
+from checker_reloader import CheckerReloader
+from circuit_breaker import CircuitBreaker
+from round_tracker import RoundTracker, CheckCancelled
+from game_clock import Clock, REAL_CLOCK
+from mongo_utils import get_db_manager, insert_flags, get_flags_for_round, get_flags_for_rounds
 import checker_lib
 from project_utils import log
+import metrics
+
+
+CHECKER_ACTION_SECONDS = metrics.histogram("adkihon_checker_action_seconds",
+                                           "Latency of checkers' actions, by service and action", ("service", "action"))
+CHECKS = metrics.counter("adkihon_checks_total", "Outcome of checks, by service and status", ("service", "status"))
+ROUND_PREPARE_SECONDS = metrics.histogram("adkihon_round_prepare_seconds",
+                                          "Time to generate and store the flags of a round")
+FLAG_COLLISIONS = metrics.counter("adkihon_flag_collisions_total",
+                                  "Generated flags discarded because they already existed")
+# while waiting for the next round, the scheduler checks if it has been stopped at least this often (in game seconds)
+STOP_CHECK_INTERVAL = 1
 
 
 class InitSchedulerError(Exception):
@@ -18,9 +37,10 @@ class InitSchedulerError(Exception):
 
 
 class CheckScheduler(threading.Thread):
-    def __init__(self, eventQueue: EventQueue, config: dict):
+    def __init__(self, eventQueue: EventQueue, config: dict, clock: Clock = REAL_CLOCK):
         super().__init__()
         self.eventQueue = eventQueue
+        self.clock = clock
         self.roundNum = 0
         _, mongo_client = get_db_manager(config['mongo'])
         self.mongoClient = mongo_client
@@ -40,12 +60,40 @@ class CheckScheduler(threading.Thread):
         self.stopped = False
         self.teams = {team['id']: team for team in config['teams']}
         self.services = {service['id']: service for service in config['services']}
-        self.checkerMods = {service_id: import_module(self.filePathToModuleName(self.services[service_id]['checker']))
-                            for service_id in self.services.keys()}
+        moduleNames = {service_id: self.filePathToModuleName(service['checker'])
+                       for service_id, service in self.services.items()}
+        self.checkerMods = {service_id: import_module(moduleNames[service_id]) for service_id in self.services.keys()}
         self.checkers = {team_id: {service_id: self.checkerMods[service_id].Checker(
                 team=self.teams[team_id],
                 service=self.services[service_id])
                 for service_id in self.services.keys()} for team_id in self.teams.keys()}
+        self.checkBuffer = CheckBuffer(config, clock)
+        self.reloader = CheckerReloader(config, self.teams, self.services, moduleNames, clock)
+        self.planner = StaggerPlanner(config, self.teams, self.services)
+        self.tracer = CheckerTracer(config, clock)
+        self.breaker = CircuitBreaker(config, self.services, clock)
+        self.tracker = RoundTracker(config, clock)
+        self.warmUpEnabled = config['misc'].get('checker_warm_up', True)
+        # checkers run in threads of this process or, if a broker is configured, in external workers
+        # (see checker_worker.py), which lease the jobs published by the scheduler and return their results
+        misc = config['misc']
+        self.broker = JobBroker(misc['checker_broker'], misc.get('checker_lease_seconds', 30),
+                                misc.get('checker_max_attempts', 3)) if misc.get('checker_broker') else None
+        self.brokerAddress = (misc.get('checker_broker_host', '127.0.0.1'), misc.get('checker_broker_port'))
+        # the jobs contain the flags: the workers which connect through TCP must know the shared secret
+        self.brokerSecret = misc.get('checker_broker_secret')
+        if self.broker is not None and self.brokerAddress[1] is not None and not self.brokerSecret:
+            log("Error: checker_broker_secret is required when checker_broker_port is set")
+            raise InitSchedulerError
+        self.collectInterval = misc.get('checker_collect_interval', 1)
+        # if enabled, the flags of the next round are generated and stored while the current one is running,
+        # so that its checkers can be started right on the round boundary
+        self.prepareAhead = config['misc'].get('prepare_next_round', False)
+        self.preparedFlags = {}
+        self.preparer = None
+        # sliding window with the flags of the last (flag lifetime + 1) rounds, which are the ones still checked:
+        # {round_num: {(team_id, service_id): (flag, seed)}}; it's loaded from the DB at the first scheduling
+        self.recentFlags = None
 
     @staticmethod
     def filePathToModuleName(checkerPath: str):
@@ -53,106 +101,273 @@ class CheckScheduler(threading.Thread):
         checkerPath = checkerPath.replace('/', '.')
         return checkerPath
 
-    @staticmethod
-    def runChecker(eventQueue: EventQueue, mongoConfig, mongoClient, checker, flag, seed, roundTime, isPrevious=False):
-        timeSlice = roundTime // 3
-        event = {"type": EVENT_CHECK, "status": "unset", "team": checker.team['id'], "service": checker.service['id']}
-        db, _ = get_db_manager(mongoConfig, mongoClient)
+    def reportCheck(self, team_id: int, service_id: int, status: str):
+        timestamp = int(self.clock.time())
+        try:
+            self.eventQueue.put(check_event(team_id, service_id, status, timestamp))
+        except KeyError:
+            log(f"Error: {status} is an invalid status, returned by the checker of service {service_id}")
+        CHECKS.inc(service=self.services[service_id]['name'], status=status)
+        # the check is persisted by the write-behind buffer, to not make each checker thread wait for the DB
+        self.checkBuffer.push(team_id, service_id, status, timestamp)
+
+    def applyReloads(self):
+        # swaps the checkers reloaded by the CheckerReloader, all at once, so that a round never mixes the
+        # old and the new version of a checker; checker threads still running keep the old instances
+        reloaded = self.reloader.takePending()
+        if len(reloaded) == 0:
+            return
+        checkers = {team_id: dict(teamCheckers) for team_id, teamCheckers in self.checkers.items()}
+        for service_id, (module, serviceCheckers) in reloaded.items():
+            self.checkerMods[service_id] = module
+            sys.modules[module.__name__] = module
+            for team_id, checker in serviceCheckers.items():
+                checkers[team_id][service_id] = checker
+        self.checkers = checkers
+        log(f"Reloaded checkers of services {sorted(reloaded.keys())} for round {self.roundNum}")
+
+    def jobPayload(self, team_id: int, service_id: int, flag: str, seed: str, flagRound: int, plan: dict,
+                   isPrevious: bool):
+        # the plan is sent as offsets in real seconds from the publication, because workers use the real clock
+        now = self.clock.time()
+        return {"team": {k: v for k, v in self.teams[team_id].items() if k != 'token'},
+                "service": self.services[service_id], "flag": flag, "seed": seed, "round_num": self.roundNum,
+                "flag_round": flagRound, "is_previous": isPrevious, "published": time.time(),
+                "plan": {action: self.clock.realSeconds(start - now) for action, start in plan.items()}}
+
+    def collectResults(self):
+        # reports the results of the jobs completed by the workers, and of the ones failed after all the attempts
+        # or not completed before the end of their round
+        while True:
+            try:
+                jobs = self.broker.collect()
+            except Exception as e:
+                log(f"Error: collection of checkers' results failed: {e.__class__.__name__} {str(e)}")
+                jobs = []
+            for _, payload, result in jobs:
+                team_id, service_id = payload['team']['id'], payload['service']['id']
+                self.tracker.jobDone(payload['round_num'])
+                if result is None:
+                    log(f"Error: job of round {payload['round_num']} for team {team_id}, service {service_id} "
+                        f"failed after {self.broker.maxAttempts} attempts, or not completed before the round's end")
+                    self.reportCheck(team_id, service_id, checker_lib.ERROR)
+                    continue
+                for action, start, duration, res, exception in result['actions']:
+                    self.tracer.record(payload['round_num'], team_id, service_id, action, start, duration, res,
+                                       exception)
+                # the outcome is the check event of the job, encoded by the worker (see CheckerWorker.runJob)
+                try:
+                    event, = decode_events(bytes.fromhex(result['event']))
+                    status = STATUS_NAMES[event.status]
+                except Exception as e:
+                    log(f"Error: invalid result of the job for team {team_id}, service {service_id}: "
+                        f"{e.__class__.__name__} {str(e)}")
+                    status = checker_lib.ERROR
+                self.reportCheck(team_id, service_id, status)
+            self.clock.sleep(self.collectInterval)
+
+    def runAction(self, checker, action: str, roundNum: int, flagRound: int, planned: float, *args):
+        # waits for the planned start of the action, then runs it as soon as the team host and the service
+        # have a free slot (see StaggerPlanner); if meanwhile the flag has expired, the check is cancelled
+        self.clock.sleep(planned - self.clock.time())
+        with self.planner.slot(roundNum, checker.team['id'], checker.service['id'], flagRound, action, planned,
+                               self.clock):
+            self.tracker.checkNotExpired(flagRound, checker.service)
+            with CHECKER_ACTION_SECONDS.time(service=checker.service['name'], action=action):
+                return self.tracer.trace(roundNum, checker.team['id'], checker.service['id'], action,
+                                         getattr(checker, action), *args)
+
+    def runChecker(self, checker, flag, seed, roundNum, flagRound, plan, isPrevious=False):
+        # plan: planned start time of each action, {action: timestamp}
+        team_id, service_id = checker.team['id'], checker.service['id']
+        # the check of the new flag is the probe of the circuit breaker
+        isProbe = not isPrevious
         try:
-            res = checker.check()
+            # the breaker is evaluated at the planned start, when other checks of the round may have completed
+            self.clock.sleep(plan["check"] - self.clock.time())
+            if self.breaker.shouldSkip(roundNum, team_id, service_id, isProbe):
+                if isProbe:
+                    self.breaker.endProbe(roundNum, team_id, service_id)
+                self.reportCheck(team_id, service_id, checker_lib.DOWN)
+                return
+            try:
+                res = self.runAction(checker, "check", roundNum, flagRound, plan["check"])
+                self.breaker.recordCheck(roundNum, team_id, service_id, res)
+            finally:
+                if isProbe:
+                    self.breaker.endProbe(roundNum, team_id, service_id)
             if res != checker_lib.OK:
-                timestamp = int(time.time())
-                event['status'] = res
-                event['timestamp'] = timestamp
-                eventQueue.put(event)
-                push_check(db, checker.team['id'], checker.service['id'], res, timestamp)
+                self.reportCheck(team_id, service_id, res)
                 return
             if not isPrevious:
-                time.sleep(random.randint(0, timeSlice))
-                res = checker.put(flag, seed)
+                res = self.runAction(checker, "put", roundNum, flagRound, plan["put"], flag, seed)
                 if res != checker_lib.OK:
-                    timestamp = int(time.time())
-                    event['status'] = res
-                    event['timestamp'] = timestamp
-                    eventQueue.put(event)
-                    push_check(db, checker.team['id'], checker.service['id'], res, timestamp)
+                    self.reportCheck(team_id, service_id, res)
                     return
-            time.sleep(random.randint(0, timeSlice))
-            res = checker.get(flag, seed)
-            timestamp = int(time.time())
-            event['status'] = res
-            event['timestamp'] = timestamp
-            eventQueue.put(event)
-            push_check(db, checker.team['id'], checker.service['id'], res, timestamp)
+            res = self.runAction(checker, "get", roundNum, flagRound, plan["get"], flag, seed)
+            self.reportCheck(team_id, service_id, res)
+        except CheckCancelled:
+            # the flag has expired, so the result of the late check would not be meaningful
+            pass
         except:
-            timestamp = int(time.time())
-            event['status'] = checker_lib.ERROR
-            event['timestamp'] = timestamp
-            eventQueue.put(event)
-            push_check(db, checker.team['id'], checker.service['id'], checker_lib.ERROR, timestamp)
+            self.reportCheck(team_id, service_id, checker_lib.ERROR)
+        finally:
+            self.tracker.jobDone(roundNum)
+
+    def warmUp(self):
+        # resolves the teams' hosts and calls the warmUp of each checker in parallel, so that the first round
+        # doesn't pay the setup of the connections; errors are only logged, the checks will report them
+        start = time.perf_counter()
+        checker_lib.CheckerUtils().warmUp(set(team['host'] for team in self.teams.values()))
+
+        def warmUpChecker(checker):
+            try:
+                checker.warmUp()
+            except Exception as e:
+                log(f"Warning: warm-up of checker {checker.service['name']} for team {checker.team['name']} failed: "
+                    f"{e.__class__.__name__} {str(e)}")
+        threads = [threading.Thread(target=warmUpChecker, args=(checker,), daemon=True)
+                   for services in self.checkers.values() for checker in services.values()
+                   if hasattr(checker, "warmUp")]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        log(f"Warm-up of {len(threads)} checkers completed in {time.perf_counter() - start:.2f} s")
+
+    def prepareRound(self, roundNum: int):
+        # generates and stores the flags of all teams and services for a round, with a single insert;
+        # it returns the mapping: {(team_id, service_id): (flag, seed)}
+        # flags already stored for the round (prepared in advance, or before a resume) are reused
+        with ROUND_PREPARE_SECONDS.time():
+            db, _ = get_db_manager(self.mongoConfig, self.mongoClient)
+            flags = {(f['team_id'], f['service_id']): (f['flag_data'], f['seed'])
+                     for f in get_flags_for_round(db, roundNum)}
+            missing = [(team_id, service_id) for team_id in self.teams for service_id in self.services
+                       if (team_id, service_id) not in flags]
+            # only the flags that collide with existing ones are generated and inserted again
+            while len(missing) > 0:
+                flag_data = checker_lib.gen_flags(len(missing), self.flagHeader, self.flagBodyLen)
+                seeds = checker_lib.gen_seeds(len(missing))
+                collisions = set(insert_flags(db, [{"flag_data": flag_data[i], "seed": seeds[i], "round_num": roundNum,
+                                                    "team_id": team_id, "service_id": service_id}
+                                                   for i, (team_id, service_id) in enumerate(missing)]))
+                FLAG_COLLISIONS.inc(len(collisions))
+                for i, key in enumerate(missing):
+                    if i not in collisions:
+                        flags[key] = (flag_data[i], seeds[i])
+                missing = [missing[i] for i in sorted(collisions)]
+            return flags
+
+    def prepareNextRound(self, roundNum: int):
+        try:
+            self.preparedFlags[roundNum] = self.prepareRound(roundNum)
+        except Exception as e:
+            # the round will be prepared when it starts
+            log(f"Error: preparation of round {roundNum} failed: {e}")
+
+    def loadRecentFlags(self):
+        # rebuilds the window of recent flags with a single query, e.g. after a resume
+        db, _ = get_db_manager(self.mongoConfig, self.mongoClient)
+        self.recentFlags = {}
+        for f in get_flags_for_rounds(db, self.roundNum - self.flagLifetime, self.roundNum - 1):
+            self.recentFlags.setdefault(f['round_num'], {})[(f['team_id'], f['service_id'])] = (f['flag_data'], f['seed'])
 
     def checkerScheduling(self):
         self.roundNum += 1
-        log(f"Starting checkers' scheduling for round number: {self.roundNum}, time: {time.time()}")
-        db, _ = get_db_manager(self.mongoConfig, self.mongoClient)
-        for team_id in self.teams:
-            for service_id in self.services:
-                while True:
-                    try:
-                        flag = checker_lib.gen_flag(self.flagHeader, self.flagBodyLen)
-                        seed = checker_lib.gen_seed()
-                        insert_flag(db, flag, seed, self.roundNum, team_id, service_id)
-                        break
-                    except AlreadyExistentFlagOrSeed:
-                        pass
-                checker = self.checkers[team_id][service_id]
-                checkerThread = threading.Thread(target=CheckScheduler.runChecker,
-                                                 args=(self.eventQueue, self.mongoConfig, self.mongoClient,
-                                                       checker, flag, seed, self.roundNum))
-                checkerThread.start()
+        log(f"Starting checkers' scheduling for round number: {self.roundNum}, time: {self.clock.time()}")
+        if self.recentFlags is None:
+            self.loadRecentFlags()
+        self.applyReloads()
+        if self.preparer is not None:
+            self.preparer.join()
+            self.preparer = None
+        flags = self.preparedFlags.pop(self.roundNum, None)
+        if flags is None:
+            flags = self.prepareRound(self.roundNum)
+        self.recentFlags[self.roundNum] = flags
+        for oldRound in [r for r in self.recentFlags if r < self.roundNum - self.flagLifetime]:
+            del self.recentFlags[oldRound]
+        if self.roundNum > 1:
+            self.planner.logSummary(self.roundNum - 1)
+            self.tracer.logSummary(self.roundNum - 1)
+        # jobs: (team_id, service_id, flag round, isPrevious)
+        jobs = [(team_id, service_id, self.roundNum, False) for team_id in self.teams for service_id in self.services]
         # a flag is valid for: (current round) + (flag lifetime rounds)
         for recentRound in range(self.roundNum - 1, self.roundNum - self.flagLifetime - 1, -1):
             if recentRound <= 0:
                 break
+            roundFlags = self.recentFlags.get(recentRound, {})
             for team_id in self.teams:
                 for service_id in self.services:
-                    try:
-                        flag_dict = get_flag_for_round(db, recentRound, team_id, service_id)
-                        flag, seed = flag_dict['flag_data'], flag_dict['seed']
-                        checker = self.checkers[team_id][service_id]
-                        checkerThread = threading.Thread(target=CheckScheduler.runChecker,
-                                                         args=(self.eventQueue, self.mongoConfig, self.mongoClient,
-                                                               checker, flag, seed, self.roundNum, True))
-                        checkerThread.start()
-                    except NotExistentDocument:
+                    if (team_id, service_id) not in roundFlags:
                         log(f"Error: flag for round {recentRound}, team {team_id} and service {service_id} doesn't exist")
-        log(f"Completed checkers' scheduling for round number: {self.roundNum}, time: {time.time()}")
+                        continue
+                    jobs.append((team_id, service_id, recentRound, True))
+        # the actions are spread over the first 2/3 of the round, so that the checks of a round are completed before
+        # the next one; the window can be shrunk by the RoundTracker, if the checks of the previous round were late
+        scale = self.tracker.startRound(self.roundNum, self.clock.time(), len(jobs))
+        window = 2 * self.roundTime / 3 * scale
+        plans = self.planner.plan(self.roundNum, jobs, self.clock.time(), window)
+        self.breaker.startRound(self.roundNum, list(set((team_id, service_id) for team_id, service_id, _, _ in jobs)))
+        if self.broker is not None:
+            # the jobs which are not completed within the round fail, instead of being reported in the next rounds
+            self.broker.publish([self.jobPayload(team_id, service_id, *self.recentFlags[flagRound][(team_id, service_id)],
+                                                 flagRound, plans[(team_id, service_id, flagRound)], isPrevious)
+                                 for team_id, service_id, flagRound, isPrevious in jobs],
+                                time.time() + self.clock.realSeconds(self.roundTime))
+            jobs = []
+        for team_id, service_id, flagRound, isPrevious in jobs:
+            flag, seed = self.recentFlags[flagRound][(team_id, service_id)]
+            checker = self.checkers[team_id][service_id]
+            checkerThread = threading.Thread(target=self.runChecker, args=(
+                checker, flag, seed, self.roundNum, flagRound, plans[(team_id, service_id, flagRound)], isPrevious))
+            checkerThread.start()
+        if self.prepareAhead and self.roundNum < self.maxRounds:
+            self.preparer = threading.Thread(target=self.prepareNextRound, args=(self.roundNum + 1,))
+            self.preparer.start()
+        log(f"Completed checkers' scheduling for round number: {self.roundNum}, time: {self.clock.time()}")
 
     def run(self) -> None:
-        # calling datetime.datetime.now() multiple times to ensure the check is right
-        if datetime.datetime.now() >= self.endTime:
+        self.checkBuffer.start()
+        self.tracer.start()
+        if self.reloader.interval > 0:
+            self.reloader.start()
+        if self.broker is not None:
+            threading.Thread(target=self.collectResults, daemon=True).start()
+            if self.brokerAddress[1] is not None:
+                BrokerServer(self.broker, *self.brokerAddress, self.brokerSecret).start()
+        now = self.clock.now()
+        if now >= self.endTime:
             log("Error: trying to start after end time")
             exit(1)
-        elif datetime.datetime.now() >= self.startTime:
+        elif now >= self.startTime:
             # resume; it works will if resume is done right after stop
             # if it is done later, it will do the scheduling such that the endTime is respected,
             # jumping over missed rounds; so, at the start it will trigger some exceptions
             # when grepping flags for old rounds
-            self.roundNum = int(math.floor((datetime.datetime.now() - self.startTime) / datetime.timedelta(seconds=self.roundTime)))
-            # wait until next round start
-            delay = (self.startTime + (self.roundNum + 1) * datetime.timedelta(seconds=self.roundTime)) - datetime.datetime.now()
-            time.sleep(delay.seconds)
+            self.roundNum = int(math.floor((now - self.startTime) / datetime.timedelta(seconds=self.roundTime)))
+            nextRoundStart = self.startTime + (self.roundNum + 1) * datetime.timedelta(seconds=self.roundTime)
         else:
-            delay = self.startTime - datetime.datetime.now()
-            time.sleep(delay.seconds)
-        schedule.every(self.roundTime).seconds.do(self.checkerScheduling)
+            nextRoundStart = self.startTime
+        if self.prepareAhead and self.roundNum < self.maxRounds:
+            self.prepareNextRound(self.roundNum + 1)
+        if self.warmUpEnabled and self.broker is None:
+            threading.Thread(target=self.warmUp, daemon=True).start()
+        # wait until next round start
+        self.clock.sleep((nextRoundStart - self.clock.now()).total_seconds())
+        # each round is scheduled one round time after the previous one (the first one after the wait);
+        # the schedule is anchored to the clock, so that the duration of the scheduling doesn't make rounds drift
+        nextRound = self.clock.time() + self.roundTime
         while self.roundNum < self.maxRounds:
-            schedule.run_pending()
             if self.stopped:
-                schedule.clear()
                 return
-        schedule.clear()
-
+            remaining = nextRound - self.clock.time()
+            if remaining > 0:
+                self.clock.sleep(min(remaining, STOP_CHECK_INTERVAL))
+                continue
+            self.checkerScheduling()
+            nextRound += self.roundTime
 
 if __name__ == "__main__":
     checker_mod_name = CheckScheduler.filePathToModuleName("volume/example/example_checker_0.py")
@@ -6,6 +6,10 @@ class AbstractChecker:
         self.team = team
         self.service = service
 
+    def warmUp(self):
+        # optional: called once before the first round, e.g. to open connections with CheckerUtils' pools
+        pass
+
     def check(self):
         raise NotImplementedError
 
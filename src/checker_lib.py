@@ -1,6 +1,12 @@
+import os
 import uuid
 import random
 import hashlib
+import socket
+import threading
+import functools
+import http.client
+from contextlib import contextmanager
 
 
 OK = "ok"
@@ -19,14 +25,143 @@ class Singleton(type):
         return cls._instances[cls]
 
 
+# data files of CheckerUtils, next to this module, so that they're found wherever the platform is installed
+DATA_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def read_lines(file_name):
+    with open(os.path.join(DATA_DIR, file_name), 'r') as f:
+        return [line for line in f.read().split('\n') if line != '']
+
+
+class HostResolver:
+    # caches the resolution of the teams' hosts, so that checkers don't query the DNS at each connection
+    def __init__(self):
+        self.addresses = {}
+        self.mutex = threading.Lock()
+
+    def resolve(self, host):
+        with self.mutex:
+            if host in self.addresses:
+                return self.addresses[host]
+        address = socket.getaddrinfo(host, None, type=socket.SOCK_STREAM)[0][4][0]
+        with self.mutex:
+            self.addresses[host] = address
+        return address
+
+
+class HTTPPool:
+    # keep-alive HTTP connections, kept idle between the calls of the checkers and keyed by (host, port);
+    # a connection is used by one request at a time, so concurrent checkers of the same team get different ones
+    STALE_ERRORS = (http.client.RemoteDisconnected, http.client.BadStatusLine, BrokenPipeError,
+                    ConnectionResetError, ConnectionAbortedError)
+
+    def __init__(self, resolver, maxIdle=8, timeout=10):
+        self.resolver = resolver
+        self.maxIdle = maxIdle
+        self.timeout = timeout
+        self.idle = {}
+        self.mutex = threading.Lock()
+
+    def acquire(self, host, port):
+        # returns an idle connection and True, or a new one and False
+        with self.mutex:
+            conns = self.idle.get((host, port))
+            if conns:
+                return conns.pop(), True
+        return http.client.HTTPConnection(self.resolver.resolve(host), port, timeout=self.timeout), False
+
+    def release(self, host, port, conn):
+        with self.mutex:
+            conns = self.idle.setdefault((host, port), [])
+            if len(conns) < self.maxIdle:
+                conns.append(conn)
+                return
+        conn.close()
+
+    def request(self, host, port, method, path, body=None, headers=None):
+        # returns (status, headers, body); the body is read completely, so that the connection can be reused
+        headers = dict(headers) if headers is not None else {}
+        headers.setdefault('Host', f"{host}:{port}")
+        while True:
+            conn, reused = self.acquire(host, port)
+            try:
+                conn.request(method, path, body=body, headers=headers)
+                response = conn.getresponse()
+                data = response.read()
+            except self.STALE_ERRORS:
+                conn.close()
+                # an idle connection may have been closed by the server: it's retried once with a new connection
+                if reused:
+                    continue
+                raise
+            except:
+                conn.close()
+                raise
+            if response.will_close:
+                conn.close()
+            else:
+                self.release(host, port, conn)
+            return response.status, dict(response.getheaders()), data
+
+    def close(self):
+        with self.mutex:
+            idle, self.idle = self.idle, {}
+        for conns in idle.values():
+            for conn in conns:
+                conn.close()
+
+
+class SocketPool:
+    # raw TCP connections to the teams' services, for line-based or binary protocols which keep the connection
+    # open between commands; keyed by (host, port), like HTTPPool
+    def __init__(self, resolver, maxIdle=8, timeout=10):
+        self.resolver = resolver
+        self.maxIdle = maxIdle
+        self.timeout = timeout
+        self.idle = {}
+        self.mutex = threading.Lock()
+
+    @contextmanager
+    def connection(self, host, port):
+        # the socket goes back to the pool only if the block completes without exceptions, otherwise it's closed,
+        # because it may be in the middle of an exchange; a socket which must not be reused can be closed
+        # in the block, and a closed socket is not pooled
+        with self.mutex:
+            socks = self.idle.get((host, port))
+            sock = socks.pop() if socks else None
+        if sock is None:
+            sock = socket.create_connection((self.resolver.resolve(host), port), timeout=self.timeout)
+        try:
+            yield sock
+        except:
+            sock.close()
+            raise
+        if sock.fileno() == -1:
+            return
+        with self.mutex:
+            socks = self.idle.setdefault((host, port), [])
+            if len(socks) < self.maxIdle:
+                socks.append(sock)
+                return
+        sock.close()
+
+    def close(self):
+        with self.mutex:
+            idle, self.idle = self.idle, {}
+        for socks in idle.values():
+            for sock in socks:
+                sock.close()
+
+
 class CheckerUtils(metaclass=Singleton):
     def __init__(self):
-        self.user_agents = None
-        with open('/usr/src/app/src/useragents.txt', 'r') as f:
-            self.user_agents = f.read().split('\n')
-        self.usernames = None
-        with open('/usr/src/app/src/usernames.txt', 'r') as f:
-            self.usernames = f.read().split('\n')
+        self.user_agents = read_lines('useragents.txt')
+        self.usernames = read_lines('usernames.txt')
+        # connections shared by all the checkers of the process
+        self.resolver = HostResolver()
+        self.http = HTTPPool(self.resolver)
+        self.sockets = SocketPool(self.resolver)
 
     def randomUserAgent(self):
         return random.choice(self.user_agents)
@@ -34,8 +169,24 @@ class CheckerUtils(metaclass=Singleton):
     def randomUsername(self):
         return random.choice(self.usernames)
 
+    def httpRequest(self, host, port, method, path, body=None, headers=None):
+        return self.http.request(host, port, method, path, body, headers)
+
+    def socketConnection(self, host, port):
+        return self.sockets.connection(host, port)
+
+    def warmUp(self, hosts):
+        # resolves the teams' hosts before the first round; unresolvable hosts are left to the checkers
+        for host in hosts:
+            try:
+                self.resolver.resolve(host)
+            except OSError:
+                pass
+
     @staticmethod
+    @functools.lru_cache(maxsize=4096)
     def credentialsFromSeed(seed, length=16):
+        # memoised, because the same seed is used for the put and all the gets of a flag
         seed = seed.encode()
         password = hashlib.sha256()
         password.update(seed)
@@ -64,3 +215,17 @@ def gen_flag(flag_header="flag", flag_body_len=32):
 
 def gen_seed():
     return uuid.uuid4().hex
+
+
+def gen_flags(n, flag_header="flag", flag_body_len=32):
+    # same pattern of gen_flag, but the bodies of all the n flags come from a single read of the OS CSPRNG
+    body_bytes = (flag_body_len + 1) // 2
+    data = os.urandom(n * body_bytes).hex()
+    step = 2 * body_bytes
+    return [flag_header + '{' + data[i * step:i * step + flag_body_len] + '}' for i in range(n)]
+
+
+def gen_seeds(n):
+    # same format of gen_seed (32 hex chars), from a single read of the OS CSPRNG
+    data = os.urandom(n * 16).hex()
+    return [data[i * 32:(i + 1) * 32] for i in range(n)]
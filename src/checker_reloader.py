@@ -0,0 +1,78 @@
+import importlib.util
+import os
+import threading
+
+from project_utils import log
+from game_clock import Clock, REAL_CLOCK
+import metrics
+
+
+CHECKER_RELOADS = metrics.counter("adkihon_checker_reloads_total", "Reloads of checkers, by service and outcome",
+                                  ("service", "outcome"))
+
+
+def load_checker_module(checkerPath: str, moduleName: str):
+    # executes the checker file in a new module object, so that if it fails the loaded module is untouched
+    spec = importlib.util.spec_from_file_location(moduleName, checkerPath)
+    if spec is None:
+        raise ImportError(f"{checkerPath} is not a Python module")
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    if not hasattr(module, "Checker"):
+        raise ImportError(f"{checkerPath} doesn't define a Checker class")
+    return module
+
+
+def file_version(path: str):
+    # the modification time of the file, or None if it doesn't exist (e.g. while it's being replaced)
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+class CheckerReloader(threading.Thread):
+    # watches the checkers' files in the volume and, when one of them changes, loads it again and instantiates
+    # its Checker for each team; the new checkers are only prepared here, the CheckScheduler swaps them
+    # between two rounds (see CheckScheduler.applyReloads). If the new version fails to load, the old one is kept
+    def __init__(self, config: dict, teams: dict, services: dict, moduleNames: dict, clock: Clock = REAL_CLOCK):
+        super().__init__(daemon=True)
+        self.clock = clock
+        self.interval = config['misc'].get('checker_reload_interval', 5)
+        self.teams = teams
+        self.services = services
+        self.moduleNames = moduleNames
+        self.versions = {service_id: file_version(service['checker']) for service_id, service in services.items()}
+        # prepared reloads: {service_id: (module, {team_id: checker})}
+        self.pending = {}
+        self.mutex = threading.Lock()
+        self.stopped = False
+
+    def poll(self):
+        for service_id, service in self.services.items():
+            version = file_version(service['checker'])
+            if version is None or version == self.versions[service_id]:
+                continue
+            self.versions[service_id] = version
+            try:
+                module = load_checker_module(service['checker'], self.moduleNames[service_id])
+                checkers = {team_id: module.Checker(team=team, service=service) for team_id, team in self.teams.items()}
+            except Exception as e:
+                log(f"Error: reload of checker {service['checker']} failed, the previous version is kept: "
+                    f"{e.__class__.__name__} {str(e)}")
+                CHECKER_RELOADS.inc(service=service['name'], outcome="failed")
+                continue
+            with self.mutex:
+                self.pending[service_id] = (module, checkers)
+            CHECKER_RELOADS.inc(service=service['name'], outcome="reloaded")
+            log(f"Checker {service['checker']} reloaded, it will be used from the next round")
+
+    def takePending(self):
+        with self.mutex:
+            pending, self.pending = self.pending, {}
+        return pending
+
+    def run(self) -> None:
+        while not self.stopped:
+            self.clock.sleep(self.interval)
+            self.poll()
@@ -0,0 +1,174 @@
+import collections
+import threading
+import time
+
+from mongo_utils import get_db_manager, create_trace_indexes, insert_traces, get_traces_for_round
+from project_utils import log
+from game_clock import Clock, REAL_CLOCK
+import metrics
+
+
+TRACE_FLUSH_SIZE = metrics.histogram("adkihon_trace_flush_size", "Number of traces persisted by each batched write",
+                                     buckets=metrics.SIZE_BUCKETS)
+# number of slowest actions in the summary of a round
+SUMMARY_SLOWEST = 3
+TRACE_FIELDS = ["team_id", "service_id", "action", "start", "duration", "result", "exception"]
+
+
+class CheckerTracer(threading.Thread):
+    # records each action of the checkers (check, put, get) with its duration and outcome: traces are kept
+    # in a bounded ring buffer, to answer queries on recent rounds without the DB, and they are persisted
+    # in the "trace" collection with a single batched write every flushInterval seconds, or as soon as
+    # flushSize traces are pending (like CheckBuffer does for checks). The statistics of each round are also
+    # updated in memory as the traces are recorded, and the summary of a round is logged by the tracer's thread
+    def __init__(self, config: dict, clock: Clock = REAL_CLOCK):
+        super().__init__(daemon=True)
+        self.clock = clock
+        _, mongo_client = get_db_manager(config['mongo'])
+        self.mongoClient = mongo_client
+        self.mongoConfig = config['mongo']
+        self.flushInterval = config['misc'].get('trace_flush_interval', 5)
+        self.flushSize = config['misc'].get('trace_flush_size', 500)
+        self.ring = collections.deque(maxlen=config['misc'].get('trace_buffer_size', 10000))
+        self.pending = []
+        # {round_num: summary}, see summary
+        self.rounds = {}
+        # rounds whose summary is to be logged
+        self.summaryRequests = []
+        self.mutex = threading.Lock()
+        self.flushMutex = threading.Lock()
+        self.wakeUp = threading.Event()
+        self.stopped = False
+
+    def record(self, round_num: int, team_id: int, service_id: int, action: str, start: float, duration: float,
+               result: str, exception: str = None):
+        trace = {"round_num": round_num, "team_id": team_id, "service_id": service_id, "action": action,
+                 "start": start, "duration": duration, "result": result, "exception": exception}
+        with self.mutex:
+            self.ring.append(trace)
+            self.pending.append(trace)
+            n_pending = len(self.pending)
+            self.count(trace)
+        if self.stopped:
+            self.flush()
+        elif n_pending >= self.flushSize:
+            self.wakeUp.set()
+
+    def count(self, trace: dict):
+        # updates the summary of the trace's round; it must be called holding the mutex
+        s = self.rounds.setdefault(trace['round_num'], {"round": trace['round_num'], "actions": 0, "services": {},
+                                                        "slowest": []})
+        s['actions'] += 1
+        service = s['services'].setdefault(trace['service_id'], {"actions": 0, "total_duration": 0,
+                                                                 "max_duration": 0, "exceptions": 0})
+        service['actions'] += 1
+        service['total_duration'] += trace['duration']
+        service['max_duration'] = max(service['max_duration'], trace['duration'])
+        service['exceptions'] += trace['exception'] is not None
+        slowest = s['slowest']
+        if len(slowest) < SUMMARY_SLOWEST or trace['duration'] > slowest[-1]['duration']:
+            slowest.append({k: trace[k] for k in TRACE_FIELDS})
+            slowest.sort(key=lambda t: t['duration'], reverse=True)
+            del slowest[SUMMARY_SLOWEST:]
+
+    def trace(self, round_num: int, team_id: int, service_id: int, action: str, func, *args):
+        # calls func(*args), recording its duration and its result, or the type of the exception it raised
+        start = self.clock.time()
+        perfStart = time.perf_counter()
+        try:
+            result = func(*args)
+        except Exception as e:
+            self.record(round_num, team_id, service_id, action, start, time.perf_counter() - perfStart,
+                        None, e.__class__.__name__)
+            raise
+        self.record(round_num, team_id, service_id, action, start, time.perf_counter() - perfStart, result)
+        return result
+
+    def flush(self):
+        with self.flushMutex:
+            with self.mutex:
+                traces, self.pending = self.pending, []
+            if len(traces) == 0:
+                return 0
+            db, _ = get_db_manager(self.mongoConfig, self.mongoClient)
+            try:
+                # copies, because the insert adds the _id to the documents, which are shared with the ring buffer
+                insert_traces(db, [dict(t) for t in traces])
+            except Exception as e:
+                log(f"Error: failed to persist {len(traces)} traces: {e.__class__.__name__} {str(e)}")
+                return 0
+            TRACE_FLUSH_SIZE.observe(len(traces))
+        return len(traces)
+
+    def roundTraces(self, round_num: int):
+        with self.mutex:
+            traces = [t for t in self.ring if t['round_num'] == round_num]
+            oldest = self.ring[0]['round_num'] if len(self.ring) > 0 else None
+        if oldest is not None and oldest < round_num:
+            return traces
+        # the round may be only partially in the ring buffer (or not at all): read it from the DB
+        self.flush()
+        db, _ = get_db_manager(self.mongoConfig, self.mongoClient)
+        return get_traces_for_round(db, round_num)
+
+    @staticmethod
+    def slowestOf(traces: list, limit: int):
+        traces = sorted(traces, key=lambda t: t['duration'], reverse=True)
+        return [{k: t[k] for k in TRACE_FIELDS} for t in traces[:limit]]
+
+    def slowest(self, round_num: int, limit: int = 10):
+        # the slowest actions of a round, with the slowest first
+        return self.slowestOf(self.roundTraces(round_num), limit)
+
+    def summary(self, round_num: int):
+        # from the statistics in memory, without reading the traces
+        with self.mutex:
+            s = self.rounds.get(round_num)
+            if s is None:
+                return {"round": round_num, "actions": 0, "services": {}, "slowest": []}
+            return {"round": round_num, "actions": s['actions'],
+                    "services": {service_id: dict(v) for service_id, v in s['services'].items()},
+                    "slowest": list(s['slowest'])}
+
+    def logSummary(self, round_num: int):
+        # the summary is logged by the tracer's thread, so that the caller (the scheduler) doesn't wait for it
+        with self.mutex:
+            self.summaryRequests.append(round_num)
+        self.wakeUp.set()
+
+    def writeSummaries(self):
+        with self.mutex:
+            requests, self.summaryRequests = self.summaryRequests, []
+        for round_num in requests:
+            s = self.summary(round_num)
+            with self.mutex:
+                # the statistics of older rounds are not needed anymore
+                for old_round in [r for r in self.rounds if r <= round_num]:
+                    del self.rounds[old_round]
+            if s['actions'] == 0:
+                continue
+            services = ", ".join(f"service {service_id}: {v['actions']} actions, "
+                                 f"mean {v['total_duration'] / v['actions']:.3f}s, max {v['max_duration']:.3f}s, "
+                                 f"{v['exceptions']} exceptions" for service_id, v in sorted(s['services'].items()))
+            slowest = ", ".join(f"team {t['team_id']} service {t['service_id']} {t['action']} {t['duration']:.3f}s"
+                                for t in s['slowest'])
+            log(f"Checkers' traces of round {round_num}: {services}; slowest: {slowest}")
+
+    def run(self) -> None:
+        try:
+            db, _ = get_db_manager(self.mongoConfig, self.mongoClient)
+            create_trace_indexes(db)
+        except Exception as e:
+            log(f"Error: failed to create the indexes of the traces: {e.__class__.__name__} {str(e)}")
+        while not self.stopped:
+            self.clock.wait(self.wakeUp, self.flushInterval)
+            self.wakeUp.clear()
+            self.writeSummaries()
+            self.flush()
+
+    def stop(self):
+        self.stopped = True
+        self.wakeUp.set()
+        if self.is_alive():
+            self.join()
+        self.flush()
@@ -0,0 +1,149 @@
+import argparse
+import os
+import socket
+import threading
+import time
+import uuid
+
+from job_broker import open_broker
+from event_queue import check_event, encode_events
+from checker_reloader import load_checker_module, file_version
+from check_scheduler import CheckScheduler
+import checker_lib
+from project_utils import log
+
+# checker worker: runs the checker jobs published on a broker by the CheckScheduler, when the misc parameter
+# checker_broker is set; it must be executed from src folder, like the platform, to find the checkers
+# usage: PYTHONPATH=. python checker_worker.py --broker <path of the SQLite file | host:port> [--concurrency N]
+# with host:port, the secret of the broker (misc parameter checker_broker_secret) must be in the
+# CHECKER_BROKER_SECRET environment variable
+
+
+class CheckerWorker:
+    # each job is the sequence of actions of a checker (check, put only for a flag of the current round, get),
+    # like CheckScheduler.runChecker in local mode; each action starts at its planned time, so jobs run
+    # in parallel, up to "concurrency" of them, and their leases are renewed until they complete
+    def __init__(self, broker, workerId: str = None, concurrency: int = 64, pollInterval: float = 0.5,
+                 renewInterval: float = 5):
+        self.broker = broker
+        self.workerId = workerId if workerId is not None else \
+            f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        self.concurrency = concurrency
+        self.pollInterval = pollInterval
+        self.renewInterval = renewInterval
+        self.running = set()
+        self.mutex = threading.Lock()
+        self.checkers = {}
+        self.stopped = False
+        self.numCompleted = 0
+
+    def getChecker(self, team: dict, service: dict):
+        # checker instances are reused, like in CheckScheduler, until the checker's file changes: then the checker
+        # is loaded again, and if the new version fails to load the old one is kept (see CheckerReloader)
+        with self.mutex:
+            key = (team['id'], service['id'])
+            version = file_version(service['checker'])
+            if key in self.checkers and (version is None or version == self.checkers[key][0]):
+                return self.checkers[key][1]
+            try:
+                checkerMod = load_checker_module(service['checker'],
+                                                 CheckScheduler.filePathToModuleName(service['checker']))
+                self.checkers[key] = (version, checkerMod.Checker(team=team, service=service))
+            except Exception as e:
+                if key not in self.checkers:
+                    raise
+                log(f"Error: reload of checker {service['checker']} failed, the previous version is kept: "
+                    f"{e.__class__.__name__} {str(e)}")
+                self.checkers[key] = (version, self.checkers[key][1])
+            return self.checkers[key][1]
+
+    def runJob(self, payload: dict):
+        # returns the check event with the final status of the checker, as a hex string of its binary record
+        # (the timestamp is set by the scheduler, when it reports the check), and the trace of each action
+        checker = self.getChecker(payload['team'], payload['service'])
+        flag, seed = payload['flag'], payload['seed']
+        actions = []
+
+        def runAction(action, *args):
+            # the plan is made of offsets from the publication of the job, in real seconds
+            delay = payload['published'] + payload['plan'][action] - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            start = time.time()
+            perfStart = time.perf_counter()
+            try:
+                res = getattr(checker, action)(*args)
+            except Exception as e:
+                actions.append([action, start, time.perf_counter() - perfStart, None, e.__class__.__name__])
+                raise
+            actions.append([action, start, time.perf_counter() - perfStart, res, None])
+            return res
+        try:
+            status = runAction("check")
+            if status == checker_lib.OK and not payload['is_previous']:
+                status = runAction("put", flag, seed)
+            if status == checker_lib.OK:
+                status = runAction("get", flag, seed)
+        except:
+            status = checker_lib.ERROR
+        try:
+            event = check_event(payload['team']['id'], payload['service']['id'], status)
+        except KeyError:
+            log(f"Error: {status} is an invalid status, returned by the checker of service {payload['service']['id']}")
+            event = check_event(payload['team']['id'], payload['service']['id'], checker_lib.ERROR)
+        return {"event": encode_events([event]).hex(), "actions": actions}
+
+    def execute(self, jobId: int, payload: dict):
+        try:
+            result = self.runJob(payload)
+            if not self.broker.complete(self.workerId, jobId, result):
+                log(f"Warning: result of job {jobId} discarded, because its lease expired")
+            self.numCompleted += 1
+        except Exception as e:
+            log(f"Error: job {jobId} not completed: {e.__class__.__name__} {str(e)}")
+        finally:
+            with self.mutex:
+                self.running.discard(jobId)
+
+    def renewLeases(self):
+        while not self.stopped:
+            time.sleep(self.renewInterval)
+            with self.mutex:
+                jobIds = list(self.running)
+            if len(jobIds) > 0:
+                try:
+                    self.broker.renew(self.workerId, jobIds)
+                except Exception as e:
+                    log(f"Error: renewal of leases failed: {e.__class__.__name__} {str(e)}")
+
+    def run(self):
+        log(f"Checker worker {self.workerId} started")
+        threading.Thread(target=self.renewLeases, daemon=True).start()
+        while not self.stopped:
+            with self.mutex:
+                free = self.concurrency - len(self.running)
+            jobs = []
+            if free > 0:
+                try:
+                    jobs = self.broker.lease(self.workerId, free)
+                except Exception as e:
+                    log(f"Error: lease of jobs failed: {e.__class__.__name__} {str(e)}")
+            for jobId, payload in jobs:
+                with self.mutex:
+                    self.running.add(jobId)
+                threading.Thread(target=self.execute, args=(jobId, payload), daemon=True).start()
+            if len(jobs) == 0:
+                time.sleep(self.pollInterval)
+
+
+def main():
+    args_parser = argparse.ArgumentParser(description="Worker which runs checker jobs published on a broker")
+    args_parser.add_argument("--broker", required=True, help="path of the SQLite file, or host:port of the broker")
+    args_parser.add_argument("--concurrency", type=int, default=64)
+    args_parser.add_argument("--worker-id", default=None)
+    args = args_parser.parse_args()
+    CheckerWorker(open_broker(args.broker), args.worker_id, args.concurrency).run()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+import threading
+
+from checker_lib import DOWN
+from game_clock import Clock, REAL_CLOCK
+import metrics
+
+
+SHORT_CIRCUITS = metrics.counter("adkihon_breaker_short_circuits_total",
+                                 "Checks reported as down without running the checker, by service", ("service",))
+
+
+class RoundState:
+    def __init__(self, probing: bool):
+        self.down = False
+        # in probe-first mode, the other checks of the round wait for the probe's result
+        self.probing = probing
+        self.probeDone = threading.Event()
+
+
+class CircuitBreaker:
+    # circuit breaker for each (team, service): in a round there is a check for the new flag and one for each
+    # flag still alive, and each of them starts with check(); as soon as one check() of the round returns DOWN,
+    # the following checks of the same team and service are reported as DOWN without running the checker.
+    # After "threshold" consecutive rounds with the service down, the breaker is open: at the next round
+    # only the check of the new flag (the probe) runs first, and the others wait for its result
+    def __init__(self, config: dict, services: dict, clock: Clock = REAL_CLOCK):
+        misc = config['misc']
+        self.enabled = misc.get('circuit_breaker', True)
+        self.threshold = misc.get('breaker_threshold', 3)
+        self.services = services
+        self.clock = clock
+        # the probe waits at most one round, then the other checks run anyway
+        self.probeTimeout = misc['round_time']
+        self.downRounds = {}
+        self.rounds = {}
+        self.mutex = threading.Lock()
+        metrics.gauge_func("adkihon_breaker_open", "Teams' services whose circuit breaker is open", self.numOpen)
+
+    def isOpen(self, team_id: int, service_id: int):
+        return self.threshold > 0 and self.downRounds.get((team_id, service_id), 0) >= self.threshold
+
+    def numOpen(self):
+        return sum(1 for team_id, service_id in list(self.downRounds.keys()) if self.isOpen(team_id, service_id))
+
+    def startRound(self, roundNum: int, pairs: list):
+        # pairs: list of (team_id, service_id) checked in the round
+        if not self.enabled:
+            return
+        with self.mutex:
+            previous = self.rounds.get(roundNum - 1, {})
+            for pair, state in previous.items():
+                self.downRounds[pair] = self.downRounds.get(pair, 0) + 1 if state.down else 0
+            self.rounds[roundNum] = {pair: RoundState(self.isOpen(*pair)) for pair in pairs}
+            # the checks of older rounds should have completed, otherwise they just aren't short-circuited
+            for oldRound in [r for r in self.rounds if r < roundNum - 1]:
+                del self.rounds[oldRound]
+
+    def state(self, roundNum: int, team_id: int, service_id: int):
+        with self.mutex:
+            return self.rounds.get(roundNum, {}).get((team_id, service_id))
+
+    def shouldSkip(self, roundNum: int, team_id: int, service_id: int, isProbe: bool):
+        # true if the check can be reported as DOWN without running the checker
+        state = self.state(roundNum, team_id, service_id)
+        if state is None:
+            return False
+        if state.probing and not isProbe:
+            self.clock.wait(state.probeDone, self.probeTimeout)
+        if state.down:
+            SHORT_CIRCUITS.inc(service=self.services[service_id]['name'])
+        return state.down
+
+    def recordCheck(self, roundNum: int, team_id: int, service_id: int, status: str):
+        state = self.state(roundNum, team_id, service_id)
+        if state is not None and status == DOWN:
+            state.down = True
+
+    def endProbe(self, roundNum: int, team_id: int, service_id: int):
+        # called when the probe completes, whatever its result, to release the other checks
+        state = self.state(roundNum, team_id, service_id)
+        if state is not None:
+            state.probeDone.set()
@@ -2,72 +2,186 @@ import threading
 import time
 
 from event_queue import *
-from mongo_utils import get_db_manager, update_points
+from mongo_utils import get_db_manager, update_points_bulk
 from project_utils import log
+from attack_stats import AttackStats
+from game_clock import Clock, REAL_CLOCK
 from checker_lib import *
+import metrics
 
-"""
-Event formats:
-{"type": EVENT_CHECK, "status": Union(OK, DOWN, MUMBLE, CORRUPT, ERROR), "team": team_id, "service": service_id, "timestamp": int_timestamp}
-{"type": EVENT_ATTACK, "team": team_id, "service": service_id, "attacked_team": attacked_team_id, "timestamp": int_timestamp}
-"""
+
+DISPATCH_BATCH_SIZE = metrics.histogram("adkihon_dispatch_batch_size", "Number of events dispatched at once",
+                                        buckets=metrics.SIZE_BUCKETS)
+DISPATCH_LAG_SECONDS = metrics.histogram("adkihon_dispatch_lag_seconds",
+                                         "Time between the generation of an event and its dispatch")
+BACKLOG_ALERTS = metrics.counter("adkihon_event_backlog_alerts_total",
+                                 "Times the events waiting to be dispatched exceeded the backlog threshold")
+
+# events are the records defined in event_queue: CheckEvent(team, service, status, timestamp) and
+# AttackEvent(team, service, attacked_team, timestamp); the events drained from the queue at once are aggregated
+# into the increments of points of each (team, service), so that they're applied with a single bulk write
+SLA_INCREMENTS = {Status.OK: 1, Status.MUMBLE: -1, Status.CORRUPT: -1, Status.DOWN: -1}
+# seconds between two checks of the stop flag, while the queue is empty
+STOP_CHECK_INTERVAL = 1
 
 
 class EventDispatcher(threading.Thread):
-    def __init__(self, eventQueue: EventQueue, config: dict):
+    # the dispatcher blocks on the queue until an event arrives, then it keeps collecting events in a
+    # micro-batch, which is dispatched as soon as it has dispatch_max_batch events or dispatch_max_delay
+    # seconds have passed since its first event, whichever comes first; when the events waiting in the queue
+    # exceed event_backlog_threshold an alert is logged (see also event_queue_max_size in Services).
+    # The attack events of each batch also update the attack statistics (see AttackStats), and the increments
+    # of points of each batch are passed to the points listeners, once they're written (see addPointsListener)
+    def __init__(self, eventQueue: EventQueue, config: dict, clock: Clock = REAL_CLOCK):
         super().__init__()
         self.eventQueue = eventQueue
+        self.clock = clock
         _, mongo_client = get_db_manager(config['mongo'])
         self.mongoClient = mongo_client
         self.mongoConfig = config['mongo']
         self.stopped = False
-        self.dispatchFrequency = config['misc']['dispatch_frequency']
+        misc = config['misc']
+        self.maxBatch = misc.get('dispatch_max_batch', 1000)
+        self.maxDelay = misc.get('dispatch_max_delay', 0.1)
+        if 'dispatch_frequency' in misc:
+            # the key of the previous versions, which slept dispatch_frequency seconds between the dispatches:
+            # it bounded the delay of the points' updates, as dispatch_max_delay does now
+            if 'dispatch_max_delay' in misc:
+                log("Warning: dispatch_frequency is deprecated and ignored, because dispatch_max_delay is set")
+            else:
+                log("Warning: dispatch_frequency is deprecated, use dispatch_max_delay; "
+                    f"dispatch_max_delay is set to {misc['dispatch_frequency']}")
+                self.maxDelay = misc['dispatch_frequency']
+        self.backlogThreshold = misc.get('event_backlog_threshold', 10000)
+        self.backlogAlert = False
+        self.attackStats = AttackStats(config, clock)
+        self.pointsListeners = []
+        # held while the points of a batch are written and passed to the listeners
+        self.pointsMutex = threading.Lock()
+        metrics.gauge_func("adkihon_event_queue_oldest_age_seconds", "Age of the oldest event waiting to be dispatched",
+                           self.oldestEventAge)
+
+    def oldestEventAge(self):
+        try:
+            event = self.eventQueue.queue[0]
+        except IndexError:
+            return 0
+        timestamp = getattr(event, "timestamp", None)
+        return max(self.clock.time() - timestamp, 0) if timestamp is not None else 0
+
+    def checkBacklog(self):
+        # the alert is raised once when the backlog exceeds the threshold, and reset when it's back under half of it
+        depth = self.eventQueue.qsize()
+        if not self.backlogAlert and depth > self.backlogThreshold:
+            self.backlogAlert = True
+            BACKLOG_ALERTS.inc()
+            log(f"Warning: {depth} events waiting to be dispatched, the threshold is {self.backlogThreshold}")
+        elif self.backlogAlert and depth < self.backlogThreshold / 2:
+            self.backlogAlert = False
+            log(f"Backlog of events back to {depth}")
 
     @staticmethod
-    def updatePoints(mongoClient, mongoConfig, event):
-        # timestamp is passed in the event to have consistency between stolen_flags, lost_flags and checks'
+    def aggregate(events: list, clock: Clock = REAL_CLOCK):
+        # returns ({(team_id, service_id): {pts_type: amount}}, {team_id: last timestamp});
+        # the timestamp is passed in the event to have consistency between stolen_flags, lost_flags and checks'
         # timestamps and last_pts_update timestamp; silently take current time as timestamp if it is not present
-        if 'timestamp' in event:
-            timestamp = event['timestamp']
-        else:
-            timestamp = int(time.time())
-        db, _ = get_db_manager(mongoConfig, mongoClient)
-        if event['type'] == EVENT_CHECK:
-            pts_type = "sla_pts"
-            status = event['status']
-            if status == ERROR:
-                # nothing to do: checker error
-                return
-            elif status == OK:
-                increment = True
-            elif status in [MUMBLE, CORRUPT, DOWN]:
-                increment = False
+        points = {}
+        timestamps = {}
+
+        def add(team_id, service_id, pts_type, amount, timestamp):
+            increments = points.setdefault((team_id, service_id), {})
+            increments[pts_type] = increments.get(pts_type, 0) + amount
+            timestamps[team_id] = max(timestamps.get(team_id, timestamp), timestamp)
+        for event in events:
+            eventType = getattr(event, "type", None)
+            timestamp = event.timestamp if getattr(event, "timestamp", None) is not None else int(clock.time())
+            if eventType == EVENT_CHECK:
+                if event.status == Status.ERROR:
+                    # nothing to do: checker error
+                    continue
+                if event.status not in SLA_INCREMENTS:
+                    log(f"Error: {event.status} is an invalid event status")
+                    continue
+                add(event.team, event.service, "sla_pts", SLA_INCREMENTS[event.status], timestamp)
+            elif eventType == EVENT_ATTACK:
+                add(event.team, event.service, "atk_pts", 1, timestamp)
+                add(event.attacked_team, event.service, "def_pts", -1, timestamp)
             else:
-                log(f"Error: {status} is an invalid event status")
-                return
-            update_points(db, event['team'], event['service'], pts_type, increment, timestamp)
-        elif event['type'] == EVENT_ATTACK:
-            atk_type = "atk_pts"
-            def_type = "def_pts"
-            team, service, attacked_team = event['team'], event['service'], event['attacked_team']
-            update_points(db, team, service, pts_type=atk_type, increment=True, timestamp=timestamp)
-            update_points(db, attacked_team, service, pts_type=def_type, increment=False, timestamp=timestamp)
-        else:
-            log(f"Error: {event['type']} is an invalid event type")
+                log(f"Error: {event} is an invalid event")
+        return points, timestamps
+
+    @staticmethod
+    def updatePoints(mongoClient, mongoConfig, events: list, clock: Clock = REAL_CLOCK):
+        # returns the increments of points which have been written
+        db, _ = get_db_manager(mongoConfig, mongoClient)
+        points, timestamps = EventDispatcher.aggregate(events, clock)
+        update_points_bulk(db, points, timestamps)
+        return points
+
+    def addPointsListener(self, listener):
+        # listener(points) is called with the increments of points of each batch, {(team_id, service_id):
+        # {pts_type: amount}}, right after they're written to the DB, or with None if the write failed, since it
+        # may have been partially applied; it's called while holding pointsMutex, so that the listener can read
+        # the points from the DB without missing a batch or counting it twice
+        self.pointsListeners.append(listener)
+
+    def nextBatch(self):
+        # waits for the first event, then for the rest of the micro-batch; returns an empty list if no event
+        # arrives before the next check of the stop flag
+        try:
+            batch = self.eventQueue.getMany(self.maxBatch, timeout=self.clock.realSeconds(STOP_CHECK_INTERVAL))
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + self.clock.realSeconds(self.maxDelay)
+        while len(batch) < self.maxBatch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch += self.eventQueue.getMany(self.maxBatch - len(batch), timeout=remaining)
+            except queue.Empty:
+                break
+        return batch
+
+    def dispatch(self, events: list):
+        DISPATCH_BATCH_SIZE.observe(len(events))
+        now = self.clock.time()
+        for event in events:
+            if getattr(event, "timestamp", None) is not None:
+                DISPATCH_LAG_SECONDS.observe(max(now - event.timestamp, 0))
+        with self.pointsMutex:
+            try:
+                points = EventDispatcher.updatePoints(self.mongoClient, self.mongoConfig, events, self.clock)
+            except Exception as e:
+                log(f"Error: update of points failed for {len(events)} events: {e.__class__.__name__} {str(e)}")
+                points = None
+            for listener in self.pointsListeners:
+                listener(points)
+        self.attackStats.record(events)
+
+    def persistAttackStats(self, force: bool = False):
+        try:
+            db, _ = get_db_manager(self.mongoConfig, self.mongoClient)
+            self.attackStats.persist(db, force)
+        except Exception as e:
+            log(f"Error: save of attack statistics failed: {e.__class__.__name__} {str(e)}")
 
     def run(self) -> None:
-        while True:
-            time.sleep(self.dispatchFrequency)
-            new_events = []
-            empty = False
-            while not empty:
-                try:
-                    new_events.append(self.eventQueue.get(block=False))
-                except queue.Empty:
-                    empty = True
-            for event in new_events:
-                updateThread = threading.Thread(target=EventDispatcher.updatePoints,
-                                                args=(self.mongoClient, self.mongoConfig, event))
-                updateThread.start()
-            if self.stopped:
-                return
+        try:
+            db, _ = get_db_manager(self.mongoConfig, self.mongoClient)
+            self.attackStats.load(db)
+        except Exception as e:
+            log(f"Error: load of attack statistics failed: {e.__class__.__name__} {str(e)}")
+        while not self.stopped:
+            batch = self.nextBatch()
+            self.checkBacklog()
+            if len(batch) > 0:
+                self.dispatch(batch)
+            self.persistAttackStats()
+        # the events still in the queue are dispatched before stopping
+        try:
+            while True:
+                self.dispatch(self.eventQueue.getMany(self.maxBatch, block=False))
+        except queue.Empty:
+            pass
+        self.persistAttackStats(force=True)
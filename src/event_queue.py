@@ -1,10 +1,117 @@
+import enum
 import queue
+import struct
+from typing import NamedTuple
 
-EVENT_CHECK = "check"
-EVENT_ATTACK = "attack"
+from checker_lib import OK, MUMBLE, CORRUPT, DOWN, ERROR
+
+
+class EventType(enum.IntEnum):
+    CHECK = 0
+    ATTACK = 1
+
+
+class Status(enum.IntEnum):
+    OK = 0
+    MUMBLE = 1
+    CORRUPT = 2
+    DOWN = 3
+    ERROR = 4
+
+
+EVENT_CHECK = EventType.CHECK
+EVENT_ATTACK = EventType.ATTACK
+# mapping between the statuses returned by the checkers and their codes in the events
+STATUS_CODES = {OK: Status.OK, MUMBLE: Status.MUMBLE, CORRUPT: Status.CORRUPT, DOWN: Status.DOWN, ERROR: Status.ERROR}
+STATUS_NAMES = {code: name for name, code in STATUS_CODES.items()}
+
+
+# events are tuples, so they're allocated without a dict and compared by value; the timestamp is the int
+# timestamp of the check or of the submission, if it's None the dispatcher uses the current time
+class CheckEvent(NamedTuple):
+    team: int
+    service: int
+    status: int
+    timestamp: int = None
+    type = EVENT_CHECK
+
+
+class AttackEvent(NamedTuple):
+    team: int
+    service: int
+    attacked_team: int
+    timestamp: int = None
+    type = EVENT_ATTACK
+
+
+def check_event(team: int, service: int, status: str, timestamp: int = None) -> CheckEvent:
+    # status is the one returned by the checker; raises KeyError if it's not a valid status
+    return CheckEvent(team, service, STATUS_CODES[status], timestamp)
+
+
+# binary encoding of the events, e.g. to persist them or to send them to another process: each event is a
+# fixed size record (type, status, team, service, attacked team, timestamp), little endian; fields which
+# are not part of the event are 0, and a missing timestamp is -1
+RECORD = struct.Struct("<BBHHHq")
+
+
+def encode_events(events: list) -> bytes:
+    records = bytearray(RECORD.size * len(events))
+    for i, event in enumerate(events):
+        timestamp = event.timestamp if event.timestamp is not None else -1
+        if event.type == EVENT_CHECK:
+            RECORD.pack_into(records, i * RECORD.size, EVENT_CHECK, event.status, event.team, event.service, 0,
+                             timestamp)
+        else:
+            RECORD.pack_into(records, i * RECORD.size, EVENT_ATTACK, 0, event.team, event.service,
+                             event.attacked_team, timestamp)
+    return bytes(records)
+
+
+def decode_events(data: bytes) -> list:
+    events = []
+    for eventType, status, team, service, attackedTeam, timestamp in RECORD.iter_unpack(data):
+        timestamp = timestamp if timestamp != -1 else None
+        if eventType == EVENT_CHECK:
+            events.append(CheckEvent(team, service, status, timestamp))
+        elif eventType == EVENT_ATTACK:
+            events.append(AttackEvent(team, service, attackedTeam, timestamp))
+        else:
+            raise ValueError(f"{eventType} is an invalid event type")
+    return events
 
 
-# just a wrapper around queue.Queue, for code manageability
 class EventQueue(queue.Queue):
+    # queue.Queue with batched operations, which take the lock of the queue once for all the events
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
+
+    def putMany(self, events: list):
+        if self.maxsize > 0:
+            # a bounded queue may block on each event
+            for event in events:
+                self.put(event)
+            return
+        if len(events) == 0:
+            return
+        with self.not_empty:
+            self.queue.extend(events)
+            self.unfinished_tasks += len(events)
+            self.not_empty.notify(len(events))
+
+    def getMany(self, maxEvents: int, block: bool = True, timeout: float = None) -> list:
+        # returns at least one event and at most maxEvents; like get, it raises queue.Empty if it doesn't block,
+        # or if the timeout expires, and there are no events
+        with self.not_empty:
+            if not block:
+                if not self._qsize():
+                    raise queue.Empty
+            elif timeout is None:
+                while not self._qsize():
+                    self.not_empty.wait()
+            else:
+                if not self.not_empty.wait_for(self._qsize, timeout):
+                    raise queue.Empty
+            events = [self.queue.popleft() for _ in range(min(maxEvents, self._qsize()))]
+            self.not_full.notify(len(events))
+            return events
@@ -0,0 +1,55 @@
+import threading
+
+from mongo_utils import get_db_manager, archive_flags
+from game_clock import Clock, REAL_CLOCK
+from project_utils import log
+import metrics
+
+
+ARCHIVED_FLAGS = metrics.counter("adkihon_archived_flags_total", "Flags of expired rounds moved to the archive")
+# flags moved by each write to the archive
+ARCHIVE_BATCH_SIZE = 10000
+
+
+class FlagArchiver(threading.Thread):
+    # only the flags of the last (flag lifetime + 1) rounds can be submitted or checked, so the flags of the older
+    # rounds are periodically moved to the flag_archive collection: the flag collection, and its indexes, stay
+    # as big as a few rounds, while the lookups of old flags (e.g. by resume_points) fall back to the archive
+    def __init__(self, config: dict, currentRound, clock: Clock = REAL_CLOCK):
+        # currentRound: function which returns the current round number
+        super().__init__(daemon=True)
+        misc = config['misc']
+        self.clock = clock
+        self.currentRound = currentRound
+        self.flagLifetime = misc['flag_lifetime']
+        self.interval = misc.get('flag_archive_interval', misc['round_time'])
+        _, mongo_client = get_db_manager(config['mongo'])
+        self.mongoClient = mongo_client
+        self.mongoConfig = config['mongo']
+        self.stopped = False
+
+    def archive(self):
+        # a flag of round r is accepted until round r + flag lifetime; one more round is kept in the flag
+        # collection, for the submissions in flight while the round changes
+        beforeRound = self.currentRound() - self.flagLifetime - 1
+        if beforeRound <= 1:
+            return 0
+        db, _ = get_db_manager(self.mongoConfig, self.mongoClient)
+        total = 0
+        while True:
+            moved = archive_flags(db, beforeRound, ARCHIVE_BATCH_SIZE)
+            total += moved
+            if moved < ARCHIVE_BATCH_SIZE:
+                break
+        if total > 0:
+            ARCHIVED_FLAGS.inc(total)
+            log(f"Archived {total} flags of the rounds before {beforeRound}")
+        return total
+
+    def run(self) -> None:
+        while not self.stopped:
+            self.clock.sleep(self.interval)
+            try:
+                self.archive()
+            except Exception as e:
+                log(f"Error: archive of flags failed: {e.__class__.__name__} {str(e)}")
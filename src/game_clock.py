@@ -0,0 +1,49 @@
+import datetime
+import threading
+import time
+
+
+class Clock:
+    # the components of the platform read time and sleep only through a clock, so that a game
+    # can also be simulated faster than real time (see SimulatedClock); this is the real one
+    def time(self) -> float:
+        return time.time()
+
+    def now(self) -> datetime.datetime:
+        return datetime.datetime.now()
+
+    def realSeconds(self, seconds: float) -> float:
+        # converts a duration in game time into a duration in real time
+        return seconds
+
+    def sleep(self, seconds: float):
+        if seconds > 0:
+            time.sleep(self.realSeconds(seconds))
+
+    def wait(self, event: threading.Event, timeout: float) -> bool:
+        return event.wait(timeout=self.realSeconds(timeout))
+
+    def timer(self, interval: float, function) -> threading.Timer:
+        return threading.Timer(interval=self.realSeconds(interval), function=function)
+
+
+class SimulatedClock(Clock):
+    # game time flows "speed" times faster than real time, starting from "start" (a timestamp);
+    # all the sleeps, waits and timers are shortened accordingly, so e.g. with speed=3600
+    # a game of 8 hours is played in 8 seconds
+    def __init__(self, start: float, speed: float):
+        self.start = start
+        self.speed = speed
+        self.realStart = time.monotonic()
+
+    def time(self) -> float:
+        return self.start + (time.monotonic() - self.realStart) * self.speed
+
+    def now(self) -> datetime.datetime:
+        return datetime.datetime.fromtimestamp(self.time())
+
+    def realSeconds(self, seconds: float) -> float:
+        return seconds / self.speed
+
+
+REAL_CLOCK = Clock()
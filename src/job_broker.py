@@ -0,0 +1,238 @@
+import hashlib
+import hmac
+import json
+import os
+import socket
+import socketserver
+import sqlite3
+import threading
+import time
+
+from project_utils import log
+
+
+QUEUED = "queued"
+LEASED = "leased"
+DONE = "done"
+FAILED = "failed"
+# the fields of a job's payload which are sent to the workers; the other ones are used only by the scheduler
+WORKER_FIELDS = ("team", "service", "flag", "seed", "is_previous", "published", "plan")
+# environment variable with the shared secret of the TCP broker, for the workers
+SECRET_ENV = "CHECKER_BROKER_SECRET"
+
+
+class JobBroker:
+    # work queue for checker jobs, backed by a SQLite file, so it needs no external service and it can be
+    # shared by the processes of the same machine (workers on other machines use BrokerServer/RemoteBroker).
+    # A worker leases some jobs for leaseSeconds, and must renew the lease while it's running them; if it dies,
+    # the lease expires and the jobs are leased again by another worker, up to maxAttempts times, then they fail.
+    # Lease time and max attempts are the ones of the broker which publishes the jobs (the scheduler's one).
+    # A job can also have a deadline, e.g. the end of its round: after it, the job is never leased again, and
+    # if it's not completed it fails, so that a late result is not reported in another round.
+    # Completed and failed jobs are collected, and deleted, by the scheduler.
+    def __init__(self, path: str, leaseSeconds: float = 30, maxAttempts: int = 3):
+        self.path = path
+        self.leaseSeconds = leaseSeconds
+        self.maxAttempts = maxAttempts
+        # the connection is shared by the threads of this process, so its use is serialized
+        self.mutex = threading.Lock()
+        self.conn = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        with self.mutex:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS job (id INTEGER PRIMARY KEY AUTOINCREMENT, payload TEXT, "
+                              "status TEXT, worker TEXT, lease_seconds REAL, lease_until REAL, attempts INTEGER, "
+                              "max_attempts INTEGER, result TEXT, deadline REAL)")
+            # the table of a previous version, without deadlines
+            if "deadline" not in [column[1] for column in self.conn.execute("PRAGMA table_info(job)")]:
+                self.conn.execute("ALTER TABLE job ADD COLUMN deadline REAL")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS job_status ON job (status, lease_until)")
+
+    def transaction(self, func, *args):
+        # BEGIN IMMEDIATE takes the write lock of the DB file, so that two processes can't lease the same job
+        with self.mutex:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                res = func(*args)
+            except:
+                self.conn.execute("ROLLBACK")
+                raise
+            self.conn.execute("COMMIT")
+        return res
+
+    def publish(self, payloads: list, deadline: float = None):
+        # deadline: timestamp (real time) after which the jobs are not leased anymore, None for no deadline
+        rows = [(json.dumps(payload), QUEUED, self.leaseSeconds, 0, self.maxAttempts, deadline)
+                for payload in payloads]
+        self.transaction(lambda: self.conn.executemany(
+            "INSERT INTO job (payload, status, lease_seconds, attempts, max_attempts, deadline) "
+            "VALUES (?, ?, ?, ?, ?, ?)", rows))
+
+    def lease(self, worker: str, maxJobs: int = 1):
+        # returns a list of (job_id, payload), with only the fields of the payload needed by the workers
+        def lease():
+            now = time.time()
+            rows = self.conn.execute(
+                "SELECT id, payload FROM job WHERE (status = ? OR (status = ? AND lease_until < ?)) "
+                "AND attempts < max_attempts AND (deadline IS NULL OR deadline > ?) ORDER BY id LIMIT ?",
+                (QUEUED, LEASED, now, now, maxJobs)).fetchall()
+            self.conn.executemany(
+                "UPDATE job SET status = ?, worker = ?, lease_until = ? + lease_seconds, attempts = attempts + 1 "
+                "WHERE id = ?", [(LEASED, worker, now, job_id) for job_id, _ in rows])
+            return [(job_id, {k: v for k, v in json.loads(payload).items() if k in WORKER_FIELDS})
+                    for job_id, payload in rows]
+        return self.transaction(lease)
+
+    def renew(self, worker: str, jobIds: list):
+        # extends the lease of the jobs still leased by the worker; returns the number of renewed jobs
+        def renew():
+            now = time.time()
+            return sum(self.conn.execute(
+                "UPDATE job SET lease_until = ? + lease_seconds WHERE id = ? AND status = ? AND worker = ?",
+                (now, job_id, LEASED, worker)).rowcount for job_id in jobIds)
+        return self.transaction(renew)
+
+    def complete(self, worker: str, jobId: int, result: dict):
+        # the result is accepted only if the job is still leased by the worker, i.e. it hasn't been leased
+        # again by another worker after the lease expired
+        return self.transaction(lambda: self.conn.execute(
+            "UPDATE job SET status = ?, result = ? WHERE id = ? AND status = ? AND worker = ?",
+            (DONE, json.dumps(result), jobId, LEASED, worker)).rowcount == 1)
+
+    def collect(self):
+        # returns, and deletes, the completed and failed jobs, as a list of (job_id, payload, result);
+        # the result of a failed job, i.e. one whose attempts have all expired, or which is not leased (or whose
+        # lease has expired) after its deadline, is None
+        def collect():
+            now = time.time()
+            self.conn.execute("UPDATE job SET status = ? WHERE status = ? AND lease_until < ? "
+                              "AND attempts >= max_attempts", (FAILED, LEASED, now))
+            self.conn.execute("UPDATE job SET status = ? WHERE (status = ? OR (status = ? AND lease_until < ?)) "
+                              "AND deadline <= ?", (FAILED, QUEUED, LEASED, now, now))
+            rows = self.conn.execute("SELECT id, payload, status, result FROM job WHERE status IN (?, ?)",
+                                     (DONE, FAILED)).fetchall()
+            self.conn.executemany("DELETE FROM job WHERE id = ?", [(row[0],) for row in rows])
+            return [(job_id, json.loads(payload), json.loads(result) if status == DONE else None)
+                    for job_id, payload, status, result in rows]
+        return self.transaction(collect)
+
+    def pending(self):
+        with self.mutex:
+            return self.conn.execute("SELECT COUNT(*) FROM job WHERE status IN (?, ?)", (QUEUED, LEASED)).fetchone()[0]
+
+
+def request_mac(secret: bytes, challenge: str, seq: int, body: str) -> str:
+    # each request is authenticated with the shared secret, the challenge of the connection and the number of
+    # the request in the connection, so that a request can't be forged, nor replayed
+    return hmac.new(secret, f"{challenge}:{seq}:{body}".encode(), hashlib.sha256).hexdigest()
+
+
+class BrokerHandler(socketserver.StreamRequestHandler):
+    # the server sends a {"challenge"} line, then each request is a line {"body", "mac"}, where body is the
+    # JSON of {"op": "lease" | "renew" | "complete", "args": [...]}, with a JSON response per line;
+    # the connection is closed at the first request which isn't authenticated
+    OPS = ("lease", "renew", "complete")
+
+    def handle(self):
+        challenge = os.urandom(16).hex()
+        self.wfile.write(json.dumps({"challenge": challenge}).encode() + b"\n")
+        for seq, line in enumerate(self.rfile):
+            try:
+                request = json.loads(line)
+                body = request['body']
+                if not hmac.compare_digest(str(request['mac']), request_mac(self.server.secret, challenge, seq, body)):
+                    log(f"Warning: unauthenticated request to the checker jobs broker from {self.client_address[0]}")
+                    self.wfile.write(json.dumps({"error": "AuthenticationError invalid MAC"}).encode() + b"\n")
+                    return
+                request = json.loads(body)
+                if request['op'] not in self.OPS:
+                    raise ValueError(f"unknown operation {request['op']}")
+                response = {"result": getattr(self.server.broker, request['op'])(*request['args'])}
+            except Exception as e:
+                response = {"error": f"{e.__class__.__name__} {str(e)}"}
+            self.wfile.write(json.dumps(response).encode() + b"\n")
+
+
+class BrokerServer(socketserver.ThreadingTCPServer):
+    # exposes a JobBroker to workers on other machines, through RemoteBroker; only the workers which know the
+    # secret can lease jobs, which contain the flags, and complete them
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, broker: JobBroker, host: str, port: int, secret: str):
+        if not secret:
+            raise ValueError("the checker jobs broker needs a secret")
+        super().__init__((host, port), BrokerHandler)
+        self.broker = broker
+        self.secret = secret.encode()
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        log(f"Checker jobs broker listening on {self.server_address[0]}:{self.server_address[1]}")
+
+
+class BrokerError(Exception):
+    pass
+
+
+class RemoteBroker:
+    # client of BrokerServer, with the same interface of JobBroker for the workers
+    def __init__(self, host: str, port: int, secret: str, timeout: float = 30):
+        self.address = (host, port)
+        self.secret = secret.encode()
+        self.timeout = timeout
+        self.mutex = threading.Lock()
+        self.sock = None
+        self.file = None
+        self.challenge = None
+        self.seq = 0
+
+    def connect(self):
+        self.sock = socket.create_connection(self.address, timeout=self.timeout)
+        self.file = self.sock.makefile("rwb")
+        self.challenge = json.loads(self.file.readline())['challenge']
+        self.seq = 0
+
+    def call(self, op: str, *args):
+        with self.mutex:
+            try:
+                if self.sock is None:
+                    self.connect()
+                body = json.dumps({"op": op, "args": args})
+                mac = request_mac(self.secret, self.challenge, self.seq, body)
+                self.seq += 1
+                self.file.write(json.dumps({"body": body, "mac": mac}).encode() + b"\n")
+                self.file.flush()
+                line = self.file.readline()
+                if len(line) == 0:
+                    raise ConnectionError("connection closed by the broker")
+            except (OSError, ValueError, KeyError):
+                # reconnects at the next call
+                if self.sock is not None:
+                    self.sock.close()
+                self.sock = None
+                raise
+        response = json.loads(line)
+        if "error" in response:
+            raise BrokerError(response['error'])
+        return response['result']
+
+    def lease(self, worker: str, maxJobs: int = 1):
+        return [tuple(job) for job in self.call("lease", worker, maxJobs)]
+
+    def renew(self, worker: str, jobIds: list):
+        return self.call("renew", worker, jobIds)
+
+    def complete(self, worker: str, jobId: int, result: dict):
+        return self.call("complete", worker, jobId, result)
+
+
+def open_broker(address: str):
+    # address: "host:port" of a BrokerServer, whose secret is in the CHECKER_BROKER_SECRET environment variable,
+    # or the path of the SQLite file
+    host, sep, port = address.rpartition(":")
+    if sep != "" and port.isdigit():
+        secret = os.environ.get(SECRET_ENV)
+        if not secret:
+            raise ValueError(f"the secret of the broker must be in the {SECRET_ENV} environment variable")
+        return RemoteBroker(host, int(port), secret)
+    return JobBroker(address)
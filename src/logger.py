@@ -0,0 +1,158 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import re
+import sys
+import threading
+import time
+
+import metrics
+
+"""
+Asynchronous logging of the platform: project_utils.log only puts the record in a bounded queue, which is
+written to stderr by a background thread, so that submissions, checkers and the scheduler never wait on the
+lock of stderr. Each module logs with its own logger (the component), whose level can be configured, and
+repeated messages are rate limited. The "logging" group of config.json is optional, e.g.:
+"logging": {"format": "json", "level": "info", "components": {"check_scheduler": "warning"},
+            "queue_size": 10000, "rate_limit_interval": 10, "rate_limit_burst": 5}
+Like metrics, this module must not import other modules of the project, except metrics itself.
+"""
+
+ROOT = "ad_kihon"
+LEVELS = {"debug": logging.DEBUG, "info": logging.INFO, "warning": logging.WARNING, "error": logging.ERROR}
+# messages are compared without their numbers, e.g. the same error for different teams or rounds is repeated
+NUMBERS = re.compile(r"\d+")
+# the rate limiter forgets the messages seen in the current interval beyond this number
+MAX_TRACKED_MESSAGES = 10000
+
+DROPPED_MESSAGES = metrics.counter("adkihon_log_dropped_total", "Log messages dropped, by reason", ("reason",))
+
+
+class TextFormatter(logging.Formatter):
+    # the format of the platform's logs before they were structured
+    def format(self, record: logging.LogRecord) -> str:
+        message = f"[+] {record.getMessage()}"
+        suppressed = getattr(record, "suppressed", 0)
+        if suppressed > 0:
+            message += f" ({suppressed} similar messages suppressed)"
+        return message
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {"ts": round(record.created, 3), "level": record.levelname.lower(),
+                 "component": record.name[len(ROOT) + 1:], "thread": record.threadName, "msg": record.getMessage()}
+        suppressed = getattr(record, "suppressed", 0)
+        if suppressed > 0:
+            entry["suppressed"] = suppressed
+        return json.dumps(entry)
+
+
+FORMATTERS = {"text": TextFormatter, "json": JsonFormatter}
+
+
+class RateLimitFilter(logging.Filter):
+    # at most "burst" messages alike for each component every "interval" seconds; the number of messages
+    # suppressed in an interval is attached to the first message which passes in the next one
+    def __init__(self, interval: float, burst: int):
+        super().__init__()
+        self.interval = interval
+        self.burst = burst
+        self.windows = {}
+        self.mutex = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if self.interval <= 0:
+            return True
+        key = (record.name, NUMBERS.sub("#", str(record.msg)))
+        now = time.monotonic()
+        with self.mutex:
+            window = self.windows.get(key)
+            if window is None or now - window[0] >= self.interval:
+                if window is None and len(self.windows) >= MAX_TRACKED_MESSAGES:
+                    self.windows.clear()
+                suppressed = window[2] if window is not None else 0
+                # [start of the interval, messages passed, messages suppressed]
+                self.windows[key] = [now, 1, 0]
+                record.suppressed = suppressed
+                return True
+            if window[1] < self.burst:
+                window[1] += 1
+                return True
+            window[2] += 1
+        DROPPED_MESSAGES.inc(reason="rate_limit")
+        return False
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    # a full queue drops the message instead of blocking the thread which logs it
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            DROPPED_MESSAGES.inc(reason="queue_full")
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # the message is formatted by the listener, in its thread
+        return record
+
+
+class AsyncLog:
+    def __init__(self):
+        self.logger = logging.getLogger(ROOT)
+        self.logger.propagate = False
+        self.listener = None
+        self.handler = None
+        self.mutex = threading.Lock()
+        self.configure({})
+        atexit.register(self.stop)
+
+    def configure(self, loggingConfig: dict):
+        # replaces the handler and the listener, flushing the messages already queued
+        with self.mutex:
+            self.stop()
+            streamHandler = logging.StreamHandler(sys.stderr)
+            streamHandler.setFormatter(FORMATTERS[loggingConfig.get('format', 'text')]())
+            logQueue = queue.Queue(maxsize=loggingConfig.get('queue_size', 10000))
+            self.handler = NonBlockingQueueHandler(logQueue)
+            self.handler.addFilter(RateLimitFilter(loggingConfig.get('rate_limit_interval', 10),
+                                                   loggingConfig.get('rate_limit_burst', 5)))
+            self.logger.addHandler(self.handler)
+            self.logger.setLevel(LEVELS[loggingConfig.get('level', 'info')])
+            for name in list(logging.Logger.manager.loggerDict.keys()):
+                if name.startswith(ROOT + "."):
+                    logging.getLogger(name).setLevel(logging.NOTSET)
+            for component, level in loggingConfig.get('components', {}).items():
+                logging.getLogger(f"{ROOT}.{component}").setLevel(LEVELS[level])
+            self.listener = logging.handlers.QueueListener(logQueue, streamHandler)
+            self.listener.start()
+
+    def stop(self):
+        # writes the messages still in the queue
+        if self.listener is not None:
+            self.logger.removeHandler(self.handler)
+            self.listener.stop()
+            self.listener = None
+
+
+ASYNC_LOG = AsyncLog()
+
+
+def component_of(module_name: str) -> str:
+    if module_name == "__main__":
+        return os.path.splitext(os.path.basename(sys.argv[0]))[0] or "main"
+    return module_name.rsplit(".", 1)[-1]
+
+
+def emit(component: str, level: int, message: str):
+    logger = logging.getLogger(f"{ROOT}.{component}")
+    if logger.isEnabledFor(level):
+        logger.log(level, message)
+
+
+def configure(config: dict):
+    ASYNC_LOG.configure(config.get('logging', {}))
+
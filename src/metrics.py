@@ -0,0 +1,217 @@
+import threading
+import time
+from bisect import bisect_left
+from functools import wraps
+
+"""
+Minimal Prometheus-style metrics, exposed in text format by the /metrics endpoint.
+Metrics are declared at module level by the modules which update them, e.g.:
+SUBMISSION_SECONDS = metrics.histogram("adkihon_submission_seconds", "Latency of flag submissions")
+Each update is a few operations in a critical section of a per-metric mutex, so that the metrics
+can stay enabled during a game; this module must not import other modules of the project,
+because it's imported by all of them.
+"""
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+SIZE_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000)
+
+# mapping: {metric_name: metric}, in order of declaration
+REGISTRY = {}
+registryMutex = threading.Lock()
+
+
+def escape(label_value) -> str:
+    return str(label_value).replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+
+
+def format_labels(label_names: tuple, label_values: tuple, extra: str = "") -> str:
+    labels = [f'{name}="{escape(value)}"' for name, value in zip(label_names, label_values)]
+    if extra:
+        labels.append(extra)
+    if len(labels) == 0:
+        return ""
+    return "{" + ",".join(labels) + "}"
+
+
+def format_value(value) -> str:
+    if value == float('inf'):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+class Metric:
+    metric_type = "untyped"
+
+    def __init__(self, name: str, documentation: str, label_names: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelNames = tuple(label_names)
+        self.mutex = threading.Lock()
+        # mapping: {label_values: value}
+        self.values = {}
+
+    def labelValues(self, labels: dict) -> tuple:
+        return tuple(labels.get(name, "") for name in self.labelNames)
+
+    def samples(self):
+        # list of (suffix, label_values, extra_label, value)
+        with self.mutex:
+            return [("", key, "", value) for key, value in self.values.items()]
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.metric_type}"]
+        for suffix, label_values, extra, value in self.samples():
+            lines.append(f"{self.name}{suffix}{format_labels(self.labelNames, label_values, extra)} "
+                         f"{format_value(value)}")
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    metric_type = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self.labelValues(labels)
+        with self.mutex:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def get(self, **labels):
+        return self.values.get(self.labelValues(labels), 0)
+
+
+class Gauge(Metric):
+    metric_type = "gauge"
+
+    def set(self, value, **labels):
+        key = self.labelValues(labels)
+        with self.mutex:
+            self.values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self.labelValues(labels)
+        with self.mutex:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def get(self, **labels):
+        return self.values.get(self.labelValues(labels), 0)
+
+
+class GaugeFunc(Metric):
+    # gauge whose value is read by calling a function at each scrape, e.g. the size of a queue
+    metric_type = "gauge"
+
+    def __init__(self, name: str, documentation: str, func):
+        super().__init__(name, documentation)
+        self.func = func
+
+    def samples(self):
+        try:
+            return [("", (), "", self.func())]
+        except Exception:
+            return []
+
+
+class Histogram(Metric):
+    metric_type = "histogram"
+
+    def __init__(self, name: str, documentation: str, label_names: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, label_names)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self.labelValues(labels)
+        # index of the first bucket whose upper bound is >= value; len(buckets) is the +Inf bucket
+        index = bisect_left(self.buckets, value)
+        with self.mutex:
+            state = self.values.get(key)
+            if state is None:
+                # [per-bucket counts, sum, count]
+                state = [[0] * (len(self.buckets) + 1), 0, 0]
+                self.values[key] = state
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def time(self, **labels):
+        return Timer(self, labels)
+
+    def get(self, **labels):
+        # returns (count, sum)
+        state = self.values.get(self.labelValues(labels))
+        if state is None:
+            return 0, 0
+        return state[2], state[1]
+
+    def samples(self):
+        with self.mutex:
+            states = [(key, list(state[0]), state[1], state[2]) for key, state in self.values.items()]
+        samples = []
+        for key, counts, total, count in states:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                samples.append(("_bucket", key, f'le="{format_value(float(bound))}"', cumulative))
+            samples.append(("_sum", key, "", total))
+            samples.append(("_count", key, "", count))
+        return samples
+
+
+class Timer:
+    # context manager and decorator to observe the duration of a block of code in a histogram
+    def __init__(self, histogram: Histogram, labels: dict):
+        self.histogram = histogram
+        self.labels = labels
+        self.start = 0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.histogram.observe(time.perf_counter() - self.start, **self.labels)
+
+    def __call__(self, func):
+        @wraps(func)
+        def timed(*args, **kwargs):
+            with Timer(self.histogram, self.labels):
+                return func(*args, **kwargs)
+        return timed
+
+
+def register(metric: Metric):
+    # declaring twice a metric with the same name returns the first one, e.g. if a module is reloaded;
+    # for GaugeFunc, the function is replaced, so that it reads from the last registered object
+    with registryMutex:
+        if metric.name in REGISTRY:
+            existing = REGISTRY[metric.name]
+            if isinstance(metric, GaugeFunc) and isinstance(existing, GaugeFunc):
+                existing.func = metric.func
+            return existing
+        REGISTRY[metric.name] = metric
+        return metric
+
+
+def counter(name: str, documentation: str, label_names: tuple = ()) -> Counter:
+    return register(Counter(name, documentation, label_names))
+
+
+def gauge(name: str, documentation: str, label_names: tuple = ()) -> Gauge:
+    return register(Gauge(name, documentation, label_names))
+
+
+def gauge_func(name: str, documentation: str, func) -> GaugeFunc:
+    return register(GaugeFunc(name, documentation, func))
+
+
+def histogram(name: str, documentation: str, label_names: tuple = (), buckets: tuple = DEFAULT_BUCKETS) -> Histogram:
+    return register(Histogram(name, documentation, label_names, buckets))
+
+
+def render() -> str:
+    with registryMutex:
+        metrics = list(REGISTRY.values())
+    return "\n".join(metric.render() for metric in metrics) + "\n"
@@ -1,10 +1,21 @@
 import pymongo
 from pymongo.database import Database
 from pymongo.collection import Collection
-from pymongo.errors import DuplicateKeyError
+from pymongo.errors import DuplicateKeyError, BulkWriteError
+from pymongo import UpdateOne
 
 from checker_lib import OK, MUMBLE, CORRUPT, DOWN, ERROR
 import project_utils
+import metrics
+
+
+MONGO_OP_SECONDS = metrics.histogram("adkihon_mongo_op_seconds",
+                                     "Latency of MongoDB operations, by function of mongo_utils", ("op",))
+
+
+DUPLICATE_KEY_ERROR = 11000
+# flags of expired rounds are moved from the "flag" collection to this one (see FlagArchiver)
+FLAG_ARCHIVE = "flag_archive"
 
 
 class AlreadyExistentFlagOrSeed(Exception):
@@ -19,6 +30,11 @@ class InvalidUpdate(Exception):
     pass
 
 
+def timed(func):
+    # decorator for the functions of this module which make operations on the DB
+    return MONGO_OP_SECONDS.time(op=func.__name__)(func)
+
+
 def get_db_manager(mongo_config, mongo_client=None):
     # the mongo_client implements a connection pool, so the idea is to have one instance of it where possible
     if mongo_client is None:
@@ -41,11 +57,27 @@ def get_collection(db: Database, collection_name: str) -> Collection:
     return db.get_collection(collection_name)
 
 
+@timed
 def create_index(db: Database, collection_name: str, column_name: str):
     col = db.get_collection(collection_name)
-    col.create_index([(column_name, pymongo.TEXT)], unique=True)
+    col.create_index([(column_name, pymongo.ASCENDING)], unique=True)
+
 
+@timed
+def create_flag_indexes(db: Database):
+    # the archive has the same unique index of the flag collection, which serves the lookups of the submitted
+    # flags (equality and $in); both are also indexed by round
+    create_index(db, collection_name='flag', column_name='flag_data')
+    create_index(db, collection_name=FLAG_ARCHIVE, column_name='flag_data')
+    for collection_name in ["flag", FLAG_ARCHIVE]:
+        col = db.get_collection(collection_name)
+        col.create_index([("round_num", pymongo.ASCENDING)])
+        # the DBs of previous versions have a text index on flag_data, which can't serve the lookups
+        if "flag_data_text" in col.index_information():
+            col.drop_index("flag_data_text")
 
+
+@timed
 def insert_flag(db: Database, flag_data: str, seed: str, round_num: int, team_id: int, service_id: int):
     col = db.get_collection("flag")
     try:
@@ -55,30 +87,131 @@ def insert_flag(db: Database, flag_data: str, seed: str, round_num: int, team_id
         raise AlreadyExistentFlagOrSeed
 
 
-def get_flag_by_data(db: Database, flag_data: str):
+@timed
+def insert_flags(db: Database, flags: list):
+    # flags: list of flag documents, like the ones inserted by insert_flag;
+    # the insert is unordered, so a duplicated flag doesn't stop the others: it returns the indexes
+    # (in the list) of the flags which haven't been inserted because they already exist
     col = db.get_collection("flag")
-    flag = col.find_one({"flag_data": flag_data})
+    try:
+        col.insert_many(flags, ordered=False)
+    except BulkWriteError as e:
+        errors = e.details['writeErrors']
+        if any(error['code'] != DUPLICATE_KEY_ERROR for error in errors):
+            raise
+        return [error['index'] for error in errors]
+    return []
+
+
+def find_flag(db: Database, query: dict):
+    # looks for the flag in the flag collection, then in the archive; flags are archived by copying them
+    # before deleting them, so a flag which is not found in the first one is already in the archive
+    flag = db.get_collection("flag").find_one(query)
+    if flag is None:
+        flag = db.get_collection(FLAG_ARCHIVE).find_one(query)
+    return flag
+
+
+@timed
+def get_flag_by_data(db: Database, flag_data: str):
+    flag = find_flag(db, {"flag_data": flag_data})
     if flag is None:
         raise NotExistentDocument
     return flag
 
 
+@timed
 def get_flag_for_round(db: Database, round_num: int, team_id: int, service_id: int):
-    col = db.get_collection("flag")
-    flag = col.find_one({"round_num": round_num, "team_id": team_id, "service_id": service_id})
+    flag = find_flag(db, {"round_num": round_num, "team_id": team_id, "service_id": service_id})
     if flag is None:
         raise NotExistentDocument
     return flag
 
 
+@timed
+def get_flags_for_round(db: Database, round_num: int):
+    flags = [flag for flag in db.get_collection("flag").find({"round_num": round_num})]
+    if len(flags) == 0:
+        flags = [flag for flag in db.get_collection(FLAG_ARCHIVE).find({"round_num": round_num})]
+    return flags
+
+
+@timed
+def get_flags_for_rounds(db: Database, first_round: int, last_round: int):
+    # flags of all the rounds in [first_round, last_round], also archived ones; a flag being archived
+    # can be in both collections, so it's returned once
+    query = {"round_num": {"$gte": first_round, "$lte": last_round}}
+    flags = {flag['flag_data']: flag for flag in db.get_collection(FLAG_ARCHIVE).find(query)}
+    flags.update((flag['flag_data'], flag) for flag in db.get_collection("flag").find(query))
+    return list(flags.values())
+
+
+@timed
+def get_flags_by_data(db: Database, flag_data: list):
+    # {flag_data: flag} of the flags which exist, also archived ones
+    query = {"flag_data": {"$in": list(flag_data)}}
+    flags = {flag['flag_data']: flag for flag in db.get_collection(FLAG_ARCHIVE).find(query)}
+    flags.update((flag['flag_data'], flag) for flag in db.get_collection("flag").find(query))
+    return flags
+
+
+@timed
+def archive_flags(db: Database, before_round: int, batch_size: int = 10000):
+    # moves up to batch_size flags of the rounds before before_round to the archive, and returns their number;
+    # they're copied and then deleted, so if the process dies in the middle the copy is repeated at the next call,
+    # with the duplicates ignored, and no flag is lost
+    col = db.get_collection("flag")
+    flags = [flag for flag in col.find({"round_num": {"$lt": before_round}}).limit(batch_size)]
+    if len(flags) == 0:
+        return 0
+    try:
+        db.get_collection(FLAG_ARCHIVE).insert_many(flags, ordered=False)
+    except BulkWriteError as e:
+        if any(error['code'] != DUPLICATE_KEY_ERROR for error in e.details['writeErrors']):
+            raise
+    col.delete_many({"_id": {"$in": [flag['_id'] for flag in flags]}})
+    return len(flags)
+
+
+@timed
+def count_stolen_flags(db: Database):
+    col = db.get_collection("team")
+    result = list(col.aggregate([{"$group": {"_id": None, "total": {"$sum": {"$size": "$stolen_flags"}}}}]))
+    return result[0]['total'] if len(result) > 0 else 0
+
+
+@timed
+def get_attack_stats(db: Database):
+    # the attack statistics are a single document (see AttackStats), None if they were never saved
+    return db.get_collection("attack_stats").find_one({"_id": "attacks"})
+
+
+@timed
+def save_attack_stats(db: Database, stats: dict):
+    db.get_collection("attack_stats").replace_one({"_id": "attacks"}, stats, upsert=True)
+
+
+@timed
 def insert_team_if_not_exists(db: Database, team_id: int, ip_addr: str, name: str, token: str):
     # ip_addr can also be an hostname
     col = db.get_collection("team")
-    team = col.find_one({"team_id": team_id})
-    if team is not None:
-        return
-    col.insert_one({"team_id": team_id, "ip_addr": ip_addr, "name": name, "token": token,
-                    "points": [], "stolen_flags": [], "lost_flags": [], "checks": [], "last_pts_update": 0})
+    col.update_one(*team_upsert(team_id, ip_addr, name, token), upsert=True)
+
+
+def team_upsert(team_id: int, ip_addr: str, name: str, token: str):
+    # filter and update which insert the team only if it doesn't exist, in a single operation
+    return {"team_id": team_id}, {"$setOnInsert": {"team_id": team_id, "ip_addr": ip_addr, "name": name, "token": token,
+                                                   "points": [], "stolen_flags": [], "lost_flags": [], "checks": [],
+                                                   "last_pts_update": 0}}
+
+
+@timed
+def insert_teams_if_not_exist(db: Database, teams: list):
+    # bulk version of insert_team_if_not_exists, for the teams of the configuration
+    requests = [UpdateOne(*team_upsert(team['id'], team['host'], team['name'], team['token']), upsert=True)
+                for team in teams]
+    if len(requests) > 0:
+        db.get_collection("team").bulk_write(requests, ordered=False)
 
 
 def get_teams(db: Database):
@@ -87,12 +220,21 @@ def get_teams(db: Database):
     return teams
 
 
+@timed
 def insert_service_if_not_exists(db: Database, service_id: int, port: int, name: str):
     col = db.get_collection("service")
-    service = col.find_one({"service_id": service_id})
-    if service is not None:
-        return
-    col.insert_one({"service_id": service_id, "port": port, "name": name})
+    col.update_one({"service_id": service_id},
+                   {"$setOnInsert": {"service_id": service_id, "port": port, "name": name}}, upsert=True)
+
+
+@timed
+def insert_services_if_not_exist(db: Database, services: list):
+    # bulk version of insert_service_if_not_exists, for the services of the configuration
+    requests = [UpdateOne({"service_id": service['id']}, {"$setOnInsert": {
+        "service_id": service['id'], "port": service['port'], "name": service['name']}}, upsert=True)
+                for service in services]
+    if len(requests) > 0:
+        db.get_collection("service").bulk_write(requests, ordered=False)
 
 
 def get_services(db: Database):
@@ -101,21 +243,24 @@ def get_services(db: Database):
     return services
 
 
+@timed
 def init_teams_points(db: Database):
-    # this function silently checks if team points had already been initialized
+    # this function silently checks if team points had already been initialized;
+    # the points of the missing services are pushed with a single bulk write
     team_col = db.get_collection("team")
-    teams = get_teams(db)
-    services = [s for s in get_services(db)]
-    for team in teams:
-        for service in services:
-            check = team_col.find_one({"team_id": team['team_id'],
-                                       "points.service_id": service['service_id']})
-            if check is None:
-                team_col.update_one({"team_id": team['team_id']}, {"$push": {
-                    "points": {"service_id": service['service_id'], "atk_pts": 0, "def_pts": 0, "sla_pts": 0}
-                }})
-
-
+    service_ids = [s['service_id'] for s in get_services(db)]
+    requests = []
+    for team in team_col.find({}, {"team_id": 1, "points": 1}):
+        initialized = {pts['service_id'] for pts in team['points']}
+        missing = [{"service_id": service_id, "atk_pts": 0, "def_pts": 0, "sla_pts": 0}
+                   for service_id in service_ids if service_id not in initialized]
+        if len(missing) > 0:
+            requests.append(UpdateOne({"team_id": team['team_id']}, {"$push": {"points": {"$each": missing}}}))
+    if len(requests) > 0:
+        team_col.bulk_write(requests, ordered=False)
+
+
+@timed
 def check_stolen_flag(db: Database, team_token: str, flag_data: str):
     # assumes that flag_data is in some flag document
     col = db.get_collection("team")
@@ -125,14 +270,18 @@ def check_stolen_flag(db: Database, team_token: str, flag_data: str):
     return team
 
 
-def push_stolen_flag(db: Database, team_token: str, flag_data: str, timestamp: int):
-    # assumes that necessary checks were already made
+@timed
+def push_stolen_flag(db: Database, team_token: str, flag_data: str, timestamp: int) -> bool:
+    # assumes that the other checks were already made; the update is conditional on the flag not being already
+    # stolen by the team, so that it's atomic: it returns False if the flag was already there
     col = db.get_collection("team")
-    col.update_one({"token": team_token}, {"$push": {
+    res = col.update_one({"token": team_token, "stolen_flags.flag_data": {"$ne": flag_data}}, {"$push": {
         "stolen_flags": {"flag_data": flag_data, "timestamp": timestamp}
     }})
+    return res.modified_count == 1
 
 
+@timed
 def push_lost_flag(db: Database, team_id: int, flag_data: str, timestamp: int):
     # uses team_id because the flag submission service verifies each flag by querying it,
     # and by doing so it obtains the team_id (the team token is given by the attacker)
@@ -142,6 +291,7 @@ def push_lost_flag(db: Database, team_id: int, flag_data: str, timestamp: int):
     }})
 
 
+@timed
 def push_check(db: Database, team_id: int, service_id: int, status: str, timestamp: int):
     col = db.get_collection("team")
     col.update_one({"team_id": team_id}, {"$push": {
@@ -149,6 +299,50 @@ def push_check(db: Database, team_id: int, service_id: int, status: str, timesta
     }})
 
 
+@timed
+def push_checks(db: Database, checks: list):
+    # batched version of push_check: checks are grouped by team, with a single $push for each team,
+    # and all the updates are sent to the DB in one unordered bulk write
+    col = db.get_collection("team")
+    team_checks = {}
+    for check in checks:
+        team_checks.setdefault(check['team_id'], []).append(
+            {"service_id": check['service_id'], "status": check['status'], "timestamp": check['timestamp']})
+    # it returns the checks which were not written, i.e. the ones of the teams whose update failed
+    team_ids = list(team_checks.keys())
+    requests = [UpdateOne({"team_id": team_id}, {"$push": {"checks": {"$each": team_checks[team_id]}}})
+                for team_id in team_ids]
+    if len(requests) == 0:
+        return []
+    try:
+        col.bulk_write(requests, ordered=False)
+    except BulkWriteError as e:
+        failed = {team_ids[error['index']] for error in e.details['writeErrors']}
+        return [check for check in checks if check['team_id'] in failed]
+    return []
+
+
+@timed
+def create_trace_indexes(db: Database):
+    # the traces of a round are read by round number, see get_traces_for_round
+    db.get_collection("trace").create_index([("round_num", pymongo.ASCENDING)])
+
+
+@timed
+def insert_traces(db: Database, traces: list):
+    # traces of checkers' actions, see CheckerTracer
+    col = db.get_collection("trace")
+    if len(traces) > 0:
+        col.insert_many(traces, ordered=False)
+
+
+@timed
+def get_traces_for_round(db: Database, round_num: int):
+    col = db.get_collection("trace")
+    return [trace for trace in col.find({"round_num": round_num}, {"_id": 0})]
+
+
+@timed
 def update_points(db: Database, team_id: int, service_id: int, pts_type: str, increment: bool, timestamp: int):
     col = db.get_collection("team")
     if pts_type not in ["atk_pts", "def_pts", "sla_pts"]:
@@ -163,56 +357,60 @@ def update_points(db: Database, team_id: int, service_id: int, pts_type: str, in
     col.update_one({"team_id": team_id}, {"$set": {"last_pts_update": timestamp}})
 
 
+@timed
+def update_points_bulk(db: Database, points: dict, timestamps: dict):
+    # batched version of update_points: points is {(team_id, service_id): {pts_type: amount}}, with the increments
+    # already summed, and timestamps is {team_id: timestamp}; all the updates are sent in one unordered bulk write
+    col = db.get_collection("team")
+    requests = []
+    for (team_id, service_id), increments in points.items():
+        if any(pts_type not in ["atk_pts", "def_pts", "sla_pts"] for pts_type in increments):
+            raise InvalidUpdate
+        requests.append(UpdateOne({"team_id": team_id, "points.service_id": service_id},
+                                  {"$inc": {f"points.$.{pts_type}": amount for pts_type, amount in increments.items()}}))
+    requests += [UpdateOne({"team_id": team_id}, {"$max": {"last_pts_update": timestamp}})
+                 for team_id, timestamp in timestamps.items()]
+    if len(requests) > 0:
+        col.bulk_write(requests, ordered=False)
+
+
+@timed
 def resume_points(db: Database):
+    # the points are recomputed in memory from the stolen and lost flags and from the checks of each team,
+    # then they're written with a single bulk write, with an update for each team
     teams = [t for t in get_teams(db)]
     col = db.get_collection("team")
-    flags = {}
+    flags = get_flags_by_data(db, {rcvd['flag_data'] for team in teams for rcvd in team['lost_flags']} |
+                              {atk['flag_data'] for team in teams for atk in team['stolen_flags']})
+    sla_increments = {OK: 1, MUMBLE: -1, DOWN: -1, CORRUPT: -1}
+    requests = []
     for team in teams:
         # set to 0 before making the entire computation
-        for pts in team['points']:
-            service_id = pts['service_id']
-            col.update_one({"team_id": team['team_id'], "points.service_id": service_id},
-                           {"$set": {"points.$.atk_pts": 0, "points.$.def_pts": 0, "points.$.sla_pts": 0}})
+        points = {pts['service_id']: {"service_id": pts['service_id'], "atk_pts": 0, "def_pts": 0, "sla_pts": 0}
+                  for pts in team['points']}
         max_timestamp = 0
-        attacks = [i for i in team['stolen_flags']]
-        for atk in attacks:
-            if atk['flag_data'] not in flags:
-                flag = get_flag_by_data(db, atk['flag_data'])
-                flags[atk['flag_data']] = flag
-            else:
-                flag = flags[atk['flag_data']]
-            service_id = flag['service_id']
-            timestamp = atk['timestamp']
-            if timestamp > max_timestamp:
-                max_timestamp = timestamp
-            update_points(db, team['team_id'], service_id, "atk_pts", True, timestamp)
-        defenses = [i for i in team['lost_flags']]
-        # it's called defenses but is "attacks received"
-        for rcvd in defenses:
-            if rcvd['flag_data'] not in flags:
-                flag = get_flag_by_data(db, rcvd['flag_data'])
-                flags[rcvd['flag_data']] = flag
-            else:
-                flag = flags[rcvd['flag_data']]
-            service_id = flag['service_id']
-            timestamp = rcvd['timestamp']
-            if timestamp > max_timestamp:
-                max_timestamp = timestamp
-            update_points(db, team['team_id'], service_id, "def_pts", False, timestamp)
-        checks = [i for i in team['checks']]
-        for check in checks:
+
+        def add(service_id, pts_type, amount, timestamp):
+            nonlocal max_timestamp
+            max_timestamp = max(max_timestamp, timestamp)
+            if service_id in points:
+                points[service_id][pts_type] += amount
+        # lost flags are the attacks received
+        for pts_type, amount, history in [("atk_pts", 1, team['stolen_flags']), ("def_pts", -1, team['lost_flags'])]:
+            for entry in history:
+                flag = flags.get(entry['flag_data'])
+                if flag is None:
+                    project_utils.log(f"Error: flag {entry['flag_data']} not found while resuming points")
+                    continue
+                add(flag['service_id'], pts_type, amount, entry['timestamp'])
+        for check in team['checks']:
             if check['status'] == ERROR:
                 continue
-            elif check['status'] == OK:
-                increment = True
-            elif check['status'] in [MUMBLE, DOWN, CORRUPT]:
-                increment = False
-            else:
+            elif check['status'] not in sla_increments:
                 project_utils.log(f"Found an invalid check status ( {check['status']} ) while resuming points")
                 continue
-            service_id = check['service_id']
-            timestamp = check['timestamp']
-            if timestamp > max_timestamp:
-                max_timestamp = timestamp
-            update_points(db, team['team_id'], service_id, "sla_pts", increment, timestamp)
-        col.update_one({"team_id": team["team_id"]}, {"$set": {"last_pts_update": max_timestamp}})
+            add(check['service_id'], "sla_pts", sla_increments[check['status']], check['timestamp'])
+        requests.append(UpdateOne({"team_id": team['team_id']}, {"$set": {
+            "points": [points[pts['service_id']] for pts in team['points']], "last_pts_update": max_timestamp}}))
+    if len(requests) > 0:
+        col.bulk_write(requests, ordered=False)
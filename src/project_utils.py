@@ -1,14 +1,32 @@
-from sys import stderr
+import sys
 import json
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
 from functools import wraps
 from flask import Response
+try:
+    # optional fast JSON backend, with fallback on the standard library
+    import orjson
+except ImportError:
+    orjson = None
 
 # not "from mongo_utils import .." because it gives import error in other modules
 import mongo_utils
+import logger
 
 
-def log(message: str):
-    print(f"[+] {message}", file=stderr)
+def log(message: str, level: int = None):
+    # asynchronous, see logger.py; the component is the module of the caller and, if the level is not given,
+    # it's inferred from the message as in the rest of the project, i.e. "Error: ..." and "Warning: ..."
+    if level is None:
+        if message.startswith("Error"):
+            level = logging.ERROR
+        elif message.startswith("Warning"):
+            level = logging.WARNING
+        else:
+            level = logging.INFO
+    logger.emit(logger.component_of(sys._getframe(1).f_globals.get('__name__', '')), level, message)
 
 
 def read_config():
@@ -17,21 +35,50 @@ def read_config():
     return config
 
 
+def json_dumps(obj) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj).encode()
+
+
+def json_loads(data):
+    # both backends raise a subclass of ValueError on invalid input
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
 def json_response(msg_dict, status_code):
-    res = Response(json.dumps(msg_dict), status=status_code, mimetype='application/json')
+    # msg_dict can also be an already encoded JSON, as bytes
+    body = msg_dict if isinstance(msg_dict, bytes) else json_dumps(msg_dict)
+    res = Response(body, status=status_code, mimetype='application/json')
     return res
 
 
-def init_or_resume_mongo(config):
-    # all these operations are safe, i.e. they are silently okay if db is being resumed
+def init_or_resume_mongo(config, phases: dict = None):
+    # all these operations are safe, i.e. they are silently okay if db is being resumed.
+    # Teams, services and flag indexes are independent, so they're written concurrently, while the points need
+    # the teams and the services; the duration of each phase is logged and, if given, stored in phases
+    phases = phases if phases is not None else {}
     db, _ = mongo_utils.get_db_manager(config['mongo'])
-    for team in config['teams']:
-        mongo_utils.insert_team_if_not_exists(db, team['id'], team['host'], team['name'], team['token'])
-    for service in config['services']:
-        mongo_utils.insert_service_if_not_exists(db, service['id'], service['port'], service['name'])
-    mongo_utils.init_teams_points(db)
-    mongo_utils.create_index(db, collection_name='flag', column_name='flag_data')
-    mongo_utils.resume_points(db)
+
+    def phase(name: str, func, *args):
+        start = time.perf_counter()
+        func(*args)
+        phases[name] = time.perf_counter() - start
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        indexes = executor.submit(phase, "flag_indexes", mongo_utils.create_flag_indexes, db)
+        teams = executor.submit(phase, "teams", mongo_utils.insert_teams_if_not_exist, db, config['teams'])
+        services = executor.submit(phase, "services", mongo_utils.insert_services_if_not_exist, db, config['services'])
+        # result() raises the exception of the phase, if any
+        teams.result()
+        services.result()
+        phase("teams_points", mongo_utils.init_teams_points, db)
+        phase("resume_points", mongo_utils.resume_points, db)
+        indexes.result()
+    breakdown = ", ".join(f"{name} {seconds:.3f}s" for name, seconds in phases.items())
+    log(f"DB initialized in {time.perf_counter() - start:.3f}s ({breakdown})")
 
 
 def catch_error(func):
@@ -41,7 +88,7 @@ def catch_error(func):
             return func(*args, **kwargs)
         except Exception as e:
             err_log = "Exception in {}: {} {}\n".format(func.__name__, e.__class__.__name__, str(e))
-            log(err_log)
+            log(err_log, logging.ERROR)
             msg = {"error": "Generic error"}
             return json_response(msg, 500)
     return exceptionLogger
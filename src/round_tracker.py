@@ -0,0 +1,110 @@
+import collections
+import threading
+
+from game_clock import Clock, REAL_CLOCK
+from project_utils import log
+import metrics
+
+
+# rounds kept in memory while they have outstanding checks; older ones are dropped anyway
+MAX_TRACKED_ROUNDS = 100
+# factor applied to the checkers' window after an overrun, and its inverse after a round in time
+WINDOW_SHRINK = 0.75
+
+ROUND_OVERRUNS = metrics.counter("adkihon_round_overruns_total",
+                                 "Rounds whose checks were still running when the next round started")
+CANCELLED_CHECKS = metrics.counter("adkihon_cancelled_checks_total",
+                                   "Checks cancelled because their flag expired before they ran, by service",
+                                   ("service",))
+
+
+class CheckCancelled(Exception):
+    pass
+
+
+class RoundJobs:
+    def __init__(self, start: float, outstanding: int):
+        self.start = start
+        self.outstanding = outstanding
+        self.lastDone = None
+        self.overran = False
+
+
+class RoundTracker:
+    # tracks the outstanding checker jobs of each round: when a round starts, the previous one is reported as
+    # overrun if some of its checks are still running, and the actions of checks whose flag has expired are
+    # cancelled before they start (see CheckScheduler.runAction). If adaptive_window is enabled, the window
+    # in which the actions of a round are planned shrinks after a round whose tail, i.e. the completion of
+    # its last check, exceeded overrun_threshold of the round time, and grows back after a round in time
+    def __init__(self, config: dict, clock: Clock = REAL_CLOCK):
+        misc = config['misc']
+        self.clock = clock
+        self.roundTime = misc['round_time']
+        self.flagLifetime = misc['flag_lifetime']
+        self.adaptive = misc.get('adaptive_window', False)
+        self.threshold = misc.get('overrun_threshold', 0.9)
+        self.minScale = misc.get('min_window_scale', 0.25)
+        self.scale = 1.0
+        self.currentRound = 0
+        self.rounds = collections.OrderedDict()
+        self.mutex = threading.Lock()
+        metrics.gauge_func("adkihon_outstanding_checks", "Checks of the previous rounds still running",
+                           self.numOutstanding)
+        metrics.gauge_func("adkihon_window_scale", "Scale factor of the checkers' window", lambda: self.scale)
+
+    def numOutstanding(self):
+        with self.mutex:
+            return sum(jobs.outstanding for roundNum, jobs in self.rounds.items() if roundNum < self.currentRound)
+
+    def outstanding(self, roundNum: int):
+        with self.mutex:
+            jobs = self.rounds.get(roundNum)
+            return jobs.outstanding if jobs is not None else 0
+
+    def isExpired(self, flagRound: int):
+        # a flag is valid for its round and the next flag lifetime rounds
+        return self.currentRound > flagRound + self.flagLifetime
+
+    def review(self, roundNum: int):
+        # returns True if the round overran, or if its tail exceeded the threshold
+        jobs = self.rounds.get(roundNum)
+        if jobs is None:
+            return False
+        if jobs.outstanding > 0:
+            jobs.overran = True
+            ROUND_OVERRUNS.inc()
+            log(f"Warning: round {roundNum} overran, {jobs.outstanding} of its checks are still running")
+            return True
+        return jobs.lastDone is not None and jobs.lastDone - jobs.start > self.threshold * self.roundTime
+
+    def startRound(self, roundNum: int, start: float, numJobs: int):
+        # registers the jobs of the new round, reviews the previous one, and returns the scale of the window
+        with self.mutex:
+            late = self.review(roundNum - 1)
+            stuck = sum(jobs.outstanding for r, jobs in self.rounds.items() if r < roundNum - 1)
+            if stuck > 0:
+                log(f"Warning: {stuck} checks of rounds before {roundNum - 1} are still running")
+            if self.adaptive:
+                scale = max(self.minScale, self.scale * WINDOW_SHRINK) if late else min(1.0, self.scale / WINDOW_SHRINK)
+                if scale != self.scale:
+                    log(f"Checkers' window of round {roundNum} scaled to {scale:.2f} of its size")
+                self.scale = scale
+            self.currentRound = roundNum
+            self.rounds[roundNum] = RoundJobs(start, numJobs)
+            for oldRound in [r for r, jobs in self.rounds.items() if r < roundNum - 1 and jobs.outstanding == 0]:
+                del self.rounds[oldRound]
+            while len(self.rounds) > MAX_TRACKED_ROUNDS:
+                self.rounds.popitem(last=False)
+            return self.scale
+
+    def jobDone(self, roundNum: int):
+        with self.mutex:
+            jobs = self.rounds.get(roundNum)
+            if jobs is not None:
+                jobs.outstanding -= 1
+                jobs.lastDone = self.clock.time()
+
+    def checkNotExpired(self, flagRound: int, service: dict):
+        if self.isExpired(flagRound):
+            CANCELLED_CHECKS.inc(service=service['name'])
+            raise CheckCancelled
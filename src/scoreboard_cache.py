@@ -1,7 +1,16 @@
-import time
 import threading
 
 from mongo_utils import get_db_manager, get_teams, get_services
+from project_utils import json_dumps
+from game_clock import Clock, REAL_CLOCK
+from scoring_engine import ScoringEngine
+from event_dispatcher import EventDispatcher
+from event_queue import STATUS_CODES
+import metrics
+
+
+SCOREBOARD_REFRESH_SECONDS = metrics.histogram("adkihon_scoreboard_refresh_seconds",
+                                               "Duration of the scoreboard cache's refresh from MongoDB")
 
 
 class ConcurrentUpdateException(Exception):
@@ -9,7 +18,8 @@ class ConcurrentUpdateException(Exception):
 
 
 class ScoreboardCache:
-    def __init__(self, config: dict):
+    def __init__(self, config: dict, clock: Clock = REAL_CLOCK):
+        self.clock = clock
         db, mongo_client = get_db_manager(config['mongo'])
         self.mongoClient = mongo_client
         self.mongoConfig = config['mongo']
@@ -19,9 +29,15 @@ class ScoreboardCache:
         self.slaWeight = config['misc']['sla_weight']
         self.baseScore = config['misc']['base_score']
         self.services = {s['service_id']: s for s in get_services(db)}
+        self.engine = ScoringEngine(config, self.services)
+        # the mutex of the dispatcher which updates the points of the engine, if any (see followEvents)
+        self.pointsMutex = None
+        self.scores = None
         self.lastUpdate = 0
-        self.teams = self.getTeams()
-        # this mutex is to make sure the teams update is not done concurrently
+        # the snapshot is (teams, teams JSON-encoded, columnar format JSON-encoded): the encodings are kept, so
+        # that each request doesn't pay the encoding of the same snapshot; it's replaced as a whole by refresh
+        self.snapshot = self.makeSnapshot()
+        # this mutex is to make sure the teams update is not done concurrently; readers never wait for it
         self.mutex = threading.Lock()
 
     def getTeams(self):
@@ -30,9 +46,26 @@ class ScoreboardCache:
         exposed_fields = {"ip_addr", "name", "points", "last_pts_update"}
         # this method "sanitizes" teams, by removing attributes that must not be publicly exposed,
         # like stolen_flags, and at the same time it adds "overall_score" field and
-        # service_status[service_name]['status'] for each service (for last status update)
+        # service_status[service_name]['status'] for each service (for last status update);
+        # scores, ranks and SLA percentages are computed for all the teams at once by the scoring engine
         teams = sorted([t for t in get_teams(db)], key=lambda t: t['team_id'])
-        for team in teams:
+        if self.pointsMutex is None:
+            self.engine.load(teams)
+        elif self.engine.needsPoints([team['team_id'] for team in teams]):
+            # the teams are read again while the dispatcher doesn't write, so that the engine starts from points
+            # which include all the batches written before, and none of the ones passed to it afterwards
+            with self.pointsMutex:
+                teams = sorted([t for t in get_teams(db)], key=lambda t: t['team_id'])
+                self.engine.load(teams)
+        else:
+            self.engine.load(teams, withPoints=False)
+        scores = self.engine.scores()
+        self.scores = scores
+        overall = [int(score) if score.is_integer() else round(score, 2) for score in scores.overall.tolist()]
+        ranks = scores.ranks.tolist()
+        slaPercent = (scores.slaRatio * 100).round(2).tolist()
+        serviceNames = [self.services[service_id]['name'] for service_id in self.engine.serviceIds]
+        for i, team in enumerate(teams):
             # mapping: {service_name: service_points}
             points = {self.services[service_points['service_id']]['name']: service_points
                       for service_points in team['points']}
@@ -47,36 +80,80 @@ class ScoreboardCache:
                     remove_keys.append(k)
             for k in remove_keys:
                 team.pop(k)
-            team['overall_score'] = self.baseScore
-            # note: def pts are assumed to be negative, so no need for "-=" or negative weight
-            for service_name in points.keys():
-                team['overall_score'] += points[service_name]['atk_pts'] * self.atkWeight
-                team['overall_score'] += points[service_name]['def_pts'] * self.defWeight
-                team['overall_score'] += points[service_name]['sla_pts'] * self.slaWeight
+            team['overall_score'] = overall[i]
+            team['rank'] = ranks[i]
+            team['sla'] = dict(zip(serviceNames, slaPercent[i]))
             team['service_status'] = {}
-            i = 0
-            while len(team['service_status']) < len(self.services) and i < len(team_checks):
-                check = team_checks[i]
+            c = 0
+            while len(team['service_status']) < len(self.services) and c < len(team_checks):
+                check = team_checks[c]
                 service_name = self.services[check['service_id']]['name']
                 if service_name not in team['service_status']:
                     team['service_status'][service_name] = check['status']
-                i += 1
-        self.lastUpdate = int(time.time())
+                c += 1
+        self.lastUpdate = int(self.clock.time())
         return teams
 
-    def getStats(self, wait=True):
-        # optimistic check
-        if int(time.time()) >= self.lastUpdate + self.updateLatency:
+    def getColumns(self, teams: list) -> dict:
+        # compact format of the snapshot, without repeated names and keys: team and service ids and names are in a
+        # header, and the other fields are arrays in the same order of the teams; points, SLA percentages and
+        # status codes are flat arrays with the services of the first team, then the ones of the second, and so on.
+        # Status codes are the ones of the events (see event_queue.STATUS_CODES), -1 if the service isn't checked
+        # yet. It must be called right after getTeams, because points are the ones of its scores
+        serviceNames = [self.services[service_id]['name'] for service_id in self.engine.serviceIds]
+        status = [STATUS_CODES.get(team['service_status'].get(service_name), -1)
+                  for team in teams for service_name in serviceNames]
+        return {
+            "team_ids": self.engine.teamIds,
+            "team_names": [team['name'] for team in teams],
+            "ip_addrs": [team['ip_addr'] for team in teams],
+            "service_ids": self.engine.serviceIds,
+            "service_names": serviceNames,
+            "status_names": [status_name for status_name, _ in sorted(STATUS_CODES.items(), key=lambda item: item[1])],
+            "overall_score": [team['overall_score'] for team in teams],
+            "rank": [team['rank'] for team in teams],
+            "last_pts_update": [team['last_pts_update'] for team in teams],
+            "atk_pts": self.scores.atk.ravel().tolist(),
+            "def_pts": self.scores.dfn.ravel().tolist(),
+            "sla_pts": self.scores.sla.ravel().tolist(),
+            "sla": [team['sla'][service_name] for team in teams for service_name in serviceNames],
+            "status": [int(code) for code in status]
+        }
+
+    def followEvents(self, dispatcher: EventDispatcher):
+        # the points of the scoring engine are then updated with the increments written by the dispatcher, instead
+        # of being read from the team documents at each refresh; they're read again only if the teams change,
+        # or if a write of the dispatcher failed
+        self.pointsMutex = dispatcher.pointsMutex
+        # the points loaded so far may miss the batches written meanwhile, so they're read again at the next refresh
+        self.engine.addPoints(None)
+        dispatcher.addPointsListener(self.engine.addPoints)
+
+    def makeSnapshot(self):
+        teams = self.getTeams()
+        return teams, json_dumps(teams), json_dumps(self.getColumns(teams))
+
+    def refresh(self, wait=True):
+        # optimistic check; the snapshot is computed by one thread at a time, without holding any lock which other
+        # readers wait for: in the meanwhile they get the previous snapshot, or an exception if wait is False
+        if int(self.clock.time()) >= self.lastUpdate + self.updateLatency:
             acquired = self.mutex.acquire(blocking=False)
             if acquired:
-                self.teams = self.getTeams()
-                self.mutex.release()
-            else:
-                if wait:
-                    # wait for the already running update to finish
-                    while self.mutex.locked():
-                        pass
-                else:
-                    # primarily used for testing
-                    raise ConcurrentUpdateException
-        return self.teams
+                try:
+                    with SCOREBOARD_REFRESH_SECONDS.time():
+                        snapshot = self.makeSnapshot()
+                    # a single assignment, so that readers never see a mix of two snapshots
+                    self.snapshot = snapshot
+                finally:
+                    self.mutex.release()
+            elif not wait:
+                # primarily used for testing
+                raise ConcurrentUpdateException
+        return self.snapshot
+
+    def getStats(self, wait=True):
+        return self.refresh(wait)[0]
+
+    def getEncodedStats(self, wait=True, columnar=False):
+        _, encodedTeams, encodedColumns = self.refresh(wait)
+        return encodedColumns if columnar else encodedTeams
@@ -0,0 +1,180 @@
+import itertools
+import threading
+from operator import itemgetter
+
+import numpy as np
+
+from checker_lib import ERROR
+from project_utils import log
+
+
+# linear: base_score + sum over services of weight * (atk * atk_weight + def * def_weight + sla * sla_weight)
+# sla_multiplicative: attack and defense points of each service count in proportion to its SLA ratio, i.e.
+#   base_score + sum over services of weight * ((atk * atk_weight + def * def_weight) * sla_ratio + sla * sla_weight)
+FORMULAS = ("linear", "sla_multiplicative")
+# fields of the points of a service, in the team documents
+POINT_FIELDS = ("service_id", "atk_pts", "def_pts", "sla_pts")
+
+
+class InvalidScoringFormula(Exception):
+    pass
+
+
+class Scores:
+    # scores of a snapshot, with the points they're computed from; arrays are indexed as ScoringEngine.teamIds
+    # and ScoringEngine.serviceIds
+    def __init__(self, overall: np.ndarray, ranks: np.ndarray, slaRatio: np.ndarray, atk: np.ndarray,
+                 dfn: np.ndarray, sla: np.ndarray):
+        self.overall = overall
+        self.ranks = ranks
+        self.slaRatio = slaRatio
+        self.atk = atk
+        self.dfn = dfn
+        self.sla = sla
+
+
+class ScoringEngine:
+    # keeps the attack, defense and SLA points, and the number of checks, as dense arrays indexed by
+    # (team, service), so that overall scores, ranks and SLA percentages are computed for all the teams at once.
+    # The points are read from the team documents, or updated with the increments written by the EventDispatcher
+    # (see addPoints), so that they're not read again at each load.
+    # The formula, the weight of each service and the decay of the value of stolen flags are configured in misc
+    def __init__(self, config: dict, services: dict):
+        misc = config['misc']
+        self.atkWeight = misc['atk_weight']
+        self.defWeight = misc['def_weight']
+        self.slaWeight = misc['sla_weight']
+        self.baseScore = misc['base_score']
+        self.formula = misc.get('scoring_formula', 'linear')
+        if self.formula not in FORMULAS:
+            log(f"Error: {self.formula} is an invalid scoring formula, valid ones are {FORMULAS}")
+            raise InvalidScoringFormula
+        # with a decay d < 1, the n-th flag stolen by a team from a service is worth d ** (n - 1) flags
+        self.flagDecay = misc.get('flag_decay', 1)
+        # services: {service_id: service document}; weights are given by service name and default to 1
+        serviceWeights = misc.get('service_weights', {})
+        self.serviceIds = sorted(services.keys())
+        self.serviceIndex = {service_id: j for j, service_id in enumerate(self.serviceIds)}
+        self.serviceIdArray = np.array(self.serviceIds, dtype=np.int64)
+        self.serviceWeights = np.array([serviceWeights.get(services[service_id]['name'], 1)
+                                        for service_id in self.serviceIds], dtype=np.float64)
+        self.teamIds = None
+        # the points arrays are replaced by load and updated by addPoints, which may run in different threads
+        self.mutex = threading.Lock()
+        # False until the points are read from the team documents, and after an update which may have been lost
+        self.pointsLoaded = False
+        self.load([])
+
+    def needsPoints(self, teamIds: list) -> bool:
+        # whether the next load must read the points from the team documents, instead of keeping the ones
+        # updated by addPoints
+        return not self.pointsLoaded or teamIds != self.teamIds
+
+    def load(self, teams: list, withPoints: bool = True):
+        # teams: documents of the team collection (see get_teams), with the points of each service and the checks;
+        # checks are only appended to the documents, so only the ones added since the previous load are counted.
+        # With withPoints False, the points updated by addPoints are kept, unless the teams changed.
+        # The arrays are allocated only when the teams change, then they're updated in place; each field of the
+        # points is read for all the teams at once, without a Python loop over the documents
+        shape = (len(teams), len(self.serviceIds))
+        teamIds = [team['team_id'] for team in teams]
+        with self.mutex:
+            if teamIds != self.teamIds:
+                self.teamIds = teamIds
+                self.teamIndex = {team_id: i for i, team_id in enumerate(teamIds)}
+                self.atk = np.zeros(shape, dtype=np.int64)
+                self.dfn = np.zeros(shape, dtype=np.int64)
+                self.sla = np.zeros(shape, dtype=np.int64)
+                self.checks = np.zeros(shape, dtype=np.int64)
+                self.counted = [0] * len(teams)
+                withPoints = True
+            if withPoints:
+                self.loadPoints(teams, shape)
+                self.pointsLoaded = True
+        checked = []
+        for i, team in enumerate(teams):
+            if len(team['checks']) == self.counted[i]:
+                continue
+            if len(team['checks']) < self.counted[i]:
+                self.checks[i] = 0
+                self.counted[i] = 0
+            # checks with an error of the checker are not counted in SLA points, so neither here
+            checked += [i * shape[1] + self.serviceIndex[c['service_id']] for c in team['checks'][self.counted[i]:]
+                        if c['status'] != ERROR and c['service_id'] in self.serviceIndex]
+            self.counted[i] = len(team['checks'])
+        if len(checked) > 0:
+            self.checks += np.bincount(checked, minlength=self.checks.size).reshape(shape)
+
+    def loadPoints(self, teams: list, shape: tuple):
+        points = list(itertools.chain.from_iterable(team['points'] for team in teams))
+        for array in (self.atk, self.dfn, self.sla):
+            array.fill(0)
+        if len(points) > 0 and shape[1] > 0:
+            serviceIds, atk, dfn, sla = [np.fromiter(map(itemgetter(field), points), dtype=np.int64, count=len(points))
+                                         for field in POINT_FIELDS]
+            rows = np.repeat(np.arange(shape[0]), [len(team['points']) for team in teams])
+            columns = np.minimum(np.searchsorted(self.serviceIdArray, serviceIds), shape[1] - 1)
+            # points of services which are not in the game anymore are ignored
+            known = self.serviceIdArray[columns] == serviceIds
+            rows, columns = rows[known], columns[known]
+            self.atk[rows, columns] = atk[known]
+            self.dfn[rows, columns] = dfn[known]
+            self.sla[rows, columns] = sla[known]
+
+    def addPoints(self, points: dict):
+        # points: {(team_id, service_id): {pts_type: amount}}, the increments of a batch of events already written
+        # to the DB (see EventDispatcher.aggregate); None if the write failed, since it may have been partially
+        # applied, so the points must be read again from the team documents. Increments which arrive before the
+        # points are loaded are already in the documents which are read (see ScoreboardCache.followEvents)
+        with self.mutex:
+            if not self.pointsLoaded:
+                return
+            if points is None:
+                self.pointsLoaded = False
+                return
+            if any(team_id not in self.teamIndex for team_id, _ in points):
+                # a new team: all the points are read again, with the new teams
+                self.pointsLoaded = False
+                return
+            # flat indexes and amounts of each type of points, added with a single operation per array
+            cells = {"atk_pts": ([], []), "def_pts": ([], []), "sla_pts": ([], [])}
+            for (team_id, service_id), increments in points.items():
+                # points of services which are not in the game anymore are ignored
+                if service_id in self.serviceIndex:
+                    cell = self.teamIndex[team_id] * len(self.serviceIds) + self.serviceIndex[service_id]
+                    for pts_type, amount in increments.items():
+                        cells[pts_type][0].append(cell)
+                        cells[pts_type][1].append(amount)
+            for array, (indexes, amounts) in zip((self.atk, self.dfn, self.sla), cells.values()):
+                if len(indexes) > 0:
+                    np.add.at(array.reshape(-1), indexes, amounts)
+
+    def slaRatio(self, sla: np.ndarray) -> np.ndarray:
+        # sla_pts = ok - not ok and checks = ok + not ok; a service not checked yet has ratio 1.
+        # Checks and points are persisted by different components, so the snapshot may be slightly inconsistent
+        ok = (self.checks + sla) / 2
+        ratio = np.divide(ok, self.checks, out=np.ones(self.checks.shape), where=self.checks > 0)
+        return np.clip(ratio, 0, 1)
+
+    def attackValue(self, atk: np.ndarray) -> np.ndarray:
+        if self.flagDecay == 1:
+            return atk.astype(np.float64)
+        # sum of the geometric series of the values of the stolen flags
+        return (1 - np.power(float(self.flagDecay), atk)) / (1 - self.flagDecay)
+
+    def scores(self) -> Scores:
+        # the points are copied, so that the scores are computed from a consistent snapshot of them, even while
+        # addPoints updates them
+        with self.mutex:
+            atk, dfn, sla = self.atk.copy(), self.dfn.copy(), self.sla.copy()
+        # note: def pts are assumed to be negative, so no need for a negative weight
+        slaRatio = self.slaRatio(sla)
+        offense = self.attackValue(atk) * self.atkWeight + dfn * self.defWeight
+        if self.formula == "sla_multiplicative":
+            offense = offense * slaRatio
+        perService = offense + sla * self.slaWeight
+        overall = self.baseScore + perService @ self.serviceWeights
+        # competition ranking: teams with the same score have the same rank, the next one skips
+        ascending = np.sort(overall)
+        ranks = len(overall) - np.searchsorted(ascending, overall, side='right') + 1
+        return Scores(overall, ranks, slaRatio, atk, dfn, sla)
@@ -0,0 +1,50 @@
+from werkzeug.serving import make_server as make_development_server
+
+from project_utils import log
+
+
+class UnknownServer(Exception):
+    pass
+
+
+class DevelopmentServer:
+    # Werkzeug's development server, which is what app.run uses: one thread per request, no keep-alive
+    def __init__(self, app, host: str, port: int, flask_config: dict):
+        self.server = make_development_server(host, port, app, threaded=True)
+
+    def run(self):
+        self.server.serve_forever()
+
+    def close(self):
+        self.server.shutdown()
+
+
+class WaitressServer:
+    # production server: a fixed pool of worker threads behind an asynchronous I/O loop, with keep-alive;
+    # it still runs in a single process, so the Services singleton is shared by all the requests
+    def __init__(self, app, host: str, port: int, flask_config: dict):
+        # imported here because it's needed only in this mode
+        from waitress import create_server
+        self.server = create_server(app, host=host, port=port,
+                                    threads=flask_config.get('threads', 8),
+                                    backlog=flask_config.get('backlog', 1024),
+                                    channel_timeout=flask_config.get('keep_alive', 30),
+                                    connection_limit=flask_config.get('connection_limit', 1000),
+                                    ident="ad_kihon")
+
+    def run(self):
+        self.server.run()
+
+    def close(self):
+        self.server.close()
+
+
+SERVERS = {"development": DevelopmentServer, "waitress": WaitressServer}
+
+
+def make_server(app, flask_config: dict, host: str = '0.0.0.0'):
+    server_name = flask_config.get('server', 'development')
+    if server_name not in SERVERS:
+        log(f"Error: {server_name} is an unknown server, choose among {list(SERVERS.keys())}")
+        raise UnknownServer
+    return SERVERS[server_name](app, host, flask_config['port'], flask_config)
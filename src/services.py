@@ -1,26 +1,84 @@
+import threading
+import time
+
 from event_queue import EventQueue
 from event_dispatcher import EventDispatcher
 from check_scheduler import CheckScheduler
 from submission_service import SubmissionService
 from scoreboard_cache import ScoreboardCache
+from flag_archiver import FlagArchiver
+from game_clock import Clock, REAL_CLOCK
+from project_utils import init_or_resume_mongo, log
+import metrics
 
 
 class Services:
-    def __init__(self, config):
-        self.eventQueue = EventQueue()
-        self.eventDispatcher = EventDispatcher(self.eventQueue, config)
-        self.checkScheduler = CheckScheduler(self.eventQueue, config)
-        self.submissionService = SubmissionService(self.eventQueue, config, self.checkScheduler)
-        self.scoreboardCache = ScoreboardCache(config)
+    def __init__(self, config, clock: Clock = REAL_CLOCK):
+        # the clock is the real one, except for simulations (see benchmark/bench_simulation.py)
+        self.clock = clock
+        # if the queue is bounded, checkers and submissions wait when it's full, instead of making the backlog grow
+        self.eventQueue = EventQueue(maxsize=config['misc'].get('event_queue_max_size', 0))
+        self.eventDispatcher = EventDispatcher(self.eventQueue, config, clock)
+        self.checkScheduler = CheckScheduler(self.eventQueue, config, clock)
+        self.submissionService = SubmissionService(self.eventQueue, config, self.checkScheduler, clock)
+        self.scoreboardCache = ScoreboardCache(config, clock)
+        self.scoreboardCache.followEvents(self.eventDispatcher)
+        self.flagArchiver = FlagArchiver(config, lambda: self.checkScheduler.roundNum, clock)
+        metrics.gauge_func("adkihon_event_queue_depth", "Events waiting to be dispatched", self.eventQueue.qsize)
+        metrics.gauge_func("adkihon_round_number", "Current round number", lambda: self.checkScheduler.roundNum)
         self.eventDispatcher.start()
         self.checkScheduler.start()
+        if self.flagArchiver.interval > 0:
+            self.flagArchiver.start()
 
     def stop(self):
         self.eventDispatcher.stopped = True
         self.checkScheduler.stopped = True
+        self.flagArchiver.stopped = True
         self.eventDispatcher.join()
         if 1 <= self.checkScheduler.roundNum < self.checkScheduler.maxRounds:
-            self.checkScheduler.join(timeout=self.checkScheduler.roundTime)
+            self.checkScheduler.join(timeout=self.clock.realSeconds(self.checkScheduler.roundTime))
+        # persist the checks still pending in the write-behind buffer
+        self.checkScheduler.checkBuffer.stop()
+        self.checkScheduler.tracer.stop()
+
+
+class Startup(threading.Thread):
+    # initializes (or resumes) the DB and then starts the services in background, so that in the meanwhile the
+    # web server can already serve the static scoreboard and the readiness of the platform; a failed startup is
+    # retried up to startup_attempts times, waiting startup_retry_delay seconds, then onFailure is called
+    def __init__(self, config: dict, clock: Clock = REAL_CLOCK, onFailure=None):
+        super().__init__(daemon=True)
+        self.config = config
+        self.clock = clock
+        # {phase: seconds}, filled as the phases complete
+        self.phases = {}
+        self.services = None
+        self.failed = False
+        self.ready = threading.Event()
+        self.attempts = config['misc'].get('startup_attempts', 3)
+        self.retryDelay = config['misc'].get('startup_retry_delay', 5)
+        self.onFailure = onFailure
+
+    def run(self) -> None:
+        for attempt in range(1, self.attempts + 1):
+            try:
+                init_or_resume_mongo(self.config, self.phases)
+                start = time.perf_counter()
+                self.services = Services(self.config, self.clock)
+                self.phases['start_services'] = time.perf_counter() - start
+                break
+            except Exception as e:
+                log(f"Error: startup failed (attempt {attempt} of {self.attempts}): {e.__class__.__name__} {str(e)}")
+                if attempt < self.attempts:
+                    time.sleep(self.retryDelay)
+        else:
+            self.failed = True
+            if self.onFailure is not None:
+                self.onFailure()
+            return
+        log(f"Ready to serve after {sum(self.phases.values()):.3f}s")
+        self.ready.set()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,117 @@
+import collections
+import contextlib
+import hashlib
+import hmac
+import os
+import threading
+
+from project_utils import log
+import metrics
+
+
+ACTIONS = ("check", "put", "get")
+# number of rounds whose timeline is kept in memory
+TIMELINE_ROUNDS = 10
+
+STAGGER_LAG_SECONDS = metrics.histogram("adkihon_stagger_lag_seconds",
+                                        "Delay of checkers' actions with respect to their planned start",
+                                        buckets=(0.01, 0.05, 0.1, 0.5, 1, 2.5, 5, 10, 30, 60))
+
+
+class StaggerPlanner:
+    # plans the start time of each checker action (check, put, get) of a round, so that the actions
+    # don't clump on the platform and on team hosts: the window of the round is split in one phase
+    # per action, and each phase in as many equal slots as its actions; each action gets one slot, in an
+    # order (and with a jitter inside the slot) given by an HMAC of (round, team, service, flag round, action).
+    # So the plan is deterministic for a given secret, but teams can't predict when they'll be checked.
+    # The number of in-flight actions can also be bounded for each team host and for each service.
+    def __init__(self, config: dict, teams: dict, services: dict):
+        misc = config['misc']
+        secret = misc.get('stagger_secret')
+        self.secret = secret.encode() if secret is not None else os.urandom(32)
+        self.teamHosts = {team_id: team['host'] for team_id, team in teams.items()}
+        maxPerTeam = misc.get('max_inflight_per_team', 0)
+        maxPerService = misc.get('max_inflight_per_service', 0)
+        # 0 means unbounded; the semaphores are per host, because more teams could share one
+        self.hostSlots = {host: threading.BoundedSemaphore(maxPerTeam) for host in self.teamHosts.values()} \
+            if maxPerTeam > 0 else {}
+        self.serviceSlots = {service_id: threading.BoundedSemaphore(maxPerService) for service_id in services} \
+            if maxPerService > 0 else {}
+        # timelines of the last rounds: {round_num: [(team_id, service_id, flag_round, action, planned, actual)]}
+        self.timelines = collections.OrderedDict()
+        self.inFlight = {}
+        self.maxInFlight = {}
+        self.mutex = threading.Lock()
+
+    def digest(self, *key) -> int:
+        message = ":".join(str(k) for k in key).encode()
+        return int.from_bytes(hmac.new(self.secret, message, hashlib.sha256).digest()[:8], "big")
+
+    def plan(self, roundNum: int, jobs: list, roundStart: float, window: float) -> dict:
+        # jobs: list of (team_id, service_id, flag_round, isPrevious); the checks of previous rounds don't put
+        # returns the planned start times: {(team_id, service_id, flag_round): {action: timestamp}}
+        phase = window / len(ACTIONS)
+        plans = {(team_id, service_id, flag_round): {} for team_id, service_id, flag_round, _ in jobs}
+        for i, action in enumerate(ACTIONS):
+            keys = [(team_id, service_id, flag_round) for team_id, service_id, flag_round, isPrevious in jobs
+                    if action != "put" or not isPrevious]
+            digests = {key: self.digest(roundNum, *key, action) for key in keys}
+            keys.sort(key=lambda k: digests[k])
+            slot = phase / len(keys) if len(keys) > 0 else 0
+            for rank, key in enumerate(keys):
+                jitter = (digests[key] & 0xffff) / 0x10000
+                plans[key][action] = roundStart + i * phase + (rank + jitter) * slot
+        with self.mutex:
+            self.timelines[roundNum] = []
+            self.inFlight[roundNum] = 0
+            self.maxInFlight[roundNum] = 0
+            while len(self.timelines) > TIMELINE_ROUNDS:
+                oldRound, _ = self.timelines.popitem(last=False)
+                del self.inFlight[oldRound]
+                del self.maxInFlight[oldRound]
+        return plans
+
+    @contextlib.contextmanager
+    def slot(self, roundNum: int, team_id: int, service_id: int, flag_round: int, action: str, planned: float,
+             clock):
+        # waits for a free slot of the team host and of the service (always in this order, to not deadlock),
+        # then records the actual start time of the action
+        hostSlot = self.hostSlots.get(self.teamHosts[team_id], contextlib.nullcontext())
+        serviceSlot = self.serviceSlots.get(service_id, contextlib.nullcontext())
+        with hostSlot, serviceSlot:
+            actual = clock.time()
+            STAGGER_LAG_SECONDS.observe(max(actual - planned, 0))
+            with self.mutex:
+                if roundNum in self.timelines:
+                    self.timelines[roundNum].append((team_id, service_id, flag_round, action, planned, actual))
+                    self.inFlight[roundNum] += 1
+                    self.maxInFlight[roundNum] = max(self.maxInFlight[roundNum], self.inFlight[roundNum])
+            try:
+                yield
+            finally:
+                with self.mutex:
+                    if roundNum in self.inFlight:
+                        self.inFlight[roundNum] -= 1
+
+    def timeline(self, roundNum: int) -> list:
+        # planned vs actual start times of the actions of a round, sorted by planned start
+        with self.mutex:
+            entries = list(self.timelines.get(roundNum, []))
+        return [{"team": team_id, "service": service_id, "flag_round": flag_round, "action": action,
+                 "planned": planned, "actual": actual, "lag": actual - planned}
+                for team_id, service_id, flag_round, action, planned, actual in sorted(entries, key=lambda e: e[4])]
+
+    def summary(self, roundNum: int) -> dict:
+        entries = self.timeline(roundNum)
+        lags = [e['lag'] for e in entries]
+        return {"round": roundNum, "actions": len(entries),
+                "mean_lag": sum(lags) / len(lags) if len(lags) > 0 else 0,
+                "max_lag": max(lags) if len(lags) > 0 else 0,
+                "max_in_flight": self.maxInFlight.get(roundNum, 0)}
+
+    def logSummary(self, roundNum: int):
+        if roundNum not in self.timelines:
+            return
+        s = self.summary(roundNum)
+        log(f"Checkers' timeline of round {s['round']}: {s['actions']} actions, mean lag {s['mean_lag']:.3f}s, "
+            f"max lag {s['max_lag']:.3f}s, max in-flight actions {s['max_in_flight']}")
@@ -1,166 +1,255 @@
+const POLL_SECONDS = 10;
+// the compact format of /api/getStats, see the README
+const STATS_URL = '/api/getStats?format=columnar';
+const STATUS_COLORS = {"ok": "lime", "corrupt": "orchid", "mumble": "orange", "down": "red", "error": "yellow"};
+const FIRST_PLACES_COLORS = ["gold", "silver", "goldenrod"];
+// rows rendered above and below the visible ones, so that scrolling doesn't show empty space
+const OVERSCAN_ROWS = 5;
+// rank, team, IP address and score, then a cell for each service
+const TEAM_CELLS = 4;
+
+// only the rows in the viewport exist in the DOM: "rows" are the rendered ones, from the "first" team of "order",
+// and each of them keeps the text and the color of its cells, so that only the changed cells are written
+const state = {
+    columns: null,
+    order: [],
+    roundNum: -1,
+    maxSla: 0,
+    rowHeight: 0,
+    first: 0,
+    rows: [],
+    polling: false,
+    renderScheduled: false
+};
+
+
 function main() {
-    res = getStats();
-    initInterface(res);
-    seconds = 10;
-    interval = seconds * 1000;
-    update = function() {
-        res = getStats();
-        updateInterface(res);
-    }
-    setInterval(update, interval);
+    initLegend();
+    poll();
+    setInterval(poll, POLL_SECONDS * 1000);
+    window.addEventListener('scroll', scheduleRender, {passive: true});
+    window.addEventListener('resize', scheduleRender);
 }
 
 
-function getStats() {
-    xhr = new XMLHttpRequest();
-    xhr.open('GET', '/api/getStats', false);
-    xhr.send();
-    msg = JSON.parse(xhr.responseText);
-    if (xhr.status != 200) {
-        alert('Oops... some error occurred. Check console log, then reload the page');
-        console.log(res);
+async function getStats() {
+    const response = await fetch(STATS_URL);
+    const msg = await response.json();
+    if (!response.ok) {
+        throw new Error(msg['error'] || ('status ' + response.status));
     }
     return msg;
 }
 
 
-function sortTeams(teams) {
-    teams.sort(function(t1, t2) {
-        if (t2.overall_score == t1.overall_score) {
-            return t1.last_pts_update - t2.last_pts_update;
+async function poll() {
+    // a slow response is not overlapped by the next poll
+    if (state.polling) {
+        return;
+    }
+    state.polling = true;
+    try {
+        updateInterface(await getStats());
+    } catch (e) {
+        console.log(e);
+        document.getElementById("roundNum").textContent = "Scoreboard not available: " + e.message;
+    } finally {
+        state.polling = false;
+    }
+}
+
+
+function sortTeams(columns) {
+    const scores = columns['overall_score'];
+    const lastUpdates = columns['last_pts_update'];
+    const order = scores.map(function(_, i) { return i; });
+    order.sort(function(t1, t2) {
+        if (scores[t2] == scores[t1]) {
+            return lastUpdates[t1] - lastUpdates[t2];
         } else {
-            return t2.overall_score - t1.overall_score;
+            return scores[t2] - scores[t1];
         }
-    })
+    });
+    return order;
 }
 
 
 function expectedSla(roundNum, flagLifetime) {
-    n = 0;
-    for (r=0; r<roundNum; r++) {
-        if ((r+1) <= flagLifetime) {
-            n = n + r + 1;
-        } else {
-            n = n + flagLifetime + 1;
-        }
-    }
-    return n;
+    // the sum over the rounds r = 1..roundNum of min(r, flagLifetime + 1)
+    const ramp = Math.min(roundNum, flagLifetime);
+    return ramp * (ramp + 1) / 2 + Math.max(roundNum - flagLifetime, 0) * (flagLifetime + 1);
 }
 
 
 function getSlaPercentage(obtained, expected) {
     if (expected == 0) {
-        perc = 0;
-        return perc.toFixed(2);
+        return (0).toFixed(2);
     }
-    if (obtained < 0) {
-        obtained = 0;
-    }
-    perc = (obtained / expected) * 100;
-    perc = perc.toFixed(2);
-    return perc;
+    return (Math.max(obtained, 0) / expected * 100).toFixed(2);
 }
 
 
-function colorForStatus(status) {
-    colors = {"ok": "lime", "corrupt": "orchid", "mumble": "orange", "down": "red", "error": "yellow"};
-    return colors[status];
+function colorForStatus(columns, code) {
+    return code < 0 ? '' : STATUS_COLORS[columns['status_names'][code]];
 }
 
 
-function initInterface(response) {
-    round = document.getElementById("roundNum");
-    round.textContent = "Round: " + response['roundNum'];
-    legend = document.getElementById("legend");
-    for (i=0; i<legend.childElementCount; i++) {
-        cell = legend.children[i];
-        cell.style.backgroundColor = colorForStatus(cell.textContent);
+function initLegend() {
+    const legend = document.getElementById("legend");
+    for (const cell of legend.children) {
+        cell.style.backgroundColor = STATUS_COLORS[cell.textContent];
         cell.textContent = cell.textContent.toUpperCase();
     }
-    services = Object.keys(response['teams'][0]['points']);
-    header = document.getElementById("teamsHeader");
-    for (i=0; i<services.length; i++) {
-        th = document.createElement("th");
-        th.textContent = services[i];
+}
+
+
+function initHeader(columns) {
+    const header = document.getElementById("teamsHeader");
+    while (header.childElementCount > TEAM_CELLS) {
+        header.removeChild(header.lastElementChild);
+    }
+    for (const service of columns['service_names']) {
+        const th = document.createElement("th");
+        th.textContent = service;
         header.appendChild(th);
     }
-    table = document.getElementById("teams");
-    sortTeams(response['teams']);
-    teams = response['teams'];
-    maxSla = expectedSla(response['roundNum'], response['flagLifetime']);
-    firstPlacesColors = ["gold", "silver", "goldenrod"];
-    for (i=0; i<teams.length; i++) {
-        tr = document.createElement("tr");
-        tr.setAttribute("id", "row_"+i);
-        td = document.createElement("td");
-        td.textContent = i+1;
-        if (i < firstPlacesColors.length) {
-            td.style.backgroundColor = firstPlacesColors[i];
-        }
-        tr.appendChild(td)
-        td = document.createElement("td");
-        td.textContent = teams[i]['name'];
-        if (i < firstPlacesColors.length) {
-            td.style.backgroundColor = firstPlacesColors[i];
+    document.getElementById("topSpacer").firstElementChild.colSpan = header.childElementCount;
+    document.getElementById("bottomSpacer").firstElementChild.colSpan = header.childElementCount;
+}
+
+
+function updateInterface(response) {
+    const columns = response['columns'];
+    const previous = state.columns;
+    if (previous === null || previous['service_names'].join() != columns['service_names'].join()) {
+        initHeader(columns);
+        // the rendered rows have the cells of the previous services
+        for (const row of state.rows) {
+            row.tr.remove();
         }
-        tr.appendChild(td);
-        td = document.createElement("td");
-        td.textContent = teams[i]['ip_addr'];
-        if (i < firstPlacesColors.length) {
-            td.style.backgroundColor = firstPlacesColors[i];
+        state.rows = [];
+    }
+    if (response['roundNum'] != state.roundNum) {
+        state.roundNum = response['roundNum'];
+        state.maxSla = expectedSla(response['roundNum'], response['flagLifetime']);
+        document.getElementById("roundNum").textContent = "Round: " + response['roundNum'];
+    }
+    state.columns = columns;
+    state.order = sortTeams(columns);
+    render();
+    document.body.className = 'visible';
+}
+
+
+function scheduleRender() {
+    if (!state.renderScheduled && state.columns !== null) {
+        state.renderScheduled = true;
+        requestAnimationFrame(function() {
+            state.renderScheduled = false;
+            render();
+        });
+    }
+}
+
+
+function visibleRange() {
+    const numTeams = state.order.length;
+    if (state.rowHeight == 0) {
+        // the height of a row is measured once the first rows are rendered
+        return [0, Math.min(numTeams, 1)];
+    }
+    const body = document.getElementById("teamsBody");
+    const top = body.getBoundingClientRect().top;
+    const count = Math.ceil(window.innerHeight / state.rowHeight) + 2 * OVERSCAN_ROWS;
+    // at the end of the table, the rendered rows are the last ones
+    const first = Math.max(0, Math.min(Math.floor(-top / state.rowHeight) - OVERSCAN_ROWS, numTeams - count));
+    return [first, Math.min(first + count, numTeams)];
+}
+
+
+function render() {
+    const [first, last] = visibleRange();
+    const body = document.getElementById("teamsBody");
+    const bottomSpacer = document.getElementById("bottomSpacer");
+    while (state.rows.length < last - first) {
+        const row = createRow(state.columns['service_names'].length);
+        body.insertBefore(row.tr, bottomSpacer);
+        state.rows.push(row);
+    }
+    while (state.rows.length > last - first) {
+        state.rows.pop().tr.remove();
+    }
+    state.first = first;
+    for (let k = 0; k < state.rows.length; k++) {
+        patchRow(state.rows[k], first + k);
+    }
+    setHeight(document.getElementById("topSpacer"), first * state.rowHeight);
+    setHeight(bottomSpacer, (state.order.length - last) * state.rowHeight);
+    if (state.rows.length > 0) {
+        // the distance between two rows, which includes the spacing of the table's cells
+        const top = state.rows[0].tr.getBoundingClientRect().top;
+        const rowHeight = state.rows.length > 1 ? state.rows[1].tr.getBoundingClientRect().top - top :
+            state.rows[0].tr.getBoundingClientRect().height;
+        if (rowHeight > 0 && rowHeight != state.rowHeight) {
+            state.rowHeight = rowHeight;
+            scheduleRender();
         }
-        tr.appendChild(td);
-        td = document.createElement("td");
-        td.textContent = teams[i]['overall_score'];
-        if (i < firstPlacesColors.length) {
-            td.style.backgroundColor = firstPlacesColors[i];
+    }
+}
+
+
+function setHeight(spacer, height) {
+    spacer.style.display = height > 0 ? '' : 'none';
+    spacer.style.height = height + 'px';
+}
+
+
+function createRow(numServices) {
+    const tr = document.createElement("tr");
+    const row = {tr: tr, cells: [], texts: [], colors: []};
+    for (let j = 0; j < TEAM_CELLS + numServices; j++) {
+        const td = document.createElement("td");
+        if (j >= TEAM_CELLS) {
+            td.className = "service";
         }
         tr.appendChild(td);
-        points = teams[i]['points'];
-        serviceStatus = teams[i]['service_status'];
-        for (j=0; j<services.length; j++) {
-            servicePts = points[services[j]];
-            td = document.createElement("td");
-            td.innerHTML = "SLA percentage: " + getSlaPercentage(servicePts['sla_pts'], maxSla) + '%<br>';
-            td.innerHTML += "SLA checks: " + servicePts['sla_pts'] + '<br>';
-            td.innerHTML += 'Flags: +' + servicePts['atk_pts'] + '/' + servicePts['def_pts'];
-            status = serviceStatus[services[j]];
-            td.style.backgroundColor = colorForStatus(status);
-            td.style.textAlign = 'left';
-            tr.appendChild(td);
-        }
-        table.appendChild(tr);
+        row.cells.push(td);
+        row.texts.push(null);
+        row.colors.push(null);
     }
-    document.body.className = 'visible';
+    return row;
 }
 
 
-function updateInterface(response) {
-    round = document.getElementById("roundNum");
-    round.textContent = "Round: " + response['roundNum'];
-    services = Object.keys(response['teams'][0]['points']);
-    table = document.getElementById("teams");
-    sortTeams(response['teams']);
-    teams = response['teams'];
-    maxSla = expectedSla(response['roundNum'], response['flagLifetime']);
-    for (i=0; i<teams.length; i++) {
-        tr = document.getElementById("row_"+i);
-        td = tr.children[1];
-        td.textContent = teams[i]['name'];
-        td = tr.children[2];
-        td.textContent = teams[i]['ip_addr'];
-        td = tr.children[3];
-        td.textContent = teams[i]['overall_score'];
-        points = teams[i]['points'];
-        serviceStatus = teams[i]['service_status'];
-        for (j=0; j<services.length; j++) {
-            servicePts = points[services[j]];
-            td = tr.children[4+j];
-            td.innerHTML = "SLA percentage: " + getSlaPercentage(servicePts['sla_pts'], maxSla) + '%<br>';
-            td.innerHTML += "SLA checks: " + servicePts['sla_pts'] + '<br>';
-            td.innerHTML += 'Flags: +' + servicePts['atk_pts'] + '/' + servicePts['def_pts'];
-            status = serviceStatus[services[j]];
-            td.style.backgroundColor = colorForStatus(status);
-        }
+function patchCell(row, j, text, color) {
+    // the DOM is written only if the cell changed since the last render
+    if (row.texts[j] !== text) {
+        row.cells[j].textContent = text;
+        row.texts[j] = text;
+    }
+    if (row.colors[j] !== color) {
+        row.cells[j].style.backgroundColor = color;
+        row.colors[j] = color;
+    }
+}
+
+
+function patchRow(row, position) {
+    const columns = state.columns;
+    const team = state.order[position];
+    const placeColor = FIRST_PLACES_COLORS[position] || '';
+    patchCell(row, 0, String(position + 1), placeColor);
+    patchCell(row, 1, columns['team_names'][team], placeColor);
+    patchCell(row, 2, columns['ip_addrs'][team], placeColor);
+    patchCell(row, 3, String(columns['overall_score'][team]), placeColor);
+    const numServices = columns['service_ids'].length;
+    for (let j = 0; j < numServices; j++) {
+        // points and status codes are flat arrays, team-major
+        const index = team * numServices + j;
+        const slaPts = columns['sla_pts'][index];
+        const text = "SLA percentage: " + getSlaPercentage(slaPts, state.maxSla) + '%\n' +
+            "SLA checks: " + slaPts + '\n' +
+            'Flags: +' + columns['atk_pts'][index] + '/' + columns['def_pts'][index];
+        patchCell(row, TEAM_CELLS + j, text, colorForStatus(columns, columns['status'][index]));
     }
 }
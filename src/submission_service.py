@@ -1,13 +1,32 @@
 import re
+import json
 import threading
 from functools import partial
 import time
 from dateutil import parser
 
 from event_queue import *
-from mongo_utils import get_db_manager, get_flag_by_data, check_stolen_flag, push_stolen_flag, push_lost_flag, \
-    NotExistentDocument
+from mongo_utils import get_db_manager, get_flag_by_data, push_stolen_flag, push_lost_flag, NotExistentDocument
 from check_scheduler import CheckScheduler
+from game_clock import Clock, REAL_CLOCK
+import metrics
+
+
+SUBMISSION_SECONDS = metrics.histogram("adkihon_submission_seconds", "Latency of flag submissions, excluding rejected ones")
+SUBMITTED_FLAGS = metrics.counter("adkihon_submitted_flags_total", "Submitted flags, by verdict", ("verdict",))
+REJECTED_SUBMISSIONS = metrics.counter("adkihon_rejected_submissions_total",
+                                       "Flag submissions rejected before checking the flags, by reason", ("reason",))
+THROTTLED_SECONDS = metrics.counter("adkihon_submission_throttled_seconds_total",
+                                    "Time spent by streamed submissions waiting for the flags-per-second budget")
+
+# verdicts of a submitted flag, in the order in which they're enforced (see flagVerdict); the counters of
+# submitFlags are "num_" followed by the verdict, plus num_discarded
+INVALID = "invalid"
+SELF_FLAGS = "self_flags"
+OLD = "old"
+ALREADY_SUBMITTED = "already_submitted"
+ACCEPTED = "accepted"
+VERDICTS = (INVALID, SELF_FLAGS, OLD, ALREADY_SUBMITTED, ACCEPTED)
 
 
 class InvalidToken(Exception):
@@ -30,9 +49,50 @@ class InitServiceError(Exception):
     pass
 
 
+class TokenBucket:
+    # budget of "rate" flags per second, with bursts of up to "burst" flags: take() reserves the flags and waits
+    # until the budget covers them, so that concurrent takers are served in order
+    def __init__(self, rate: float, burst: int, clock: Clock = REAL_CLOCK):
+        self.rate = rate
+        self.burst = burst
+        self.clock = clock
+        self.tokens = burst
+        self.last = clock.time()
+        self.mutex = threading.Lock()
+
+    def take(self, amount: int) -> float:
+        # amount should not exceed the burst; returns the seconds waited
+        with self.mutex:
+            now = self.clock.time()
+            self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+            self.last = now
+            self.tokens -= amount
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+        if wait > 0:
+            self.clock.sleep(wait)
+        return wait
+
+
+def parse_flag_lines(lines):
+    # lines of a NDJSON body: each one is a flag, either raw or as a JSON string; blank lines are skipped
+    for line in lines:
+        line = line.strip()
+        if len(line) == 0:
+            continue
+        flag = line.decode(errors='replace') if isinstance(line, bytes) else line
+        if flag.startswith('"'):
+            try:
+                flag = json.loads(flag)
+            except ValueError:
+                pass
+        # anything else than a string is just an invalid flag
+        yield flag if isinstance(flag, str) else str(flag)
+
+
 class SubmissionService:
-    def __init__(self, eventQueue: EventQueue, config: dict, checkScheduler: CheckScheduler):
+    def __init__(self, eventQueue: EventQueue, config: dict, checkScheduler: CheckScheduler, clock: Clock = REAL_CLOCK):
         self.eventQueue = eventQueue
+        self.clock = clock
         _, mongo_client = get_db_manager(config['mongo'])
         self.mongoClient = mongo_client
         self.mongoConfig = config['mongo']
@@ -42,11 +102,21 @@ class SubmissionService:
         for team_token in self.teams.keys():
             self.teams[team_token]['rate_limit_mutex'] = threading.Lock()
             self.teams[team_token]['service_mutex'] = threading.Lock()
+            # the accepts of a team's flags are serialized, whatever the endpoint (see flagVerdict)
+            self.teams[team_token]['accept_mutex'] = threading.Lock()
         self.rateLimitSeconds = config['misc']['rate_limit_seconds']
         self.roundTime = config['misc']['round_time']
         self.rateLimitTimeMutex = threading.Lock()
         self.maxFlagsPerSubmission = config['misc']['max_flags_per_submission']
         self.flagLifetime = config['misc']['flag_lifetime']
+        # streamed submissions (see submitFlagStream) have a budget of flags per second for each team, instead of
+        # the cap on the flags of a request; by default it is the same throughput allowed by submitFlags
+        misc = config['misc']
+        flagsPerSecond = misc.get('flags_per_second', self.maxFlagsPerSubmission / self.rateLimitSeconds)
+        burst = misc.get('flags_burst', self.maxFlagsPerSubmission)
+        self.streamBatchSize = max(1, min(misc.get('stream_batch_size', 100), burst))
+        self.budgets = {team_token: TokenBucket(flagsPerSecond, burst, clock) if flagsPerSecond > 0 else None
+                        for team_token in self.teams.keys()}
         self.startTime = int(parser.parse(config['misc']['start_time']).timestamp())
         self.endTime = int(parser.parse(config['misc']['end_time']).timestamp())
         if self.startTime >= self.endTime:
@@ -76,7 +146,7 @@ class SubmissionService:
             raise RateLimitExceeded
         else:
             release = partial(SubmissionService.release, mutex)
-            rateHandler = threading.Timer(interval=self.rateLimitSeconds, function=release)
+            rateHandler = self.clock.timer(self.rateLimitSeconds, release)
             rateHandler.start()
 
     def increaseRateLimit(self):
@@ -97,65 +167,68 @@ class SubmissionService:
             self.increaseRateLimit()
             decrease = lambda service: service.decreaseRateLimit()
             decrease = partial(decrease, self)
-            decreaseHandler = threading.Timer(interval=self.roundTime, function=decrease)
+            decreaseHandler = self.clock.timer(self.roundTime, decrease)
             decreaseHandler.start()
             raise ServiceBusy
         # also this one is scheduled after a long time, for reliability;
         # if the service goes well, it will (and must) cancel the scheduling, to avoid a spurious release
         release = partial(SubmissionService.release, mutex)
-        reliabilityHandler = threading.Timer(interval=self.roundTime * 2, function=release)
+        reliabilityHandler = self.clock.timer(self.roundTime * 2, release)
         reliabilityHandler.start()
         return reliabilityHandler
 
     @staticmethod
-    def handleFlag(db, flag, team_token, team, event_queue, flag_pat, msg, msg_mutex, round_num, flag_lifetime):
+    def flagVerdict(db, flag, team_token, team, events, flag_pat, round_num, flag_lifetime,
+                    clock: Clock = REAL_CLOCK) -> str:
+        # the attack event of an accepted flag is appended to events, which are queued at once by the caller
         if not re.match(flag_pat, flag):
-            msg_mutex.acquire(blocking=True)
-            msg['num_invalid'] += 1
-            msg_mutex.release()
-            return
+            return INVALID
         try:
             flag_dict = get_flag_by_data(db, flag)
         except NotExistentDocument:
-            msg_mutex.acquire(blocking=True)
-            msg['num_invalid'] += 1
-            msg_mutex.release()
-            return
+            return INVALID
         if flag_dict['team_id'] == team['id']:
-            msg_mutex.acquire(blocking=True)
-            msg['num_self_flags'] += 1
-            msg_mutex.release()
-            return
+            return SELF_FLAGS
         if flag_dict['round_num'] < round_num - flag_lifetime:
-            msg_mutex.acquire(blocking=True)
-            msg['num_old'] += 1
-            msg_mutex.release()
-            return
-        try:
-            check_stolen_flag(db, team_token, flag)
-            msg_mutex.acquire(blocking=True)
-            msg['num_already_submitted'] += 1
-            msg_mutex.release()
-            return
-        except NotExistentDocument:
-            timestamp = int(time.time())
-            push_stolen_flag(db, team_token, flag, timestamp)
-            push_lost_flag(db, flag_dict['team_id'], flag, timestamp)
-            event = {"type": EVENT_ATTACK, "team": team['id'], "service": flag_dict['service_id'],
-                     "attacked_team": flag_dict['team_id'], "timestamp": timestamp}
-            event_queue.put(event)
-            msg_mutex.acquire(blocking=True)
-            msg['num_accepted'] += 1
-            msg_mutex.release()
+            return OLD
+        # concurrent submissions of the same flag by a team, e.g. two streams, or a stream and /api/flagSubmit,
+        # don't hold the same service mutex: the flag is accepted by a single one, because the push of the stolen
+        # flag is conditional, and the accepts of the team are serialized
+        timestamp = int(clock.time())
+        with team['accept_mutex']:
+            if not push_stolen_flag(db, team_token, flag, timestamp):
+                return ALREADY_SUBMITTED
+        push_lost_flag(db, flag_dict['team_id'], flag, timestamp)
+        events.append(AttackEvent(team['id'], flag_dict['service_id'], flag_dict['team_id'], timestamp))
+        return ACCEPTED
+
+    @staticmethod
+    def handleFlag(db, flag, team_token, team, events, flag_pat, msg, msg_mutex, round_num, flag_lifetime,
+                   clock: Clock = REAL_CLOCK):
+        verdict = SubmissionService.flagVerdict(db, flag, team_token, team, events, flag_pat, round_num,
+                                                flag_lifetime, clock)
+        msg_mutex.acquire(blocking=True)
+        msg["num_" + verdict] += 1
+        msg_mutex.release()
 
     def submitFlags(self, team_token: str, flags: list):
-        if not (self.startTime <= int(time.time()) <= self.endTime):
-            raise OutOfTimeWindow
-        rate_limit_mutex, service_mutex = self.getTeamMutexes(team_token)
-        # for rate limiting
-        self.acquireMutexWithScheduledRelease(rate_limit_mutex)
-        # for other concurrency issues (when the service is slower than rate limit)
-        timed_release = self.acquireServiceMutex(service_mutex)
+        start = time.perf_counter()
+        self.checkTimeWindow()
+        try:
+            rate_limit_mutex, service_mutex = self.getTeamMutexes(team_token)
+            # for rate limiting
+            self.acquireMutexWithScheduledRelease(rate_limit_mutex)
+            # for other concurrency issues (when the service is slower than rate limit)
+            timed_release = self.acquireServiceMutex(service_mutex)
+        except InvalidToken:
+            REJECTED_SUBMISSIONS.inc(reason="invalid_token")
+            raise
+        except ServiceBusy:
+            REJECTED_SUBMISSIONS.inc(reason="service_busy")
+            raise
+        except RateLimitExceeded:
+            REJECTED_SUBMISSIONS.inc(reason="rate_limit")
+            raise
         msg = {"num_invalid": 0, "num_accepted": 0, "num_already_submitted": 0,
                "num_self_flags": 0, "num_discarded": max(len(flags) - self.maxFlagsPerSubmission, 0),
                "num_old": 0}
@@ -164,11 +237,13 @@ class SubmissionService:
         db, _ = get_db_manager(self.mongoConfig, self.mongoClient)
         team = self.teams[team_token]
         threads = []
+        events = []
         # a thread for each flag, join all of them, because most operations are I/O; it would be too slow otherwise
         current_flag_handler = partial(SubmissionService.handleFlag,
-                                       db=db, team_token=team_token, team=team, event_queue=self.eventQueue,
+                                       db=db, team_token=team_token, team=team, events=events,
                                        flag_pat=self.flagPat, msg=msg, msg_mutex=msg_mutex,
-                                       round_num=self.checkScheduler.roundNum, flag_lifetime=self.flagLifetime)
+                                       round_num=self.checkScheduler.roundNum, flag_lifetime=self.flagLifetime,
+                                       clock=self.clock)
         for flag in flags:
             thread_flag_handler = partial(current_flag_handler, flag=flag)
             service_thread = threading.Thread(target=thread_flag_handler)
@@ -176,9 +251,88 @@ class SubmissionService:
             service_thread.start()
         for thread in threads:
             thread.join()
+        # the events of the accepted flags are queued in a single batch
+        self.eventQueue.putMany(events)
         if timed_release.is_alive():
             # note: if it is not alive, it means that the service took more than 2 rounds to complete;
             # it's rare, but it's still an edge case to consider, to avoid a release on an already released mutex
             self.release(service_mutex)
             timed_release.cancel()
+        for verdict, count in msg.items():
+            if count > 0:
+                # e.g. num_accepted -> accepted
+                SUBMITTED_FLAGS.inc(count, verdict=verdict[len("num_"):])
+        SUBMISSION_SECONDS.observe(time.perf_counter() - start)
         return msg
+
+    def checkTimeWindow(self):
+        if not (self.startTime <= int(self.clock.time()) <= self.endTime):
+            REJECTED_SUBMISSIONS.inc(reason="out_of_time_window")
+            raise OutOfTimeWindow
+
+    def batchVerdicts(self, db, team_token: str, flags: list) -> list:
+        # verdicts of a batch of flags, with a thread for each distinct flag, as in submitFlags; the repetitions
+        # of a flag in the batch get the verdict of its first occurrence, or already_submitted if it was accepted
+        team = self.teams[team_token]
+        distinct = list(dict.fromkeys(flags))
+        verdicts = {}
+        events = []
+
+        def handle(flag):
+            verdicts[flag] = SubmissionService.flagVerdict(db, flag, team_token, team, events, self.flagPat,
+                                                           self.checkScheduler.roundNum, self.flagLifetime, self.clock)
+        threads = [threading.Thread(target=handle, args=(flag,)) for flag in distinct]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.eventQueue.putMany(events)
+        result = []
+        seen = set()
+        for flag in flags:
+            verdict = verdicts[flag]
+            if flag in seen and verdict == ACCEPTED:
+                verdict = ALREADY_SUBMITTED
+            seen.add(flag)
+            result.append(verdict)
+        return result
+
+    def submitFlagStream(self, team_token: str, flags):
+        # flags: an iterable of flags, e.g. read from the request while it's being received (see parse_flag_lines).
+        # The token and the time window are checked here, so that errors are raised before the response starts;
+        # the returned generator consumes the flags in batches of stream_batch_size, each one waiting for the
+        # team's budget of flags per second, and yields a {"flag", "verdict"} dict for each of them, followed by
+        # a {"summary"} dict with the counters of the verdicts
+        self.checkTimeWindow()
+        if team_token not in self.teams:
+            REJECTED_SUBMISSIONS.inc(reason="invalid_token")
+            raise InvalidToken
+        return self.streamVerdicts(team_token, iter(flags))
+
+    def streamVerdicts(self, team_token: str, flags):
+        db, _ = get_db_manager(self.mongoConfig, self.mongoClient)
+        budget = self.budgets[team_token]
+        counts = {"num_" + verdict: 0 for verdict in VERDICTS}
+        while True:
+            batch = [flag for _, flag in zip(range(self.streamBatchSize), flags)]
+            if len(batch) == 0:
+                break
+            if budget is not None:
+                THROTTLED_SECONDS.inc(budget.take(len(batch)))
+            try:
+                # the game may end while the flags are being streamed
+                self.checkTimeWindow()
+            except OutOfTimeWindow:
+                yield {"error": "Too early or too late to submit a flag"}
+                return
+            start = time.perf_counter()
+            verdicts = self.batchVerdicts(db, team_token, batch)
+            for verdict in VERDICTS:
+                count = verdicts.count(verdict)
+                if count > 0:
+                    counts["num_" + verdict] += count
+                    SUBMITTED_FLAGS.inc(count, verdict=verdict)
+            SUBMISSION_SECONDS.observe(time.perf_counter() - start)
+            for flag, verdict in zip(batch, verdicts):
+                yield {"flag": flag, "verdict": verdict}
+        yield {"summary": counts}
@@ -0,0 +1,145 @@
+import mongomock
+import time
+from dateutil import parser
+
+from attack_stats import AttackStats
+from event_dispatcher import EventDispatcher
+from event_queue import EventQueue, AttackEvent, check_event
+from mongo_utils import *
+from checker_lib import gen_flag, gen_seed, OK
+from project_utils import log
+
+config = {
+    "teams": [
+        {"id": 0, "host": "10.0.0.1", "name": "first", "token": "c2e192800a294acbb2ac7dd188502edb"},
+        {"id": 1, "host": "10.0.0.2", "name": "second", "token": "934310005a1447b8bd52d9dcbd5c405a"},
+        {"id": 2, "host": "10.0.0.3", "name": "third", "token": "5d41402abc4b2a76b9719d911017c592"}
+    ],
+    "services": [
+        {"id": 0, "port": 7331, "name": "example_0", "checker": "volume/example/example_checker_0.py"},
+        {"id": 1, "port": 7332, "name": "example_1", "checker": "volume/example/example_checker_1.py"}
+    ],
+    "mongo": {
+        "hostname": "mock.mongodb.com", "port": 27017, "db_name": "ad_kihon", "user": "admin", "password": "admin"
+    },
+    "flask": {
+        "port": 8080
+    },
+    "misc": {
+        "start_time": "11 apr 2022 15:30",
+        "end_time": "11 apr 2022 19:30",
+        "round_time": 120,
+        "flag_lifetime": 5,
+        "atk_weight": 10,
+        "def_weight": 10,
+        "sla_weight": 80,
+        "flag_header": "flag",
+        "flag_body_len": 30,
+        "dispatch_max_delay": 0.1
+    }
+}
+
+START = int(parser.parse(config['misc']['start_time']).timestamp())
+
+
+def prepare_test():
+    db, _ = get_db_manager(config['mongo'])
+    for team in config['teams']:
+        insert_team_if_not_exists(db, team['id'], team['host'], team['name'], team['token'])
+    for service in config['services']:
+        insert_service_if_not_exists(db, service['id'], service['port'], service['name'])
+    init_teams_points(db)
+    return db
+
+
+def steal(db, attacker: int, victim: int, service_id: int, round_num: int, timestamp: int):
+    # a flag of the victim submitted by the attacker, as the SubmissionService does
+    flag = gen_flag(config['misc']['flag_header'], config['misc']['flag_body_len'])
+    insert_flag(db, flag, gen_seed(), round_num, victim, service_id)
+    push_stolen_flag(db, config['teams'][attacker]['token'], flag, timestamp)
+    push_lost_flag(db, victim, flag, timestamp)
+    return AttackEvent(attacker, service_id, victim, timestamp)
+
+
+def record_test():
+    stats = AttackStats(config)
+    stats.record([AttackEvent(0, 1, 2, START + 130), check_event(0, 1, OK, START + 131),
+                  AttackEvent(1, 1, 2, START + 10), AttackEvent(0, 1, 2, START + 250),
+                  AttackEvent(0, 0, 7, START + 250)])
+    snapshot = stats.snapshot()
+    assert snapshot['teams'] == ["first", "second", "third"], "Teams should be sorted by id"
+    assert snapshot['matrix']['example_1'] == [[0, 0, 2], [0, 0, 1], [0, 0, 0]], \
+        f"Wrong matrix of example_1: {snapshot['matrix']['example_1']}"
+    assert snapshot['matrix']['example_0'] == [[0] * 3] * 3, "Invalid attacks should not be counted"
+    first = snapshot['first_blood']
+    assert list(first.keys()) == ["example_1"], "Only example_1 has a first blood"
+    assert first['example_1'] == {"attacker": "second", "victim": "third", "timestamp": START + 10, "round": 1}, \
+        f"Wrong first blood {first['example_1']}"
+    assert snapshot['flags_per_round'] == [[1, 1], [2, 1], [3, 1]], \
+        f"Wrong flags per round {snapshot['flags_per_round']}"
+    assert snapshot['total'] == 3, "There should be 3 attacks"
+    encoded = stats.getEncoded()
+    assert stats.getEncoded() is encoded, "The snapshot should be encoded once for each version"
+    stats.record([AttackEvent(2, 0, 1, START + 300)])
+    assert stats.getEncoded() is not encoded, "The snapshot should be encoded again after an attack"
+
+
+@mongomock.patch(servers=(('mock.mongodb.com', 27017),))
+def persist_and_load_test():
+    db = prepare_test()
+    stats = AttackStats(config)
+    stats.record([steal(db, 0, 1, 0, 1, START + 5), steal(db, 2, 1, 1, 2, START + 200)])
+    stats.persist(db)
+    assert get_attack_stats(db) is None, "The statistics should not be saved before the persist interval"
+    stats.persist(db, force=True)
+    loaded = AttackStats(config)
+    loaded.load(db)
+    assert loaded.snapshot() == stats.snapshot(), "The loaded statistics should be the saved ones"
+    assert loaded.persistedVersion == loaded.version, "Up to date statistics should not be saved again"
+
+
+@mongomock.patch(servers=(('mock.mongodb.com', 27017),))
+def rebuild_test():
+    db = prepare_test()
+    stats = AttackStats(config)
+    stats.record([steal(db, 0, 1, 0, 1, START + 5)])
+    stats.persist(db, force=True)
+    # as if the platform crashed after this attack was dispatched, but before the statistics were saved
+    stats.record([steal(db, 1, 2, 1, 3, START + 250)])
+    # the flag of the first attack is archived
+    archive_flags(db, 2)
+    loaded = AttackStats(config)
+    loaded.load(db)
+    assert loaded.snapshot() == stats.snapshot(), "Stale statistics should be rebuilt from the stolen flags"
+    assert loaded.persistedVersion != loaded.version, "Rebuilt statistics should be saved"
+
+
+@mongomock.patch(servers=(('mock.mongodb.com', 27017),))
+def dispatcher_test():
+    db = prepare_test()
+    eventQueue = EventQueue()
+    eventDispatcher = EventDispatcher(eventQueue, config)
+    eventDispatcher.start()
+    now = int(time.time())
+    eventQueue.putMany([steal(db, 0, 2, 1, 1, now), steal(db, 1, 2, 1, 1, now + 1), check_event(2, 1, OK, now)])
+    time.sleep(0.5)
+    snapshot = eventDispatcher.attackStats.snapshot()
+    assert snapshot['matrix']['example_1'] == [[0, 0, 1], [0, 0, 1], [0, 0, 0]], "Attacks should be dispatched"
+    assert snapshot['first_blood']['example_1']['attacker'] == "first", "Wrong first blood"
+    eventDispatcher.stopped = True
+    eventDispatcher.join()
+    assert get_attack_stats(db)['total'] == 2, "The statistics should be saved when the dispatcher stops"
+
+
+tests = [record_test, persist_and_load_test, rebuild_test, dispatcher_test]
+
+
+if __name__ == "__main__":
+    for test in tests:
+        log(f"Starting test: {test.__name__}")
+        try:
+            test()
+        except AssertionError as e:
+            log(f"Test {test.__name__} failed: {e.args}")
+            continue
+        log(f"Test {test.__name__} completed successfully")
@@ -0,0 +1,130 @@
+import mongomock
+import time
+
+import check_buffer
+from check_buffer import CheckBuffer
+from mongo_utils import get_db_manager, insert_team_if_not_exists, insert_service_if_not_exists, get_teams
+from checker_lib import OK, CORRUPT
+from project_utils import log
+
+config = {
+    "teams": [
+        {"id": 0, "host": "10.0.0.1", "name": "first", "token": "c2e192800a294acbb2ac7dd188502edb"},
+        {"id": 1, "host": "10.0.0.2", "name": "second", "token": "934310005a1447b8bd52d9dcbd5c405a"}
+    ],
+    "services": [
+        {"id": 0, "port": 7331, "name": "example_0", "checker": "volume/example/example_checker_0.py"},
+        {"id": 1, "port": 7332, "name": "example_1", "checker": "volume/example/example_checker_1.py"}
+    ],
+    "mongo": {
+        "hostname": "mock.mongodb.com", "port": 27017, "db_name": "ad_kihon", "user": "admin", "password": "admin"
+    },
+    "flask": {
+        "port": 8080
+    },
+    "misc": {
+        "start_time": "11 apr 2022 15:30",
+        "end_time": "11 apr 2022 19:30",
+        "round_time": 120,
+        "flag_lifetime": 5,
+        "check_flush_interval": 2,
+        "check_flush_size": 4,
+        "check_buffer_size": 100
+    }
+}
+
+
+def prepare_test():
+    db, _ = get_db_manager(config['mongo'])
+    for team in config['teams']:
+        insert_team_if_not_exists(db, team['id'], team['host'], team['name'], team['token'])
+    for service in config['services']:
+        insert_service_if_not_exists(db, service['id'], service['port'], service['name'])
+    return db
+
+
+def count_checks(db):
+    teams = sorted([t for t in get_teams(db)], key=lambda t: t['team_id'])
+    return [len(team['checks']) for team in teams]
+
+
+@mongomock.patch(servers=(('mock.mongodb.com', 27017),))
+def flush_interval_test():
+    db = prepare_test()
+    checkBuffer = CheckBuffer(config)
+    checkBuffer.start()
+    checkBuffer.push(team_id=0, service_id=0, status=OK, timestamp=int(time.time()))
+    checkBuffer.push(team_id=1, service_id=1, status=CORRUPT, timestamp=int(time.time()))
+    assert count_checks(db) == [0, 0], "Checks should not have been persisted before the flush interval"
+    assert checkBuffer.depth() == 2, "There should be 2 pending checks"
+    time.sleep(3)
+    assert count_checks(db) == [1, 1], "Checks should have been persisted after the flush interval"
+    assert checkBuffer.depth() == 0, "There shouldn't be pending checks"
+    teams = sorted([t for t in get_teams(db)], key=lambda t: t['team_id'])
+    assert teams[1]['checks'][0]['status'] == CORRUPT, "Incorrect status for team 1's check"
+    assert teams[1]['checks'][0]['service_id'] == 1, "Incorrect service for team 1's check"
+    checkBuffer.stop()
+
+
+@mongomock.patch(servers=(('mock.mongodb.com', 27017),))
+def flush_size_test():
+    db = prepare_test()
+    checkBuffer = CheckBuffer(config)
+    checkBuffer.start()
+    for i in range(4):
+        checkBuffer.push(team_id=0, service_id=i % 2, status=OK, timestamp=int(time.time()))
+    time.sleep(0.5)
+    assert count_checks(db) == [4, 0], "Checks should have been persisted as soon as flush size was reached"
+    assert checkBuffer.numFlushes == 1, "Checks should have been persisted with a single flush"
+    checkBuffer.stop()
+
+
+@mongomock.patch(servers=(('mock.mongodb.com', 27017),))
+def flush_on_stop_test():
+    db = prepare_test()
+    checkBuffer = CheckBuffer(config)
+    checkBuffer.start()
+    checkBuffer.push(team_id=0, service_id=0, status=OK, timestamp=int(time.time()))
+    checkBuffer.stop()
+    assert count_checks(db) == [1, 0], "Pending checks should have been persisted on stop"
+    checkBuffer.push(team_id=1, service_id=0, status=OK, timestamp=int(time.time()))
+    assert count_checks(db) == [1, 1], "Checks pushed after stop should be persisted immediately"
+
+
+@mongomock.patch(servers=(('mock.mongodb.com', 27017),))
+def flush_retry_test():
+    db = prepare_test()
+    checkBuffer = CheckBuffer(config)
+    real_push_checks = check_buffer.push_checks
+    failures = [ConnectionError("DB down"), ConnectionError("DB down")]
+
+    def failing_push_checks(db, checks):
+        if len(failures) > 0:
+            raise failures.pop()
+        return real_push_checks(db, checks)
+    check_buffer.push_checks = failing_push_checks
+    try:
+        checkBuffer.push(team_id=0, service_id=0, status=OK, timestamp=int(time.time()))
+        assert checkBuffer.flush() == 0 and len(checkBuffer.pending) == 1, "A failed batch should be kept"
+        checkBuffer.push(team_id=1, service_id=0, status=OK, timestamp=int(time.time()))
+        assert checkBuffer.flush() == 0, "A failed batch should not be retried before the backoff"
+        assert checkBuffer.flush(force=True) == 0 and checkBuffer.retryDelay == 2 * config['misc']['check_flush_interval'], \
+            "The backoff should double at each failure"
+        assert checkBuffer.flush(force=True) == 1, "The failed batch should be retried before the buffer"
+        assert checkBuffer.flush() == 1, "The buffer should be flushed after the failed batch"
+    finally:
+        check_buffer.push_checks = real_push_checks
+    assert count_checks(db) == [1, 1], "Each check should have been persisted once"
+
+
+tests = [flush_interval_test, flush_size_test, flush_on_stop_test, flush_retry_test]
+
+if __name__ == "__main__":
+    for test in tests:
+        log(f"Starting test: {test.__name__}")
+        try:
+            test()
+        except AssertionError as e:
+            log(f"Test {test.__name__} failed: {e.args}")
+            continue
+        log(f"Test {test.__name__} completed successfully")
@@ -1,7 +1,11 @@
 import mongomock
+import re
 
 from check_scheduler import *
-from mongo_utils import insert_team_if_not_exists, insert_service_if_not_exists, get_teams, get_services
+from mongo_utils import insert_team_if_not_exists, insert_service_if_not_exists, get_teams, get_services, \
+    get_flags_for_round, create_index
+from game_clock import SimulatedClock
+from event_queue import EVENT_CHECK, STATUS_NAMES
 from checker_lib import *
 
 config = {
@@ -66,12 +70,12 @@ def sanity_check(db, checkScheduler, queue):
     for team in teams:
         for service in services:
             events_team_i_service_j = [i for i in filter(
-                lambda e: e['team'] == team['team_id'] and e['service'] == service['service_id'], events)]
+                lambda e: e.team == team['team_id'] and e.service == service['service_id'], events)]
             assert len(events_team_i_service_j) == n_checks_for_service, \
                 f"There should be {n_checks_for_service} check events for each service and for each team"
             for event in events_team_i_service_j:
-                assert event['status'] in possible_status, "Event status should be among valid statuses"
-                assert event['type'] == EVENT_CHECK, "Event type should be EVENT_CHECK"
+                assert STATUS_NAMES[event.status] in possible_status, "Event status should be among valid statuses"
+                assert event.type == EVENT_CHECK, "Event type should be EVENT_CHECK"
     # test on flags
     n_flags = checkScheduler.maxRounds * len(checkScheduler.teams) * len(checkScheduler.services)
     col = db.get_collection("flag")
@@ -118,6 +122,8 @@ def resume_test():
     config['misc']['round_time'] = 9
     checkScheduler = CheckScheduler(queue, config)
     checkScheduler.start()
+    # round i starts at start_time + i * round_time, and its checks are completed in the first 2/3 of the round:
+    # the scheduler is stopped after the checks of round 2 and before the start of round 3
     time.sleep(35)
     checkScheduler.stopped = True
     checkScheduler.join()
@@ -176,7 +182,90 @@ def stop_test():
     assert checkScheduler.roundNum == 2, "The scheduler should run the pending job, then stop itself"
 
 
-tests = [common_test, resume_test, after_end_test, start_time_after_end_time_test, stop_test]
+@mongomock.patch(servers=(('mock.mongodb.com', 27017),))
+def prepare_round_test():
+    db, queue = prepare_test()
+    create_index(db, collection_name='flag', column_name='flag_data')
+    checkScheduler = CheckScheduler(queue, config)
+    flags = checkScheduler.prepareRound(1)
+    assert len(flags) == len(config['teams']) * len(config['services']), "There should be a flag for each team and service"
+    pattern = re.compile(config['misc']['flag_header'] + r'\{[a-f0-9]{' + str(config['misc']['flag_body_len']) + r'}\}')
+    for flag, seed in flags.values():
+        assert pattern.fullmatch(flag) is not None, "Flags should match the flag pattern"
+        assert re.fullmatch(r'[a-f0-9]{32}', seed) is not None, "Seeds should be 32 hex chars"
+    assert len(set(flag for flag, _ in flags.values())) == len(flags), "Flags of a round should be unique"
+    assert len(get_flags_for_round(db, 1)) == len(flags), "All the flags of the round should be stored"
+    assert checkScheduler.prepareRound(1) == flags, "Flags already stored for a round should be reused"
+    assert len(get_flags_for_round(db, 1)) == len(flags), "Flags of a round should be stored only once"
+
+
+@mongomock.patch(servers=(('mock.mongodb.com', 27017),))
+def flag_collision_test():
+    db, queue = prepare_test()
+    create_index(db, collection_name='flag', column_name='flag_data')
+    checkScheduler = CheckScheduler(queue, config)
+    old_flags = [flag for flag, _ in checkScheduler.prepareRound(1).values()]
+    real_gen_flags = checker_lib.gen_flags
+    calls = []
+
+    def colliding_gen_flags(n, flag_header, flag_body_len):
+        # the first generation collides with two flags of the previous round
+        calls.append(n)
+        flags = real_gen_flags(n, flag_header, flag_body_len)
+        if len(calls) == 1:
+            flags[0], flags[-1] = old_flags[0], old_flags[1]
+        return flags
+    checker_lib.gen_flags = colliding_gen_flags
+    try:
+        flags = checkScheduler.prepareRound(2)
+    finally:
+        checker_lib.gen_flags = real_gen_flags
+    n_flags = len(config['teams']) * len(config['services'])
+    assert calls == [n_flags, 2], "Only the colliding flags should be generated again"
+    assert len(get_flags_for_round(db, 2)) == n_flags, "All the flags of the round should be stored"
+    assert all(flag not in old_flags for flag, _ in flags.values()), "Colliding flags should have been replaced"
+
+
+@mongomock.patch(servers=(('mock.mongodb.com', 27017),))
+def prepare_ahead_test():
+    db, queue = prepare_test()
+    now = datetime.datetime.now()
+    fmt = "%d %b %Y %H:%M:%S"
+    config['misc']['start_time'] = (now + datetime.timedelta(seconds=10)).strftime(fmt)
+    config['misc']['end_time'] = (now + datetime.timedelta(seconds=100)).strftime(fmt)
+    config['misc']['round_time'] = 9
+    config['misc']['prepare_next_round'] = True
+    try:
+        checkScheduler = CheckScheduler(queue, config, SimulatedClock(start=time.time(), speed=20))
+        checkScheduler.start()
+        checkScheduler.join()
+    finally:
+        del config['misc']['prepare_next_round']
+    n_flags = checkScheduler.maxRounds * len(config['teams']) * len(config['services'])
+    assert len([f for f in db.get_collection("flag").find()]) == n_flags, \
+        f"Total num of flags should be {n_flags}, without flags prepared after the last round"
+
+
+@mongomock.patch(servers=(('mock.mongodb.com', 27017),))
+def recent_flags_window_test():
+    db, queue = prepare_test()
+    checkScheduler = CheckScheduler(queue, config, SimulatedClock(start=time.time(), speed=1000))
+    stored = {round_num: checkScheduler.prepareRound(round_num) for round_num in range(1, 8)}
+    # as after a resume at the end of round 7: the window is loaded at the next scheduling
+    checkScheduler.roundNum = 7
+    checkScheduler.checkerScheduling()
+    lifetime = checkScheduler.flagLifetime
+    assert sorted(checkScheduler.recentFlags.keys()) == list(range(8 - lifetime, 9)), \
+        "The window should contain the flags of the last flag lifetime + 1 rounds"
+    for round_num in range(8 - lifetime, 8):
+        assert checkScheduler.recentFlags[round_num] == stored[round_num], "The window should contain the stored flags"
+    assert checkScheduler.recentFlags[8] == checkScheduler.prepareRound(8), "The window should include the new round"
+    checkScheduler.checkerScheduling()
+    assert sorted(checkScheduler.recentFlags.keys()) == list(range(9 - lifetime, 10)), \
+        "The window should slide, dropping the flags which are not checked anymore"
+
+tests = [common_test, resume_test, after_end_test, start_time_after_end_time_test, stop_test, prepare_round_test,
+         flag_collision_test, prepare_ahead_test, recent_flags_window_test]
 
 if __name__ == "__main__":
     for test in tests:
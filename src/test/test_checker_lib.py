@@ -0,0 +1,118 @@
+import hashlib
+import http.server
+import socketserver
+import threading
+
+from checker_lib import CheckerUtils, HostResolver, HTTPPool, SocketPool
+from project_utils import log
+
+
+class CountingHTTPHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    connections = 0
+
+    def setup(self):
+        super().setup()
+        CountingHTTPHandler.connections += 1
+
+    def do_GET(self):
+        body = self.path.encode()
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class EchoHandler(socketserver.StreamRequestHandler):
+    connections = 0
+
+    def handle(self):
+        EchoHandler.connections += 1
+        for line in self.rfile:
+            self.wfile.write(line)
+
+
+def serve(server):
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def utils_test():
+    utils = CheckerUtils()
+    assert len(utils.user_agents) > 0 and "" not in utils.user_agents, "User agents should be read from src folder"
+    assert len(utils.usernames) > 0 and "" not in utils.usernames, "Usernames should be read from src folder"
+    assert utils is CheckerUtils(), "CheckerUtils should be a singleton"
+    seed = "c2e192800a294acbb2ac7dd188502edb"
+    password = hashlib.sha256(seed.encode()).digest()
+    username = hashlib.sha256(password + seed.encode()).hexdigest()[:16]
+    assert utils.credentialsFromSeed(seed) == (username, password.hex()[:16]), "Credentials should not change"
+    hits = CheckerUtils.credentialsFromSeed.cache_info().hits
+    assert CheckerUtils.credentialsFromSeed(seed) == (username, password.hex()[:16])
+    assert CheckerUtils.credentialsFromSeed.cache_info().hits == hits + 1, "Credentials should be memoised"
+
+
+def http_pool_test():
+    server = serve(http.server.ThreadingHTTPServer(("127.0.0.1", 0), CountingHTTPHandler))
+    try:
+        pool = HTTPPool(HostResolver())
+        port = server.server_address[1]
+        for i in range(5):
+            status, _, body = pool.request("localhost", port, "GET", f"/path_{i}")
+            assert status == 200 and body == f"/path_{i}".encode(), "The response should be returned"
+        assert CountingHTTPHandler.connections == 1, "Requests should reuse the same connection"
+        # the idle connection is dropped, e.g. for a restart of the service: the request is retried with a new one
+        for conns in pool.idle.values():
+            for conn in conns:
+                conn.sock.shutdown(2)
+        server.shutdown()
+        server.server_close()
+        server = serve(http.server.ThreadingHTTPServer(("127.0.0.1", port), CountingHTTPHandler))
+        status, _, body = pool.request("localhost", port, "GET", "/again")
+        assert status == 200 and body == b"/again", "A closed idle connection should be replaced"
+        assert CountingHTTPHandler.connections == 2, "A new connection should be opened"
+        pool.close()
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def socket_pool_test():
+    server = serve(socketserver.ThreadingTCPServer(("127.0.0.1", 0), EchoHandler))
+    try:
+        pool = SocketPool(HostResolver())
+        port = server.server_address[1]
+        for i in range(3):
+            with pool.connection("127.0.0.1", port) as sock:
+                sock.sendall(f"line {i}\n".encode())
+                assert sock.recv(1024) == f"line {i}\n".encode(), "The service should answer"
+        assert EchoHandler.connections == 1, "The socket should be reused"
+        try:
+            with pool.connection("127.0.0.1", port) as sock:
+                raise ValueError("unexpected answer")
+        except ValueError:
+            pass
+        assert sock.fileno() == -1, "A socket used by a failed exchange should be closed"
+        with pool.connection("127.0.0.1", port) as sock:
+            sock.sendall(b"new\n")
+            assert sock.recv(1024) == b"new\n"
+        assert EchoHandler.connections == 2, "A new socket should replace the closed one"
+        pool.close()
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+tests = [utils_test, http_pool_test, socket_pool_test]
+
+if __name__ == "__main__":
+    for test in tests:
+        log(f"Starting test: {test.__name__}")
+        try:
+            test()
+        except AssertionError as e:
+            log(f"Test {test.__name__} failed: {e.args}")
+            continue
+        log(f"Test {test.__name__} completed successfully")
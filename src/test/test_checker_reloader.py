@@ -0,0 +1,152 @@
+import mongomock
+import os
+import time
+
+from checker_reloader import CheckerReloader
+from check_scheduler import CheckScheduler
+from checker_worker import CheckerWorker
+from event_queue import EventQueue
+from checker_lib import OK, CORRUPT, MUMBLE
+from project_utils import log
+
+CHECKER_PATH = "volume/reload_test_checker.py"
+
+config = {
+    "teams": [
+        {"id": 0, "host": "10.0.0.1", "name": "first", "token": "c2e192800a294acbb2ac7dd188502edb"},
+        {"id": 1, "host": "10.0.0.2", "name": "second", "token": "934310005a1447b8bd52d9dcbd5c405a"}
+    ],
+    "services": [
+        {"id": 0, "port": 7331, "name": "reloaded", "checker": CHECKER_PATH},
+        {"id": 1, "port": 7332, "name": "example_1", "checker": "volume/example/example_checker_1.py"}
+    ],
+    "mongo": {
+        "hostname": "mock.mongodb.com", "port": 27017, "db_name": "ad_kihon", "user": "admin", "password": "admin"
+    },
+    "flask": {
+        "port": 8080
+    },
+    "misc": {
+        "start_time": "11 apr 2022 15:30",
+        "end_time": "11 apr 2022 19:30",
+        "round_time": 60,
+        "flag_lifetime": 5,
+        "flag_header": "flag",
+        "flag_body_len": 30
+    }
+}
+
+CHECKER_TEMPLATE = """from checker import AbstractChecker
+from checker_lib import *
+
+
+class Checker(AbstractChecker):
+    def check(self):
+        return {status}
+
+    def put(self, flag_data: str, seed: str):
+        return OK
+
+    def get(self, flag_data: str, seed: str):
+        return OK
+"""
+
+
+def write_checker(source: str):
+    # the modification time is moved forward, because the file could be written twice in the same tick
+    mtime = os.stat(CHECKER_PATH).st_mtime + 1 if os.path.exists(CHECKER_PATH) else time.time()
+    with open(CHECKER_PATH, 'w') as f:
+        f.write(source)
+    os.utime(CHECKER_PATH, (mtime, mtime))
+
+
+def make_reloader():
+    teams = {team['id']: team for team in config['teams']}
+    services = {service['id']: service for service in config['services']}
+    moduleNames = {service_id: CheckScheduler.filePathToModuleName(service['checker'])
+                   for service_id, service in services.items()}
+    return CheckerReloader(config, teams, services, moduleNames)
+
+
+def reload_test():
+    write_checker(CHECKER_TEMPLATE.format(status="OK"))
+    try:
+        reloader = make_reloader()
+        reloader.poll()
+        assert reloader.takePending() == {}, "Nothing should be reloaded if checkers didn't change"
+        write_checker(CHECKER_TEMPLATE.format(status="CORRUPT"))
+        reloader.poll()
+        pending = reloader.takePending()
+        assert list(pending.keys()) == [0], "Only the changed checker should be reloaded"
+        module, checkers = pending[0]
+        assert sorted(checkers.keys()) == [0, 1], "The checker should be instantiated for each team"
+        assert all(checker.check() == CORRUPT for checker in checkers.values()), "The new version should be loaded"
+        assert reloader.takePending() == {}, "Pending reloads should be taken only once"
+    finally:
+        os.remove(CHECKER_PATH)
+
+
+def broken_reload_test():
+    write_checker(CHECKER_TEMPLATE.format(status="OK"))
+    try:
+        reloader = make_reloader()
+        write_checker("def Checker(:\n")
+        reloader.poll()
+        assert reloader.takePending() == {}, "A checker with syntax errors should not be reloaded"
+        write_checker("import not_existent_module\n")
+        reloader.poll()
+        assert reloader.takePending() == {}, "A checker with import errors should not be reloaded"
+        write_checker("x = 1\n")
+        reloader.poll()
+        assert reloader.takePending() == {}, "A module without a Checker class should not be reloaded"
+        write_checker(CHECKER_TEMPLATE.format(status="MUMBLE"))
+        reloader.poll()
+        assert 0 in reloader.takePending(), "A fixed checker should be reloaded"
+    finally:
+        os.remove(CHECKER_PATH)
+
+
+@mongomock.patch(servers=(('mock.mongodb.com', 27017),))
+def scheduler_swap_test():
+    write_checker(CHECKER_TEMPLATE.format(status="OK"))
+    try:
+        checkScheduler = CheckScheduler(EventQueue(), config)
+        old_checkers = checkScheduler.checkers
+        assert all(old_checkers[team_id][0].check() == OK for team_id in old_checkers), "The first version is loaded"
+        write_checker(CHECKER_TEMPLATE.format(status="MUMBLE"))
+        checkScheduler.reloader.poll()
+        assert checkScheduler.checkers[0][0].check() == OK, "Checkers should not be swapped before the next round"
+        checkScheduler.applyReloads()
+        assert all(checkScheduler.checkers[team_id][0].check() == MUMBLE for team_id in checkScheduler.checkers), \
+            "The new version should be used for all the teams"
+        assert checkScheduler.checkers[0][1] is old_checkers[0][1], "Other checkers should not be changed"
+        assert old_checkers[0][0].check() == OK, "Running checkers should keep the old version"
+    finally:
+        os.remove(CHECKER_PATH)
+
+
+def worker_reload_test():
+    write_checker(CHECKER_TEMPLATE.format(status="OK"))
+    try:
+        worker = CheckerWorker(broker=None)
+        team, service = config['teams'][0], config['services'][0]
+        assert worker.getChecker(team, service).check() == OK, "The checker should be loaded"
+        write_checker("def Checker(:\n")
+        assert worker.getChecker(team, service).check() == OK, "The old version should be kept on errors"
+        write_checker(CHECKER_TEMPLATE.format(status="CORRUPT"))
+        assert worker.getChecker(team, service).check() == CORRUPT, "The new version should be loaded"
+    finally:
+        os.remove(CHECKER_PATH)
+
+
+tests = [reload_test, broken_reload_test, scheduler_swap_test, worker_reload_test]
+
+if __name__ == "__main__":
+    for test in tests:
+        log(f"Starting test: {test.__name__}")
+        try:
+            test()
+        except AssertionError as e:
+            log(f"Test {test.__name__} failed: {e.args}")
+            continue
+        log(f"Test {test.__name__} completed successfully")
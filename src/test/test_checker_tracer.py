@@ -0,0 +1,133 @@
+import mongomock
+import time
+
+import checker_tracer
+from checker_tracer import CheckerTracer
+from mongo_utils import get_db_manager
+from checker_lib import OK, DOWN
+from project_utils import log
+
+config = {
+    "mongo": {
+        "hostname": "mock.mongodb.com", "port": 27017, "db_name": "ad_kihon", "user": "admin", "password": "admin"
+    },
+    "misc": {
+        "trace_flush_interval": 2,
+        "trace_flush_size": 4,
+        "trace_buffer_size": 10
+    }
+}
+
+
+def count_traces(db):
+    return db.get_collection("trace").count_documents({})
+
+
+@mongomock.patch(servers=(('mock.mongodb.com', 27017),))
+def trace_test():
+    db, _ = get_db_manager(config['mongo'])
+    tracer = CheckerTracer(config)
+
+    def slow_get():
+        time.sleep(0.05)
+        return DOWN
+
+    def broken_put():
+        raise ConnectionRefusedError
+    assert tracer.trace(1, 0, 0, "check", lambda: OK) == OK, "The result of the action should be returned"
+    assert tracer.trace(1, 1, 0, "get", slow_get) == DOWN, "The result of the action should be returned"
+    exception = False
+    try:
+        tracer.trace(1, 0, 1, "put", broken_put)
+    except ConnectionRefusedError:
+        exception = True
+    assert exception, "The exception of the action should be raised again"
+    slowest = tracer.slowest(1, 2)
+    assert len(slowest) == 2, "There should be as many actions as the limit"
+    assert slowest[0]['team_id'] == 1 and slowest[0]['action'] == "get" and slowest[0]['duration'] >= 0.05, \
+        "The slowest action should be the first one"
+    put = [t for t in tracer.slowest(1) if t['action'] == "put"][0]
+    assert put['exception'] == "ConnectionRefusedError" and put['result'] is None, \
+        "The exception type should be traced"
+    summary = tracer.summary(1)
+    assert summary['actions'] == 3 and summary['services'][0]['actions'] == 2, "The summary should count the actions"
+    assert summary['services'][1]['exceptions'] == 1, "The summary should count the exceptions"
+
+
+@mongomock.patch(servers=(('mock.mongodb.com', 27017),))
+def batched_persistence_test():
+    db, _ = get_db_manager(config['mongo'])
+    tracer = CheckerTracer(config)
+    tracer.start()
+    for i in range(3):
+        tracer.record(1, i, 0, "check", time.time(), 0.1, OK)
+    time.sleep(0.5)
+    assert count_traces(db) == 0, "Traces should not be persisted before the flush interval"
+    tracer.record(1, 3, 0, "check", time.time(), 0.1, OK)
+    time.sleep(0.5)
+    assert count_traces(db) == 4, "Traces should be persisted as soon as the flush size is reached"
+    tracer.record(1, 4, 0, "check", time.time(), 0.1, OK)
+    time.sleep(config['misc']['trace_flush_interval'] + 0.5)
+    assert count_traces(db) == 5, "Traces should be persisted after the flush interval"
+    tracer.record(1, 5, 0, "check", time.time(), 0.1, OK)
+    tracer.stop()
+    assert count_traces(db) == 6, "Pending traces should be persisted on stop"
+
+
+@mongomock.patch(servers=(('mock.mongodb.com', 27017),))
+def ring_buffer_test():
+    db, _ = get_db_manager(config['mongo'])
+    tracer = CheckerTracer(config)
+    for round_num in range(1, 5):
+        for team_id in range(4):
+            tracer.record(round_num, team_id, 0, "check", time.time(), round_num + team_id / 10, OK)
+    assert len(tracer.ring) == config['misc']['trace_buffer_size'], "The ring buffer should be bounded"
+    assert len(tracer.slowest(4)) == 4, "Recent rounds should be read from the ring buffer"
+    # round 2 is only partially in the ring buffer, so it's read from the DB
+    slowest = tracer.slowest(2)
+    assert len(slowest) == 4, "Old rounds should be read from the DB"
+    assert [t['team_id'] for t in slowest] == [3, 2, 1, 0], "Actions should be sorted by duration"
+
+
+@mongomock.patch(servers=(('mock.mongodb.com', 27017),))
+def summary_test():
+    db, _ = get_db_manager(config['mongo'])
+    tracer = CheckerTracer(config)
+    logged = []
+    checker_tracer.log, log_func = logged.append, checker_tracer.log
+
+    def no_db_reads(round_num):
+        raise AssertionError("The summary should not read the traces")
+    tracer.roundTraces = no_db_reads
+    try:
+        tracer.start()
+        for team_id in range(5):
+            tracer.record(1, team_id, team_id % 2, "check", time.time(), team_id / 10, OK,
+                          "TimeoutError" if team_id == 4 else None)
+        tracer.record(2, 0, 0, "check", time.time(), 0.1, OK)
+        summary = tracer.summary(1)
+        assert summary['actions'] == 5 and summary['services'][0]['actions'] == 3, "The summary should count actions"
+        assert summary['services'][0]['exceptions'] == 1, "The summary should count the exceptions"
+        assert [t['team_id'] for t in summary['slowest']] == [4, 3, 2], "The slowest actions should be kept"
+        tracer.logSummary(1)
+        time.sleep(0.5)
+        assert len(logged) == 1 and "round 1" in logged[0], "The summary should be logged by the tracer's thread"
+        assert list(tracer.rounds.keys()) == [2], "The statistics of the logged rounds should be dropped"
+        tracer.stop()
+    finally:
+        checker_tracer.log = log_func
+    indexes = db.get_collection("trace").index_information()
+    assert any(index['key'] == [("round_num", 1)] for index in indexes.values()), "Traces should be indexed by round"
+
+
+tests = [trace_test, batched_persistence_test, ring_buffer_test, summary_test]
+
+if __name__ == "__main__":
+    for test in tests:
+        log(f"Starting test: {test.__name__}")
+        try:
+            test()
+        except AssertionError as e:
+            log(f"Test {test.__name__} failed: {e.args}")
+            continue
+        log(f"Test {test.__name__} completed successfully")
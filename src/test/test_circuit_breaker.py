@@ -0,0 +1,142 @@
+import mongomock
+import threading
+import time
+
+from circuit_breaker import CircuitBreaker
+from check_scheduler import CheckScheduler
+from event_queue import EventQueue, Status
+from checker_lib import OK, DOWN
+from project_utils import log
+
+config = {
+    "teams": [
+        {"id": 0, "host": "10.0.0.1", "name": "first", "token": "c2e192800a294acbb2ac7dd188502edb"},
+        {"id": 1, "host": "10.0.0.2", "name": "second", "token": "934310005a1447b8bd52d9dcbd5c405a"}
+    ],
+    "services": [
+        {"id": 0, "port": 7331, "name": "example_0", "checker": "volume/example/example_checker_0.py"},
+        {"id": 1, "port": 7332, "name": "example_1", "checker": "volume/example/example_checker_1.py"}
+    ],
+    "mongo": {
+        "hostname": "mock.mongodb.com", "port": 27017, "db_name": "ad_kihon", "user": "admin", "password": "admin"
+    },
+    "flask": {
+        "port": 8080
+    },
+    "misc": {
+        "start_time": "11 apr 2022 15:30",
+        "end_time": "11 apr 2022 19:30",
+        "round_time": 2,
+        "flag_lifetime": 3,
+        "flag_header": "flag",
+        "flag_body_len": 30,
+        "breaker_threshold": 2
+    }
+}
+services = {service['id']: service for service in config['services']}
+PAIRS = [(0, 0), (0, 1), (1, 0), (1, 1)]
+
+
+class CountingChecker:
+    def __init__(self, team, service, status):
+        self.team, self.service = team, service
+        self.status = status
+        self.calls = []
+
+    def check(self):
+        self.calls.append("check")
+        return self.status
+
+    def put(self, flag_data, seed):
+        self.calls.append("put")
+        return OK
+
+    def get(self, flag_data, seed):
+        self.calls.append("get")
+        return OK
+
+
+def down_rounds(breaker, rounds):
+    for round_num in rounds:
+        breaker.startRound(round_num, PAIRS)
+        breaker.recordCheck(round_num, 0, 0, DOWN)
+
+
+def short_circuit_test():
+    breaker = CircuitBreaker(config, services)
+    breaker.startRound(1, PAIRS)
+    assert not breaker.shouldSkip(1, 0, 0, False), "Checks should run while the service isn't down"
+    breaker.recordCheck(1, 0, 0, OK)
+    assert not breaker.shouldSkip(1, 0, 0, False), "Checks should run while the service isn't down"
+    breaker.recordCheck(1, 0, 0, DOWN)
+    assert breaker.shouldSkip(1, 0, 0, False), "Checks should be skipped after a down check in the same round"
+    assert not breaker.shouldSkip(1, 0, 1, False) and not breaker.shouldSkip(1, 1, 0, False), \
+        "Only the checks of the same team and service should be skipped"
+    breaker.startRound(2, PAIRS)
+    assert not breaker.shouldSkip(2, 0, 0, False), "Checks should run again in the next round"
+    assert not breaker.shouldSkip(7, 0, 0, False), "Checks of unknown rounds should run"
+
+
+def probe_first_test():
+    breaker = CircuitBreaker(config, services)
+    down_rounds(breaker, [1, 2])
+    breaker.startRound(3, PAIRS)
+    assert breaker.isOpen(0, 0) and not breaker.isOpen(0, 1), "The breaker should be open after 2 down rounds"
+    skipped = []
+    waiter = threading.Thread(target=lambda: skipped.append(breaker.shouldSkip(3, 0, 0, False)))
+    waiter.start()
+    time.sleep(0.3)
+    assert waiter.is_alive(), "In probe-first mode, the other checks should wait for the probe"
+    assert not breaker.shouldSkip(3, 0, 0, True), "The probe should run"
+    breaker.recordCheck(3, 0, 0, OK)
+    breaker.endProbe(3, 0, 0)
+    waiter.join(timeout=1)
+    assert skipped == [False], "If the probe is not down, the other checks should run"
+    breaker.startRound(4, PAIRS)
+    assert not breaker.isOpen(0, 0), "The breaker should be closed after a round which is not down"
+
+
+def probe_down_test():
+    breaker = CircuitBreaker(config, services)
+    down_rounds(breaker, [1, 2])
+    breaker.startRound(3, PAIRS)
+    breaker.recordCheck(3, 0, 0, DOWN)
+    breaker.endProbe(3, 0, 0)
+    assert breaker.shouldSkip(3, 0, 0, False), "If the probe is down, the other checks should be skipped"
+    breaker.startRound(4, PAIRS)
+    assert breaker.isOpen(0, 0) and breaker.numOpen() == 1, "The breaker should stay open"
+
+
+@mongomock.patch(servers=(('mock.mongodb.com', 27017),))
+def scheduler_test():
+    queue = EventQueue()
+    checkScheduler = CheckScheduler(queue, config)
+    checkScheduler.roundNum = 4
+    team, service = config['teams'][0], config['services'][0]
+    checker = CountingChecker(team, service, DOWN)
+    checkScheduler.breaker.startRound(4, PAIRS)
+    now = time.time()
+    plan = {"check": now, "put": now, "get": now}
+    checkScheduler.runChecker(checker, "flag", "seed", 4, 4, plan)
+    for flag_round in range(1, 4):
+        checkScheduler.runChecker(checker, "flag", "seed", 4, flag_round, plan, True)
+    assert checker.calls == ["check"], "After a down check, the checker should not run again in the round"
+    events = [queue.get() for _ in range(queue.qsize())]
+    assert len(events) == 4 and all(e.status == Status.DOWN for e in events), "All the checks should be down"
+    up_checker = CountingChecker(team, config['services'][1], OK)
+    checkScheduler.runChecker(up_checker, "flag", "seed", 4, 4, plan)
+    checkScheduler.runChecker(up_checker, "flag", "seed", 4, 3, plan, True)
+    assert up_checker.calls == ["check", "put", "get", "check", "get"], "Checks of other services should run"
+
+
+tests = [short_circuit_test, probe_first_test, probe_down_test, scheduler_test]
+
+if __name__ == "__main__":
+    for test in tests:
+        log(f"Starting test: {test.__name__}")
+        try:
+            test()
+        except AssertionError as e:
+            log(f"Test {test.__name__} failed: {e.args}")
+            continue
+        log(f"Test {test.__name__} completed successfully")
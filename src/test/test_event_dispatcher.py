@@ -1,4 +1,5 @@
 import mongomock
+from typing import NamedTuple
 
 from event_dispatcher import *
 from mongo_utils import insert_team_if_not_exists, insert_service_if_not_exists, init_teams_points, get_teams
@@ -28,11 +29,18 @@ config = {
         "sla_weight": 80,
         "flag_header": "flag",
         "flag_body_len": 30,
-        "dispatch_frequency": 2
+        "dispatch_max_delay": 0.1
     }
 }
 
 
+class UnknownEvent(NamedTuple):
+    team: int
+    service: int
+    timestamp: int = None
+    type = 7
+
+
 def prepare_test():
     db, _ = get_db_manager(config['mongo'])
     for team in config['teams']:
@@ -49,15 +57,14 @@ def only_sla_test():
     db, eventQueue = prepare_test()
     eventDispatcher = EventDispatcher(eventQueue, config)
     eventDispatcher.start()
-    events = [{'type': EVENT_CHECK, 'status': OK, 'team': 0, 'service': 0},
-              {'type': EVENT_CHECK, 'status': DOWN, 'team': 0, 'service': 0},
-              {'type': EVENT_CHECK, 'status': CORRUPT, 'team': 0, 'service': 0},
-              {'type': EVENT_CHECK, 'status': MUMBLE, 'team': 0, 'service': 0},
-              {'type': EVENT_CHECK, 'status': ERROR, 'team': 0, 'service': 0},
-              {'type': EVENT_CHECK, 'status': OK, 'team': 1, 'service': 1}]
+    events = [check_event(0, 0, OK),
+              check_event(0, 0, DOWN),
+              check_event(0, 0, CORRUPT),
+              check_event(0, 0, MUMBLE),
+              check_event(0, 0, ERROR),
+              check_event(1, 1, OK)]
     for event in events:
-        event['timestamp'] = int(time.time())
-        eventQueue.put(event)
+        eventQueue.put(event._replace(timestamp=int(time.time())))
     time.sleep(5)
     assert eventQueue.empty(), "Events should have been consumed"
     teams = sorted([t for t in get_teams(db)], key=lambda t: t['team_id'])
@@ -77,11 +84,10 @@ def invalid_status_test():
     db, eventQueue = prepare_test()
     eventDispatcher = EventDispatcher(eventQueue, config)
     eventDispatcher.start()
-    events = [{'type': EVENT_CHECK, 'status': "invalid", 'team': 0, 'service': 0},
-              {'type': EVENT_CHECK, 'status': OK, 'team': 0, 'service': 0}]
+    events = [CheckEvent(0, 0, 99),
+              check_event(0, 0, OK)]
     for event in events:
-        event['timestamp'] = int(time.time())
-        eventQueue.put(event)
+        eventQueue.put(event._replace(timestamp=int(time.time())))
     time.sleep(5)
     assert eventQueue.empty(), "Events should have been consumed"
     teams = sorted([t for t in get_teams(db)], key=lambda t: t['team_id'])
@@ -96,11 +102,10 @@ def invalid_event_test():
     db, eventQueue = prepare_test()
     eventDispatcher = EventDispatcher(eventQueue, config)
     eventDispatcher.start()
-    events = [{'type': "event", 'status': OK, 'team': 0, 'service': 0},
-              {'type': EVENT_CHECK, 'status': OK, 'team': 0, 'service': 0}]
+    events = [UnknownEvent(0, 0),
+              check_event(0, 0, OK)]
     for event in events:
-        event['timestamp'] = int(time.time())
-        eventQueue.put(event)
+        eventQueue.put(event._replace(timestamp=int(time.time())))
     time.sleep(5)
     assert eventQueue.empty(), "Events should have been consumed"
     teams = sorted([t for t in get_teams(db)], key=lambda t: t['team_id'])
@@ -115,10 +120,9 @@ def attack_test():
     db, eventQueue = prepare_test()
     eventDispatcher = EventDispatcher(eventQueue, config)
     eventDispatcher.start()
-    events = [{'type': EVENT_ATTACK, 'team': 0, 'service': 0, 'attacked_team': 1}]
+    events = [AttackEvent(0, 0, 1)]
     for event in events:
-        event['timestamp'] = int(time.time())
-        eventQueue.put(event)
+        eventQueue.put(event._replace(timestamp=int(time.time())))
     time.sleep(5)
     assert eventQueue.empty(), "Events should have been consumed"
     teams = sorted([t for t in get_teams(db)], key=lambda t: t['team_id'])
@@ -136,7 +140,7 @@ def no_timestamp_test():
     db, eventQueue = prepare_test()
     eventDispatcher = EventDispatcher(eventQueue, config)
     eventDispatcher.start()
-    events = [{'type': EVENT_ATTACK, 'team': 0, 'service': 0, 'attacked_team': 1}]
+    events = [AttackEvent(0, 0, 1)]
     for event in events:
         eventQueue.put(event)
     time.sleep(5)
@@ -156,16 +160,15 @@ def mixed_test():
     db, eventQueue = prepare_test()
     eventDispatcher = EventDispatcher(eventQueue, config)
     eventDispatcher.start()
-    events = [{'type': EVENT_ATTACK, 'team': 0, 'service': 0, 'attacked_team': 1},
-              {'type': EVENT_CHECK, 'status': OK, 'team': 0, 'service': 0},
-              {'type': EVENT_CHECK, 'status': DOWN, 'team': 0, 'service': 0},
-              {'type': EVENT_CHECK, 'status': CORRUPT, 'team': 0, 'service': 0},
-              {'type': EVENT_CHECK, 'status': MUMBLE, 'team': 0, 'service': 0},
-              {'type': EVENT_CHECK, 'status': ERROR, 'team': 0, 'service': 0},
-              {'type': EVENT_CHECK, 'status': OK, 'team': 1, 'service': 1}]
+    events = [AttackEvent(0, 0, 1),
+              check_event(0, 0, OK),
+              check_event(0, 0, DOWN),
+              check_event(0, 0, CORRUPT),
+              check_event(0, 0, MUMBLE),
+              check_event(0, 0, ERROR),
+              check_event(1, 1, OK)]
     for event in events:
-        event['timestamp'] = int(time.time())
-        eventQueue.put(event)
+        eventQueue.put(event._replace(timestamp=int(time.time())))
     time.sleep(5)
     assert eventQueue.empty(), "Events should have been consumed"
     teams = sorted([t for t in get_teams(db)], key=lambda t: t['team_id'])
@@ -192,7 +195,75 @@ def mixed_test():
     eventDispatcher.stopped = True
 
 
-tests = [only_sla_test, invalid_status_test, invalid_event_test, attack_test, no_timestamp_test, mixed_test]
+@mongomock.patch(servers=(('mock.mongodb.com', 27017),))
+def micro_batch_test():
+    db, eventQueue = prepare_test()
+    config['misc']['dispatch_max_batch'] = 3
+    config['misc']['dispatch_max_delay'] = 0.5
+    try:
+        eventDispatcher = EventDispatcher(eventQueue, config)
+    finally:
+        config['misc']['dispatch_max_batch'] = 1000
+        config['misc']['dispatch_max_delay'] = 0.1
+    eventQueue.putMany([check_event(0, 0, OK) for _ in range(4)])
+    start = time.time()
+    assert len(eventDispatcher.nextBatch()) == 3, "A batch should have at most dispatch_max_batch events"
+    assert time.time() - start < 0.25, "A full batch should be dispatched without waiting"
+    threading.Timer(0.2, eventQueue.put, args=(check_event(0, 0, OK),)).start()
+    start = time.time()
+    assert len(eventDispatcher.nextBatch()) == 2, "Events arrived during the delay should be in the same batch"
+    assert 0.4 < time.time() - start < 1, "A batch should be dispatched after dispatch_max_delay"
+
+
+@mongomock.patch(servers=(('mock.mongodb.com', 27017),))
+def wake_up_test():
+    db, eventQueue = prepare_test()
+    eventDispatcher = EventDispatcher(eventQueue, config)
+    eventDispatcher.start()
+    time.sleep(0.5)
+    eventQueue.put(check_event(1, 0, OK, int(time.time())))
+    time.sleep(0.5)
+    teams = sorted([t for t in get_teams(db)], key=lambda t: t['team_id'])
+    team_1_points = sorted(teams[1]['points'], key=lambda p: p['service_id'])
+    assert team_1_points[0]['sla_pts'] == 1, "The event should be dispatched right after dispatch_max_delay"
+    eventDispatcher.stopped = True
+    eventDispatcher.join()
+
+
+@mongomock.patch(servers=(('mock.mongodb.com', 27017),))
+def backlog_alert_test():
+    db, eventQueue = prepare_test()
+    config['misc']['event_backlog_threshold'] = 4
+    try:
+        eventDispatcher = EventDispatcher(eventQueue, config)
+    finally:
+        del config['misc']['event_backlog_threshold']
+    alerts = BACKLOG_ALERTS.get()
+    eventQueue.putMany([check_event(0, 0, OK, int(time.time()) - 10) for _ in range(6)])
+    assert eventDispatcher.oldestEventAge() >= 10, "The age of the oldest event should be exposed"
+    eventDispatcher.checkBacklog()
+    eventDispatcher.checkBacklog()
+    assert BACKLOG_ALERTS.get() == alerts + 1, "The alert should be raised once"
+    eventQueue.getMany(5)
+    eventDispatcher.checkBacklog()
+    assert not eventDispatcher.backlogAlert, "The alert should be reset when the backlog is back under half"
+    eventQueue.putMany([check_event(0, 0, OK) for _ in range(4)])
+    eventDispatcher.checkBacklog()
+    assert BACKLOG_ALERTS.get() == alerts + 2, "The alert should be raised again"
+
+
+@mongomock.patch(servers=(('mock.mongodb.com', 27017),))
+def deprecated_frequency_test():
+    misc = {k: v for k, v in config['misc'].items() if k != 'dispatch_max_delay'}
+    eventDispatcher = EventDispatcher(EventQueue(), dict(config, misc=dict(misc, dispatch_frequency=2)))
+    assert eventDispatcher.maxDelay == 2, "The deprecated dispatch_frequency should be used as dispatch_max_delay"
+    eventDispatcher = EventDispatcher(EventQueue(), dict(config, misc=dict(config['misc'], dispatch_frequency=2)))
+    assert eventDispatcher.maxDelay == config['misc']['dispatch_max_delay'], \
+        "dispatch_max_delay should take precedence over the deprecated dispatch_frequency"
+
+
+tests = [only_sla_test, invalid_status_test, invalid_event_test, attack_test, no_timestamp_test, mixed_test,
+         micro_batch_test, wake_up_test, backlog_alert_test, deprecated_frequency_test]
 
 if __name__ == "__main__":
     for test in tests:
@@ -0,0 +1,68 @@
+import threading
+import queue
+import time
+
+from event_queue import *
+from checker_lib import OK, CORRUPT
+from project_utils import log
+
+
+def typed_events_test():
+    event = check_event(0, 1, CORRUPT, 100)
+    assert event.type == EVENT_CHECK and event.status == Status.CORRUPT, "The status should be encoded as an int"
+    assert STATUS_NAMES[event.status] == CORRUPT, "The status should be decoded to the checker's status"
+    assert not hasattr(event, "__dict__"), "Events should not have a dict"
+    attack = AttackEvent(0, 1, 2)
+    assert attack.type == EVENT_ATTACK and attack.timestamp is None, "The timestamp should be optional"
+    try:
+        check_event(0, 1, "invalid")
+        assert False, "An invalid status should raise an exception"
+    except KeyError:
+        pass
+
+
+def encoding_test():
+    events = [check_event(0, 1, OK, 1650383468), AttackEvent(3, 1, 65535, 1650383469), CheckEvent(2, 0, Status.DOWN)]
+    data = encode_events(events)
+    assert len(data) == len(events) * RECORD.size, "Each event should be a fixed size record"
+    assert decode_events(data) == events, "Decoded events should be equal to the encoded ones"
+    assert decode_events(b"") == [], "No data should be decoded to no events"
+
+
+def batch_test():
+    eventQueue = EventQueue()
+    events = [check_event(i, 0, OK, i) for i in range(10)]
+    eventQueue.putMany(events)
+    assert eventQueue.qsize() == 10, "All the events should be queued"
+    assert eventQueue.getMany(4) == events[:4], "At most 4 events should be returned, in order"
+    assert eventQueue.getMany(100) == events[4:], "The remaining events should be returned"
+    try:
+        eventQueue.getMany(100, block=False)
+        assert False, "An empty queue should raise queue.Empty"
+    except queue.Empty:
+        pass
+    try:
+        eventQueue.getMany(100, timeout=0.1)
+        assert False, "An empty queue should raise queue.Empty after the timeout"
+    except queue.Empty:
+        pass
+    threading.Timer(0.2, eventQueue.putMany, args=(events[:3],)).start()
+    start = time.time()
+    assert eventQueue.getMany(100) == events[:3], "A blocking get should wait for the events"
+    assert time.time() - start >= 0.1, "A blocking get should wait for the events"
+    bounded = EventQueue(maxsize=20)
+    bounded.putMany(events)
+    assert bounded.getMany(100) == events, "A bounded queue should support batches too"
+
+
+tests = [typed_events_test, encoding_test, batch_test]
+
+if __name__ == "__main__":
+    for test in tests:
+        log(f"Starting test: {test.__name__}")
+        try:
+            test()
+        except AssertionError as e:
+            log(f"Test {test.__name__} failed: {e.args}")
+            continue
+        log(f"Test {test.__name__} completed successfully")
@@ -0,0 +1,152 @@
+import mongomock
+import datetime
+import time
+import pymongo
+
+from flag_archiver import FlagArchiver
+from submission_service import SubmissionService
+from mongo_utils import *
+from event_queue import EventQueue
+from checker_lib import gen_flag, gen_seed
+from project_utils import log
+
+config = {
+    "teams": [
+        {"id": 0, "host": "10.0.0.1", "name": "first", "token": "c2e192800a294acbb2ac7dd188502edb"},
+        {"id": 1, "host": "10.0.0.2", "name": "second", "token": "934310005a1447b8bd52d9dcbd5c405a"}
+    ],
+    "services": [
+        {"id": 0, "port": 7331, "name": "example_0", "checker": "volume/example/example_checker_0.py"},
+        {"id": 1, "port": 7332, "name": "example_1", "checker": "volume/example/example_checker_1.py"}
+    ],
+    "mongo": {
+        "hostname": "mock.mongodb.com", "port": 27017, "db_name": "ad_kihon", "user": "admin", "password": "admin"
+    },
+    "flask": {
+        "port": 8080
+    },
+    "misc": {
+        "start_time": "11 apr 2022 15:30",
+        "end_time": "11 apr 2022 19:30",
+        "round_time": 120,
+        "flag_lifetime": 2,
+        "atk_weight": 10,
+        "def_weight": 10,
+        "sla_weight": 80,
+        "flag_header": "flag",
+        "flag_body_len": 30,
+        "rate_limit_seconds": 5,
+        "max_flags_per_submission": 20
+    }
+}
+
+NUM_ROUNDS = 6
+
+
+def to_time_str(timestamp: int):
+    fmt = "%d %b %Y %H:%M:%S"
+    return datetime.datetime.fromtimestamp(timestamp).strftime(fmt)
+
+
+def prepare_test():
+    # a flag for each team, service and round in [1, NUM_ROUNDS]; returns {round: [flags]}
+    db, _ = get_db_manager(config['mongo'])
+    for team in config['teams']:
+        insert_team_if_not_exists(db, team['id'], team['host'], team['name'], team['token'])
+    for service in config['services']:
+        insert_service_if_not_exists(db, service['id'], service['port'], service['name'])
+    create_flag_indexes(db)
+    flags = {}
+    for round_num in range(1, NUM_ROUNDS + 1):
+        flags[round_num] = []
+        for team in config['teams']:
+            for service in config['services']:
+                flag = gen_flag(config['misc']['flag_header'], config['misc']['flag_body_len'])
+                insert_flag(db, flag, gen_seed(), round_num, team['id'], service['id'])
+                flags[round_num].append(flag)
+    return db, flags
+
+
+@mongomock.patch(servers=(('mock.mongodb.com', 27017),))
+def archive_expired_rounds_test():
+    db, flags = prepare_test()
+    archiver = FlagArchiver(config, lambda: NUM_ROUNDS)
+    archived = archiver.archive()
+    # at round 6 with lifetime 2, rounds 4, 5 and 6 are alive and round 3 is kept for the flags in flight
+    assert archived == 2 * 4, f"Flags of rounds 1 and 2 should have been archived, not {archived}"
+    rounds = {flag['round_num'] for flag in db.get_collection("flag").find()}
+    assert rounds == {3, 4, 5, 6}, f"The flag collection should have rounds 3 to 6, not {rounds}"
+    rounds = {flag['round_num'] for flag in db.get_collection(FLAG_ARCHIVE).find()}
+    assert rounds == {1, 2}, f"The archive should have rounds 1 and 2, not {rounds}"
+    assert archiver.archive() == 0, "Nothing should be archived twice"
+
+
+@mongomock.patch(servers=(('mock.mongodb.com', 27017),))
+def lookup_archived_flags_test():
+    db, flags = prepare_test()
+    FlagArchiver(config, lambda: NUM_ROUNDS).archive()
+    flag = get_flag_by_data(db, flags[1][0])
+    assert flag['round_num'] == 1, "An archived flag should be found by its data"
+    flag = get_flag_for_round(db, round_num=2, team_id=1, service_id=1)
+    assert flag['flag_data'] == flags[2][3], "An archived flag should be found by its round"
+    assert len(get_flags_for_round(db, 1)) == 4, "The flags of an archived round should be found"
+    found = {flag['flag_data'] for flag in get_flags_for_rounds(db, 1, NUM_ROUNDS)}
+    expected = {flag for round_flags in flags.values() for flag in round_flags}
+    assert found == expected, "The flags of archived and alive rounds should be found"
+
+
+@mongomock.patch(servers=(('mock.mongodb.com', 27017),))
+def flag_indexes_test():
+    db, _ = get_db_manager(config['mongo'])
+    # as if the DB was created by a previous version, with a text index
+    db.get_collection(FLAG_ARCHIVE).create_index([("flag_data", pymongo.TEXT)], unique=True)
+    create_flag_indexes(db)
+    for collection_name in ["flag", FLAG_ARCHIVE]:
+        indexes = db.get_collection(collection_name).index_information()
+        assert any(index['key'] == [("flag_data", pymongo.ASCENDING)] and index.get('unique')
+                   for index in indexes.values()), f"Lookups by flag_data in {collection_name} should be indexed"
+        assert "flag_data_text" not in indexes, f"The text index of {collection_name} should be dropped"
+
+
+@mongomock.patch(servers=(('mock.mongodb.com', 27017),))
+def interrupted_archive_test():
+    db, flags = prepare_test()
+    # as if the process died after copying round 1, before deleting it
+    copied = [flag for flag in db.get_collection("flag").find({"round_num": 1})]
+    db.get_collection(FLAG_ARCHIVE).insert_many(copied)
+    assert len(get_flags_for_rounds(db, 1, 1)) == 4, "A flag in both collections should be returned once"
+    FlagArchiver(config, lambda: NUM_ROUNDS).archive()
+    assert db.get_collection(FLAG_ARCHIVE).count_documents({}) == 8, "Archived flags should not be duplicated"
+    assert db.get_collection("flag").count_documents({"round_num": {"$lt": 3}}) == 0, \
+        "Copied flags should be deleted anyway"
+
+
+@mongomock.patch(servers=(('mock.mongodb.com', 27017),))
+def submit_archived_flag_test():
+    db, flags = prepare_test()
+    FlagArchiver(config, lambda: NUM_ROUNDS).archive()
+    config['misc']['start_time'] = to_time_str(int(time.time()))
+    config['misc']['end_time'] = to_time_str(int(time.time()) + 300)
+
+    class MockCheckScheduler:
+        roundNum = NUM_ROUNDS
+
+    submissionService = SubmissionService(EventQueue(), config, MockCheckScheduler())
+    # flags[1][2] is owned by team 1
+    msg = submissionService.submitFlags("c2e192800a294acbb2ac7dd188502edb", [flags[1][2]])
+    assert msg['num_old'] == 1, "An archived flag should be old, not invalid"
+
+
+tests = [archive_expired_rounds_test, lookup_archived_flags_test, flag_indexes_test, interrupted_archive_test,
+         submit_archived_flag_test]
+
+
+if __name__ == "__main__":
+    for test in tests:
+        log(f"Starting test: {test.__name__}")
+        try:
+            test()
+        except AssertionError as e:
+            log(f"Test {test.__name__} failed: {e.args}")
+            continue
+        log(f"Test {test.__name__} completed successfully")
@@ -0,0 +1,86 @@
+import mongomock
+import datetime
+import time
+
+from game_clock import SimulatedClock
+from check_scheduler import CheckScheduler
+from event_queue import EventQueue
+from mongo_utils import get_db_manager, insert_team_if_not_exists, insert_service_if_not_exists, get_teams
+from project_utils import log
+
+config = {
+    "teams": [
+        {"id": 0, "host": "10.0.0.1", "name": "first", "token": "c2e192800a294acbb2ac7dd188502edb"},
+        {"id": 1, "host": "10.0.0.2", "name": "second", "token": "934310005a1447b8bd52d9dcbd5c405a"}
+    ],
+    "services": [
+        {"id": 0, "port": 7331, "name": "example_0", "checker": "volume/example/example_checker_0.py"},
+        {"id": 1, "port": 7332, "name": "example_1", "checker": "volume/example/example_checker_1.py"}
+    ],
+    "mongo": {
+        "hostname": "mock.mongodb.com", "port": 27017, "db_name": "ad_kihon", "user": "admin", "password": "admin"
+    },
+    "flask": {
+        "port": 8080
+    },
+    "misc": {
+        "start_time": "11 apr 2022 15:30",
+        "end_time": "11 apr 2022 19:30",
+        "round_time": 60,
+        "flag_lifetime": 5,
+        "flag_header": "flag",
+        "flag_body_len": 30
+    }
+}
+
+
+def simulated_clock_test():
+    start = time.time()
+    clock = SimulatedClock(start=start, speed=100)
+    real_start = time.monotonic()
+    clock.sleep(50)
+    real_elapsed = time.monotonic() - real_start
+    assert real_elapsed < 2, "A sleep of 50 seconds should take about 0.5 seconds at speed 100"
+    assert clock.time() - start >= 50, "The simulated clock should have advanced by at least 50 seconds"
+    assert abs(clock.now().timestamp() - clock.time()) < 1, "now() and time() should be consistent"
+
+
+@mongomock.patch(servers=(('mock.mongodb.com', 27017),))
+def simulated_game_test():
+    db, _ = get_db_manager(config['mongo'])
+    for team in config['teams']:
+        insert_team_if_not_exists(db, team['id'], team['host'], team['name'], team['token'])
+    for service in config['services']:
+        insert_service_if_not_exists(db, service['id'], service['port'], service['name'])
+    # a game of 10 rounds of 1 minute, played at 200x
+    start = datetime.datetime.now().replace(microsecond=0) + datetime.timedelta(seconds=60)
+    fmt = "%d %b %Y %H:%M:%S"
+    config['misc']['start_time'] = start.strftime(fmt)
+    config['misc']['end_time'] = (start + datetime.timedelta(minutes=10)).strftime(fmt)
+    clock = SimulatedClock(start=time.time(), speed=200)
+    checkScheduler = CheckScheduler(EventQueue(), config, clock)
+    real_start = time.monotonic()
+    checkScheduler.start()
+    checkScheduler.join()
+    assert time.monotonic() - real_start < 30, "11 minutes of game should be played in a few seconds"
+    assert checkScheduler.roundNum == 10, "All the 10 rounds should have been played"
+    clock.sleep(checkScheduler.roundTime)
+    checkScheduler.checkBuffer.stop()
+    n_checks_for_service = sum([i + 1 for i in range(checkScheduler.flagLifetime)]) + \
+        (checkScheduler.flagLifetime + 1) * (checkScheduler.maxRounds - checkScheduler.flagLifetime)
+    for team in get_teams(db):
+        assert len(team['checks']) == n_checks_for_service * len(config['services']), \
+            f"Team {team['team_id']} should have received {n_checks_for_service} checks for each service"
+
+
+tests = [simulated_clock_test, simulated_game_test]
+
+if __name__ == "__main__":
+    for test in tests:
+        log(f"Starting test: {test.__name__}")
+        try:
+            test()
+        except AssertionError as e:
+            log(f"Test {test.__name__} failed: {e.args}")
+            continue
+        log(f"Test {test.__name__} completed successfully")
@@ -1,5 +1,6 @@
 import mongomock
 import time
+import copy
 
 import project_utils
 from mongo_utils import get_db_manager, get_teams, get_services, insert_flag, push_stolen_flag, push_lost_flag, get_flag_by_data, NotExistentDocument
@@ -125,7 +126,28 @@ def init_do_something_then_resume_test():
         assert not error, "Flag should be present in mongo"
 
 
-tests = [base_init_test, init_do_something_then_resume_test]
+@mongomock.patch(servers=(('mock.mongodb.com', 27017),))
+def repeated_init_test():
+    phases = {}
+    project_utils.init_or_resume_mongo(config, phases)
+    assert set(phases.keys()) == {"teams", "services", "flag_indexes", "teams_points", "resume_points"}, \
+        f"The duration of each phase should be measured, not only {phases.keys()}"
+    # a service added to the configuration of a resumed game
+    new_config = copy.deepcopy(config)
+    new_config['services'].append({"id": 2, "port": 7333, "name": "example_2",
+                                   "checker": "volume/example/example_checker_0.py"})
+    project_utils.init_or_resume_mongo(new_config)
+    project_utils.init_or_resume_mongo(new_config)
+    db, _ = get_db_manager(config['mongo'])
+    teams = [t for t in get_teams(db)]
+    assert len(teams) == len(config['teams']), "Teams should be inserted once"
+    assert len([s for s in get_services(db)]) == 3, "Services should be inserted once"
+    for team in teams:
+        service_ids = [p['service_id'] for p in team['points']]
+        assert service_ids == [0, 1, 2], f"Points should be initialized once for each service, not {service_ids}"
+
+
+tests = [base_init_test, init_do_something_then_resume_test, repeated_init_test]
 
 
 if __name__ == "__main__":
@@ -0,0 +1,245 @@
+import mongomock
+import datetime
+import json
+import os
+import socket
+import tempfile
+import threading
+import time
+
+from job_broker import JobBroker, BrokerServer, RemoteBroker, BrokerError, WORKER_FIELDS, request_mac
+from checker_worker import CheckerWorker
+from check_scheduler import CheckScheduler
+from event_queue import EventQueue, Status, check_event, decode_events
+from mongo_utils import get_db_manager, insert_team_if_not_exists, insert_service_if_not_exists, get_teams
+from checker_lib import OK, CORRUPT, ERROR
+from project_utils import log
+
+config = {
+    "teams": [
+        {"id": 0, "host": "10.0.0.1", "name": "first", "token": "c2e192800a294acbb2ac7dd188502edb"},
+        {"id": 1, "host": "10.0.0.2", "name": "second", "token": "934310005a1447b8bd52d9dcbd5c405a"}
+    ],
+    "services": [
+        {"id": 0, "port": 7331, "name": "example_0", "checker": "volume/example/example_checker_0.py"},
+        {"id": 1, "port": 7332, "name": "example_1", "checker": "volume/example/example_checker_1.py"}
+    ],
+    "mongo": {
+        "hostname": "mock.mongodb.com", "port": 27017, "db_name": "ad_kihon", "user": "admin", "password": "admin"
+    },
+    "flask": {
+        "port": 8080
+    },
+    "misc": {
+        "start_time": "11 apr 2022 15:30",
+        "end_time": "11 apr 2022 19:30",
+        "round_time": 9,
+        "flag_lifetime": 2,
+        "flag_header": "flag",
+        "flag_body_len": 30
+    }
+}
+
+
+def make_job(team_id, service_id, is_previous=False):
+    team = {k: v for k, v in config['teams'][team_id].items() if k != 'token'}
+    return {"team": team, "service": config['services'][service_id], "flag": "flag{" + "a" * 30 + "}",
+            "seed": "b" * 32, "round_num": 1, "flag_round": 1, "is_previous": is_previous, "published": time.time(),
+            "plan": {"check": 0, "put": 0, "get": 0}}
+
+
+def broker_path():
+    return os.path.join(tempfile.mkdtemp(), "jobs.db")
+
+
+def lease_and_complete_test():
+    broker = JobBroker(broker_path())
+    broker.publish([make_job(0, 0), make_job(1, 0)])
+    other = JobBroker(broker.path)
+    first = broker.lease("w1", 1)
+    second = other.lease("w2", 5)
+    assert len(first) == 1 and len(second) == 1, "Each job should be leased by only one worker"
+    assert first[0][0] != second[0][0], "Workers should lease different jobs"
+    assert other.lease("w2", 5) == [], "There should be no jobs left"
+    assert broker.complete("w1", first[0][0], {"status": OK, "actions": []}), "The result should be accepted"
+    assert not broker.complete("w1", second[0][0], {"status": OK, "actions": []}), \
+        "The result of a job leased by another worker should be rejected"
+    collected = broker.collect()
+    assert len(collected) == 1 and collected[0][2]['status'] == OK, "Completed jobs should be collected"
+    assert broker.collect() == [], "Collected jobs should be deleted"
+    assert broker.pending() == 1, "The job leased by the second worker should be pending"
+
+
+def expired_lease_test():
+    broker = JobBroker(broker_path(), leaseSeconds=0.5, maxAttempts=3)
+    broker.publish([make_job(0, 0)])
+    (job_id, _), = broker.lease("dead_worker", 1)
+    assert broker.lease("w2", 1) == [], "A leased job should not be leased again before the lease expires"
+    time.sleep(0.6)
+    leased = broker.lease("w2", 1)
+    assert len(leased) == 1 and leased[0][0] == job_id, "The job of a dead worker should be leased again"
+    assert not broker.complete("dead_worker", job_id, {"status": OK, "actions": []}), \
+        "The late result of the dead worker should be rejected"
+    time.sleep(0.3)
+    assert broker.renew("w2", [job_id]) == 1, "The lease should be renewed"
+    time.sleep(0.3)
+    assert broker.lease("w3", 1) == [], "A renewed lease should not expire"
+    time.sleep(0.3)
+    assert broker.collect() == [], "The job should be failed only after all the attempts expired"
+    assert len(broker.lease("w3", 1)) == 1, "The job should be leased until the last attempt"
+    time.sleep(0.6)
+    collected = broker.collect()
+    assert len(collected) == 1 and collected[0][2] is None, "The job should be failed after all the attempts"
+
+
+def remote_broker_test():
+    broker = JobBroker(broker_path())
+    server = BrokerServer(broker, "127.0.0.1", 0, "secret")
+    server.start()
+    try:
+        remote = RemoteBroker(*server.server_address, "secret")
+        broker.publish([make_job(0, 0)])
+        leased = remote.lease("remote_worker", 2)
+        assert len(leased) == 1 and leased[0][1]['team']['id'] == 0, "The job should be leased through TCP"
+        assert set(leased[0][1].keys()) == set(WORKER_FIELDS), "Only the fields needed by the workers should be sent"
+        assert remote.renew("remote_worker", [leased[0][0]]) == 1, "The lease should be renewed through TCP"
+        assert remote.complete("remote_worker", leased[0][0], {"status": CORRUPT, "actions": []}), \
+            "The result should be accepted through TCP"
+        collected = broker.collect()
+        assert collected[0][2]['status'] == CORRUPT, "The result should be collected"
+        assert collected[0][1]['round_num'] == 1, "The collected job should have the whole payload"
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def broker_authentication_test():
+    broker = JobBroker(broker_path())
+    server = BrokerServer(broker, "127.0.0.1", 0, "secret")
+    server.start()
+    try:
+        broker.publish([make_job(0, 0)])
+        try:
+            RemoteBroker(*server.server_address, "wrong secret").lease("intruder", 1)
+            assert False, "A request with a wrong secret should be rejected"
+        except BrokerError:
+            pass
+        assert broker.pending() == 1 and len(broker.lease("w1", 1)) == 1, "The job should not have been leased"
+        # a request captured on the network can't be sent again, neither in the same connection nor in another one
+        with socket.create_connection(server.server_address) as sock:
+            file = sock.makefile("rwb")
+            challenge = json.loads(file.readline())['challenge']
+            body = json.dumps({"op": "renew", "args": ["w1", [1]]})
+            request = json.dumps({"body": body, "mac": request_mac(b"secret", challenge, 0, body)}).encode() + b"\n"
+            for _ in range(2):
+                file.write(request)
+                file.flush()
+            assert json.loads(file.readline()) == {"result": 1}, "The signed request should be accepted"
+            assert "error" in json.loads(file.readline()), "The replayed request should be rejected"
+            assert file.readline() == b"", "The connection should be closed after an unauthenticated request"
+        with socket.create_connection(server.server_address) as sock:
+            file = sock.makefile("rwb")
+            file.readline()
+            file.write(request)
+            file.flush()
+            assert "error" in json.loads(file.readline()), "The request should be rejected in another connection"
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def deadline_test():
+    broker = JobBroker(broker_path(), leaseSeconds=0.3)
+    broker.publish([make_job(0, 0), make_job(1, 0)], time.time() + 0.5)
+    broker.publish([make_job(0, 1)])
+    (job_id, _), = broker.lease("w1", 1)
+    assert broker.collect() == [], "No job should be failed before the deadline"
+    time.sleep(0.6)
+    assert [payload['service']['id'] for _, payload in broker.lease("w2", 3)] == [1], \
+        "The jobs past their deadline should not be leased"
+    collected = broker.collect()
+    assert sorted(payload['team']['id'] for _, payload, result in collected if result is None) == [0, 1], \
+        "The queued job and the one with an expired lease should be failed after the deadline"
+    assert not broker.complete("w1", job_id, {"status": OK, "actions": []}), "A late result should be rejected"
+    assert broker.pending() == 1, "The job without a deadline should still be pending"
+
+
+def worker_test():
+    broker = JobBroker(broker_path())
+    broker.publish([make_job(0, 0), make_job(1, 1), make_job(1, 0, is_previous=True)])
+    worker = CheckerWorker(broker, "worker", pollInterval=0.1)
+    thread = threading.Thread(target=worker.run)
+    thread.start()
+    time.sleep(1)
+    worker.stopped = True
+    thread.join()
+    results = {(payload['team']['id'], payload['service']['id']): result for _, payload, result in broker.collect()}
+    assert len(results) == 3, "All the jobs should be completed"
+    assert decode_events(bytes.fromhex(results[(0, 0)]['event'])) == [check_event(0, 0, OK)], \
+        "The result should be the check event of the job"
+    assert [a[0] for a in results[(0, 0)]['actions']] == ["check", "put", "get"], "All the actions should be executed"
+    assert decode_events(bytes.fromhex(results[(1, 1)]['event']))[0].status == Status.CORRUPT, \
+        "The status should be the one returned by the checker"
+    assert [a[0] for a in results[(1, 0)]['actions']] == ["check", "get"], "Previous flags should not be put"
+
+
+@mongomock.patch(servers=(('mock.mongodb.com', 27017),))
+def distributed_scheduler_test():
+    db, _ = get_db_manager(config['mongo'])
+    for team in config['teams']:
+        insert_team_if_not_exists(db, team['id'], team['host'], team['name'], team['token'])
+    for service in config['services']:
+        insert_service_if_not_exists(db, service['id'], service['port'], service['name'])
+    now = datetime.datetime.now()
+    fmt = "%d %b %Y %H:%M:%S"
+    config['misc']['start_time'] = (now + datetime.timedelta(seconds=3)).strftime(fmt)
+    config['misc']['end_time'] = (now + datetime.timedelta(seconds=30)).strftime(fmt)
+    config['misc']['checker_broker'] = broker_path()
+    config['misc']['checker_collect_interval'] = 0.2
+    try:
+        queue = EventQueue()
+        checkScheduler = CheckScheduler(queue, config)
+    finally:
+        del config['misc']['checker_broker']
+        del config['misc']['checker_collect_interval']
+    # a worker which dies after leasing its jobs, and two other workers
+    assert checkScheduler.broker is not None, "The scheduler should publish jobs on the broker"
+    checkScheduler.broker.leaseSeconds = 2
+    checkScheduler.start()
+    while checkScheduler.broker.pending() == 0:
+        time.sleep(0.1)
+    assert len(JobBroker(checkScheduler.broker.path).lease("dead_worker", 3)) == 3, "The jobs should be leased"
+    workers = [CheckerWorker(JobBroker(checkScheduler.broker.path), f"worker_{i}", pollInterval=0.1) for i in range(2)]
+    threads = [threading.Thread(target=w.run) for w in workers]
+    for thread in threads:
+        thread.start()
+    checkScheduler.join()
+    time.sleep(checkScheduler.roundTime)
+    for worker in workers:
+        worker.stopped = True
+    for thread in threads:
+        thread.join()
+    checkScheduler.checkBuffer.stop()
+    n_checks_for_service = sum([i + 1 for i in range(checkScheduler.flagLifetime)]) + \
+        (checkScheduler.flagLifetime + 1) * (checkScheduler.maxRounds - checkScheduler.flagLifetime)
+    for team in get_teams(db):
+        for service in config['services']:
+            checks = [c for c in team['checks'] if c['service_id'] == service['id']]
+            assert len(checks) == n_checks_for_service, \
+                f"Each team should have received {n_checks_for_service} checks for each service"
+            assert all(c['status'] != ERROR for c in checks), "No job should have failed"
+    assert checkScheduler.broker.pending() == 0, "All the jobs should have been completed"
+
+
+tests = [lease_and_complete_test, expired_lease_test, remote_broker_test, broker_authentication_test, deadline_test,
+         worker_test, distributed_scheduler_test]
+
+if __name__ == "__main__":
+    for test in tests:
+        log(f"Starting test: {test.__name__}")
+        try:
+            test()
+        except AssertionError as e:
+            log(f"Test {test.__name__} failed: {e.args}")
+            continue
+        log(f"Test {test.__name__} completed successfully")
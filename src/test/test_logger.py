@@ -0,0 +1,96 @@
+import io
+import json
+import logging
+import queue
+import sys
+import time
+
+import logger
+from logger import ASYNC_LOG, NonBlockingQueueHandler, DROPPED_MESSAGES
+from project_utils import log
+
+
+def captured(loggingConfig: dict, messages: list) -> list:
+    # logs the messages with the given configuration, and returns the lines written to stderr
+    stderr = sys.stderr
+    sys.stderr = io.StringIO()
+    try:
+        ASYNC_LOG.configure(loggingConfig)
+        for message, component in messages:
+            logger.emit(component, logging.ERROR if message.startswith("Error") else logging.INFO, message)
+        ASYNC_LOG.stop()
+        output = sys.stderr.getvalue()
+    finally:
+        sys.stderr = stderr
+        ASYNC_LOG.configure({})
+    return output.splitlines()
+
+
+def json_format_test():
+    lines = captured({"format": "json"}, [("Error: checker failed", "check_scheduler")])
+    assert len(lines) == 1, f"There should be a line, not {lines}"
+    entry = json.loads(lines[0])
+    assert entry['level'] == "error" and entry['component'] == "check_scheduler", f"Wrong entry {entry}"
+    assert entry['msg'] == "Error: checker failed", "The message should be in the entry"
+    # the component is the module which calls log
+    stderr = sys.stderr
+    sys.stderr = io.StringIO()
+    try:
+        ASYNC_LOG.configure({"format": "json"})
+        log("Warning: from the test")
+        ASYNC_LOG.stop()
+        entry = json.loads(sys.stderr.getvalue())
+    finally:
+        sys.stderr = stderr
+        ASYNC_LOG.configure({})
+    assert entry['component'] == "test_logger" and entry['level'] == "warning", f"Wrong entry {entry}"
+
+
+def component_levels_test():
+    config = {"level": "info", "components": {"check_scheduler": "error"}}
+    lines = captured(config, [("Starting round 1", "check_scheduler"), ("Error: round 1 failed", "check_scheduler"),
+                              ("Accepted 3 flags", "submission_service")])
+    assert lines == ["[+] Error: round 1 failed", "[+] Accepted 3 flags"], f"Wrong lines {lines}"
+    # levels are reset by a new configuration
+    lines = captured({}, [("Starting round 1", "check_scheduler")])
+    assert lines == ["[+] Starting round 1"], "The level of the component should have been reset"
+
+
+def rate_limit_test():
+    config = {"rate_limit_interval": 10, "rate_limit_burst": 3}
+    dropped = DROPPED_MESSAGES.get(reason="rate_limit")
+    messages = [(f"Error: flag for round {i} doesn't exist", "check_scheduler") for i in range(10)]
+    messages.append(("Error: another error", "check_scheduler"))
+    lines = captured(config, messages)
+    assert len(lines) == 4, f"Only 3 messages alike should be written, plus a different one, not {lines}"
+    assert DROPPED_MESSAGES.get(reason="rate_limit") == dropped + 7, "The suppressed messages should be counted"
+    limiter = logger.RateLimitFilter(0.2, 1)
+    records = [logging.LogRecord("ad_kihon.test", logging.INFO, "", 0, f"message {i}", None, None) for i in range(4)]
+    passed = [limiter.filter(record) for record in records[:3]]
+    assert passed == [True, False, False], "Messages beyond the burst should be suppressed"
+    time.sleep(0.3)
+    assert limiter.filter(records[3]) and records[3].suppressed == 2, \
+        "The first message of the next interval should report the suppressed ones"
+
+
+def non_blocking_test():
+    dropped = DROPPED_MESSAGES.get(reason="queue_full")
+    handler = NonBlockingQueueHandler(queue.Queue(maxsize=1))
+    for i in range(3):
+        handler.handle(logging.LogRecord("ad_kihon.test", logging.INFO, "", 0, f"message {i}", None, None))
+    assert handler.queue.qsize() == 1, "The queue should keep its size"
+    assert DROPPED_MESSAGES.get(reason="queue_full") == dropped + 2, "Messages of a full queue should be dropped"
+
+
+tests = [json_format_test, component_levels_test, rate_limit_test, non_blocking_test]
+
+
+if __name__ == "__main__":
+    for test in tests:
+        log(f"Starting test: {test.__name__}")
+        try:
+            test()
+        except AssertionError as e:
+            log(f"Test {test.__name__} failed: {e.args}")
+            continue
+        log(f"Test {test.__name__} completed successfully")
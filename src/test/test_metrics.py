@@ -0,0 +1,65 @@
+import metrics
+from project_utils import log
+
+
+def counter_test():
+    counter = metrics.counter("test_counter_total", "Test counter", ("verdict",))
+    counter.inc(verdict="accepted")
+    counter.inc(2, verdict="accepted")
+    counter.inc(verdict="old")
+    assert counter.get(verdict="accepted") == 3, "Counter for accepted should be 3"
+    assert counter.get(verdict="old") == 1, "Counter for old should be 1"
+    assert counter.get(verdict="invalid") == 0, "Counter for a label never seen should be 0"
+    assert metrics.counter("test_counter_total", "Test counter", ("verdict",)) is counter, \
+        "Declaring twice the same metric should return the first one"
+    text = metrics.render()
+    assert "# TYPE test_counter_total counter" in text, "Counter type should be rendered"
+    assert 'test_counter_total{verdict="accepted"} 3' in text, "Counter value should be rendered"
+
+
+def histogram_test():
+    histogram = metrics.histogram("test_histogram_seconds", "Test histogram", ("service",), buckets=(0.1, 1, 10))
+    for value in [0.05, 0.5, 0.5, 5, 50]:
+        histogram.observe(value, service="example_0")
+    count, total = histogram.get(service="example_0")
+    assert count == 5, "Histogram count should be 5"
+    assert abs(total - 56.05) < 1e-9, "Histogram sum should be 56.05"
+    text = metrics.render()
+    assert 'test_histogram_seconds_bucket{service="example_0",le="0.1"} 1' in text, "Incorrect 0.1 bucket"
+    assert 'test_histogram_seconds_bucket{service="example_0",le="1"} 3' in text, "Buckets should be cumulative"
+    assert 'test_histogram_seconds_bucket{service="example_0",le="10"} 4' in text, "Incorrect 10 bucket"
+    assert 'test_histogram_seconds_bucket{service="example_0",le="+Inf"} 5' in text, "Incorrect +Inf bucket"
+    assert 'test_histogram_seconds_count{service="example_0"} 5' in text, "Incorrect count"
+    with histogram.time(service="example_1"):
+        pass
+    assert histogram.get(service="example_1")[0] == 1, "Timer should have observed one value"
+
+
+def gauge_func_test():
+    values = [1, 2, 3]
+    metrics.gauge_func("test_queue_depth", "Test gauge", lambda: len(values))
+    assert "test_queue_depth 3" in metrics.render(), "Gauge should read the current value"
+    values.append(4)
+    assert "test_queue_depth 4" in metrics.render(), "Gauge should read the current value at each render"
+    other_values = []
+    metrics.gauge_func("test_queue_depth", "Test gauge", lambda: len(other_values))
+    assert "test_queue_depth 0" in metrics.render(), "Re-declaring a gauge function should replace the function"
+
+
+def escape_test():
+    counter = metrics.counter("test_escape_total", "Test escape", ("service",))
+    counter.inc(service='fruit "ninja"\n')
+    assert r'test_escape_total{service="fruit \"ninja\"\n"} 1' in metrics.render(), "Label values should be escaped"
+
+
+tests = [counter_test, histogram_test, gauge_func_test, escape_test]
+
+if __name__ == "__main__":
+    for test in tests:
+        log(f"Starting test: {test.__name__}")
+        try:
+            test()
+        except AssertionError as e:
+            log(f"Test {test.__name__} failed: {e.args}")
+            continue
+        log(f"Test {test.__name__} completed successfully")
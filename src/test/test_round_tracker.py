@@ -0,0 +1,132 @@
+import mongomock
+import time
+
+from round_tracker import RoundTracker, ROUND_OVERRUNS, CANCELLED_CHECKS
+from check_scheduler import CheckScheduler
+from event_queue import EventQueue
+from game_clock import SimulatedClock
+from checker_lib import OK
+from project_utils import log
+
+config = {
+    "teams": [
+        {"id": 0, "host": "10.0.0.1", "name": "first", "token": "c2e192800a294acbb2ac7dd188502edb"},
+        {"id": 1, "host": "10.0.0.2", "name": "second", "token": "934310005a1447b8bd52d9dcbd5c405a"}
+    ],
+    "services": [
+        {"id": 0, "port": 7331, "name": "example_0", "checker": "volume/example/example_checker_0.py"},
+        {"id": 1, "port": 7332, "name": "example_1", "checker": "volume/example/example_checker_1.py"}
+    ],
+    "mongo": {
+        "hostname": "mock.mongodb.com", "port": 27017, "db_name": "ad_kihon", "user": "admin", "password": "admin"
+    },
+    "flask": {
+        "port": 8080
+    },
+    "misc": {
+        "start_time": "11 apr 2022 15:30",
+        "end_time": "11 apr 2022 19:30",
+        "round_time": 10,
+        "flag_lifetime": 2,
+        "flag_header": "flag",
+        "flag_body_len": 30
+    }
+}
+
+
+class CountingChecker:
+    def __init__(self, team, service):
+        self.team, self.service = team, service
+        self.calls = []
+
+    def check(self):
+        self.calls.append("check")
+        return OK
+
+    def put(self, flag_data, seed):
+        self.calls.append("put")
+        return OK
+
+    def get(self, flag_data, seed):
+        self.calls.append("get")
+        return OK
+
+
+def overrun_test():
+    clock = SimulatedClock(time.time(), 50)
+    tracker = RoundTracker(config, clock)
+    overruns = ROUND_OVERRUNS.get()
+    tracker.startRound(1, clock.time(), 3)
+    tracker.jobDone(1)
+    tracker.jobDone(1)
+    assert tracker.outstanding(1) == 1, "One check of the round should be outstanding"
+    clock.sleep(10)
+    tracker.startRound(2, clock.time(), 2)
+    assert ROUND_OVERRUNS.get() == overruns + 1, "The round should be reported as overrun"
+    assert tracker.numOutstanding() == 1, "The outstanding checks of the previous rounds should be counted"
+    tracker.jobDone(2)
+    tracker.jobDone(2)
+    tracker.jobDone(1)
+    clock.sleep(10)
+    tracker.startRound(3, clock.time(), 0)
+    assert ROUND_OVERRUNS.get() == overruns + 1, "A round completed in time should not be reported"
+    assert tracker.numOutstanding() == 0 and 1 not in tracker.rounds, "Completed rounds should be dropped"
+    assert tracker.scale == 1.0, "The window should not be scaled if adaptive_window is disabled"
+
+
+def adaptive_window_test():
+    config['misc']['adaptive_window'] = True
+    config['misc']['min_window_scale'] = 0.5
+    try:
+        clock = SimulatedClock(time.time(), 50)
+        tracker = RoundTracker(config, clock)
+    finally:
+        del config['misc']['adaptive_window']
+        del config['misc']['min_window_scale']
+    assert tracker.startRound(1, clock.time(), 1) == 1.0
+    # the last check of round 1 completes after 95% of the round
+    clock.sleep(9.5)
+    tracker.jobDone(1)
+    clock.sleep(0.5)
+    assert tracker.startRound(2, clock.time(), 1) == 0.75, "The window should shrink after a late tail"
+    clock.sleep(10)
+    assert tracker.startRound(3, clock.time(), 1) == 0.75 * 0.75, "The window should shrink after an overrun"
+    clock.sleep(10)
+    assert tracker.startRound(4, clock.time(), 1) == 0.5, "The window should not shrink below the minimum"
+    clock.sleep(1)
+    tracker.jobDone(4)
+    clock.sleep(9)
+    assert tracker.startRound(5, clock.time(), 0) == 0.5 / 0.75, "The window should grow after a round in time"
+
+
+@mongomock.patch(servers=(('mock.mongodb.com', 27017),))
+def cancel_expired_test():
+    clock = SimulatedClock(time.time(), 50)
+    queue = EventQueue()
+    checkScheduler = CheckScheduler(queue, config, clock)
+    checkScheduler.tracker.startRound(5, clock.time(), 2)
+    team, service = config['teams'][0], config['services'][0]
+    plan = {"check": clock.time(), "put": clock.time(), "get": clock.time()}
+    cancelled = CANCELLED_CHECKS.get(service=service['name'])
+    expired = CountingChecker(team, service)
+    checkScheduler.runChecker(expired, "flag", "seed", 4, 2, plan, True)
+    assert expired.calls == [], "The check of an expired flag should be cancelled"
+    assert queue.qsize() == 0, "A cancelled check should not be reported"
+    assert CANCELLED_CHECKS.get(service=service['name']) == cancelled + 1, "The cancelled check should be counted"
+    valid = CountingChecker(team, service)
+    checkScheduler.runChecker(valid, "flag", "seed", 5, 3, plan, True)
+    assert valid.calls == ["check", "get"] and queue.qsize() == 1, "The check of a valid flag should run"
+    assert checkScheduler.tracker.outstanding(5) == 1, "Completed checks should not be outstanding"
+
+
+tests = [overrun_test, adaptive_window_test, cancel_expired_test]
+
+if __name__ == "__main__":
+    for test in tests:
+        log(f"Starting test: {test.__name__}")
+        try:
+            test()
+        except AssertionError as e:
+            log(f"Test {test.__name__} failed: {e.args}")
+            continue
+        log(f"Test {test.__name__} completed successfully")
@@ -1,8 +1,11 @@
 import mongomock
 import time
 import threading
+import json
 
 from scoreboard_cache import ScoreboardCache, ConcurrentUpdateException
+from event_dispatcher import EventDispatcher
+from event_queue import EventQueue, AttackEvent, check_event
 from mongo_utils import get_db_manager, insert_team_if_not_exists, insert_service_if_not_exists, init_teams_points, \
     insert_flag, push_stolen_flag, push_lost_flag, push_check, resume_points
 from checker_lib import gen_flag, gen_seed, OK, CORRUPT
@@ -221,8 +224,7 @@ def concurrent_get_stats_test():
         error = True
     assert error or not scoreboardCache.mutex.locked(), \
         "The concurrent update with 'wait' set to False should throw an exception, or the mutex should be unlocked"
-    while scoreboardCache.mutex.locked():
-        pass
+    backgroundGetStats.join()
     teams = scoreboardCache.getStats(wait=False)
     for team in teams:
         if team['name'] == 'first':
@@ -234,8 +236,89 @@ def concurrent_get_stats_test():
                 f"First team overall score is {team['overall_score']}, but should be equal to base score"
 
 
+@mongomock.patch(servers=(('mock.mongodb.com', 27017),))
+def stale_while_refresh_test():
+    db, flags = prepare_test()
+    scoreboardCache = ScoreboardCache(config)
+    push_check(db, team_id=0, service_id=0, status=OK, timestamp=int(time.time()))
+    resume_points(db)
+    time.sleep(scoreboardCache.updateLatency)
+    makeSnapshot = scoreboardCache.makeSnapshot
+
+    def slowSnapshot():
+        time.sleep(1)
+        return makeSnapshot()
+    scoreboardCache.makeSnapshot = slowSnapshot
+    backgroundGetStats = threading.Thread(target=scoreboardCache.getStats)
+    backgroundGetStats.start()
+    time.sleep(0.1)
+    start = time.time()
+    teams = scoreboardCache.getStats()
+    assert time.time() - start < 0.1, "Readers should not wait for the refresh in progress"
+    assert all(team['overall_score'] == config['misc']['base_score'] for team in teams), \
+        "Readers should get the previous snapshot during the refresh"
+    backgroundGetStats.join()
+    first, = [team for team in scoreboardCache.getStats(wait=False) if team['name'] == 'first']
+    assert first['overall_score'] == config['misc']['base_score'] + config['misc']['sla_weight'], \
+        "The new snapshot should be served after the refresh"
+
+
+@mongomock.patch(servers=(('mock.mongodb.com', 27017),))
+def columnar_test():
+    db, flags = prepare_test()
+    scoreboardCache = ScoreboardCache(config)
+    get_ts = lambda: int(time.time())
+    push_check(db, team_id=0, service_id=1, status=OK, timestamp=get_ts())
+    push_check(db, team_id=1, service_id=0, status=CORRUPT, timestamp=get_ts())
+    util_push_attack(db, flags, 2)
+    resume_points(db)
+    time.sleep(scoreboardCache.updateLatency)
+    columns = json.loads(scoreboardCache.getEncodedStats(columnar=True))
+    teams = json.loads(scoreboardCache.getEncodedStats())
+    assert columns['team_ids'] == [0, 1] and columns['service_ids'] == [0, 1], "Wrong header of the columns"
+    assert columns['team_names'] == [team['name'] for team in teams], "Teams should be in the same order"
+    assert columns['overall_score'] == [team['overall_score'] for team in teams], "Scores should be the same"
+    n_services = len(columns['service_ids'])
+    for i, team in enumerate(teams):
+        for j, service_name in enumerate(columns['service_names']):
+            for pts_type in ["atk_pts", "def_pts", "sla_pts"]:
+                assert columns[pts_type][i * n_services + j] == team['points'][service_name][pts_type], \
+                    f"Wrong {pts_type} of team {i}, service {j}"
+            code = columns['status'][i * n_services + j]
+            status = columns['status_names'][code] if code >= 0 else None
+            assert status == team['service_status'].get(service_name), f"Wrong status of team {i}, service {j}"
+    assert columns['status'] == [-1, 0, 2, -1], f"Wrong status codes {columns['status']}"
+    assert len(scoreboardCache.getEncodedStats(columnar=True)) < len(scoreboardCache.getEncodedStats()), \
+        "The columnar format should be smaller"
+
+
+@mongomock.patch(servers=(('mock.mongodb.com', 27017),))
+def follow_events_test():
+    db, flags = prepare_test()
+    scoreboardCache = ScoreboardCache(config)
+    dispatcher = EventDispatcher(EventQueue(), config)
+    scoreboardCache.followEvents(dispatcher)
+    dispatcher.dispatch([check_event(0, 0, OK), AttackEvent(1, 1, 0)])
+    time.sleep(scoreboardCache.updateLatency)
+    first, second = scoreboardCache.getStats()
+    assert first['overall_score'] == config['misc']['base_score'] + config['misc']['sla_weight'] - \
+        config['misc']['def_weight'] and second['overall_score'] == config['misc']['base_score'] + \
+        config['misc']['atk_weight'], "The points written before the refresh should be read from the DB"
+    dispatcher.dispatch([check_event(1, 0, CORRUPT)])
+    # the points of the documents are not read again, so a change which doesn't come from the dispatcher is ignored
+    db.get_collection("team").update_one({"team_id": 0, "points.service_id": 1}, {"$inc": {"points.$.atk_pts": 5}})
+    time.sleep(scoreboardCache.updateLatency)
+    first, second = scoreboardCache.getStats()
+    assert first['overall_score'] == config['misc']['base_score'] + config['misc']['sla_weight'] - \
+        config['misc']['def_weight'], "The points should not be read again from the DB"
+    assert second['overall_score'] == config['misc']['base_score'] + config['misc']['atk_weight'] - \
+        config['misc']['sla_weight'], "The points should be updated with the increments of the dispatcher"
+    columns = json.loads(scoreboardCache.getEncodedStats(columnar=True))
+    assert columns['sla_pts'] == [1, 0, -1, 0], "The columnar format should have the points of the scores"
+
+
 tests = [zero_pts_anti_leak_test, update_latency_test, sla_pts_and_status_test, atk_and_def_pts_test,
-         mixed_pts_test, concurrent_get_stats_test]
+         mixed_pts_test, concurrent_get_stats_test, stale_while_refresh_test, columnar_test, follow_events_test]
 
 if __name__ == "__main__":
     for test in tests:
@@ -0,0 +1,106 @@
+import random
+
+from scoring_engine import ScoringEngine, InvalidScoringFormula
+from checker_lib import OK, DOWN, CORRUPT, ERROR
+from project_utils import log
+
+services = {0: {"service_id": 0, "name": "example_0"}, 1: {"service_id": 1, "name": "example_1"}}
+misc = {"atk_weight": 10, "def_weight": 10, "sla_weight": 80, "base_score": 1000}
+
+
+def make_team(team_id, points, checks):
+    # points: {service_id: (atk, def, sla)}, checks: list of (service_id, status)
+    return {"team_id": team_id,
+            "points": [{"service_id": s, "atk_pts": p[0], "def_pts": p[1], "sla_pts": p[2]} for s, p in points.items()],
+            "checks": [{"service_id": s, "status": status, "timestamp": 0} for s, status in checks]}
+
+
+def make_engine(**params):
+    return ScoringEngine({"misc": dict(misc, **params)}, services)
+
+
+def linear_test():
+    engine = make_engine()
+    teams = [make_team(i, {s: (random.randint(0, 50), -random.randint(0, 50), random.randint(-20, 20))
+                           for s in services}, []) for i in range(10)]
+    engine.load(teams)
+    overall = engine.scores().overall.tolist()
+    for i, team in enumerate(teams):
+        expected = misc['base_score'] + sum(p['atk_pts'] * misc['atk_weight'] + p['def_pts'] * misc['def_weight'] +
+                                            p['sla_pts'] * misc['sla_weight'] for p in team['points'])
+        assert overall[i] == expected, f"Score of team {i} is {overall[i]}, but should be {expected}"
+
+
+def ranks_and_sla_test():
+    engine = make_engine()
+    engine.load([make_team(0, {0: (1, 0, 2), 1: (0, 0, 0)}, [(0, OK), (0, OK), (0, ERROR)]),
+                 make_team(1, {0: (0, 0, 0), 1: (0, -1, 0)}, [(0, OK), (0, DOWN), (1, OK), (1, CORRUPT)]),
+                 make_team(2, {0: (1, 0, 2), 1: (0, 0, 0)}, [(0, OK), (0, OK)])])
+    scores = engine.scores()
+    assert scores.ranks.tolist() == [1, 3, 1], "Teams with the same score should have the same rank"
+    assert scores.slaRatio.tolist() == [[1, 1], [0.5, 0.5], [1, 1]], \
+        "SLA ratio should be the fraction of checks which are ok, excluding errors"
+
+
+def formulas_test():
+    team = make_team(0, {0: (4, -2, 0), 1: (2, 0, 1)}, [(0, OK), (0, DOWN), (0, DOWN), (0, OK), (1, OK)])
+    engine = make_engine(scoring_formula="sla_multiplicative")
+    engine.load([team])
+    expected = 1000 + (4 * 10 - 2 * 10) * 0.5 + 2 * 10 + 80
+    assert engine.scores().overall[0] == expected, "Attack and defense points should be scaled by the SLA ratio"
+    engine = make_engine(flag_decay=0.5, service_weights={"example_1": 2})
+    engine.load([team])
+    expected = 1000 + (1 + 0.5 + 0.25 + 0.125) * 10 - 2 * 10 + 2 * ((1 + 0.5) * 10 + 80)
+    assert abs(engine.scores().overall[0] - expected) < 1e-9, "Flags should decay and services should be weighted"
+    try:
+        make_engine(scoring_formula="unknown")
+        assert False, "An invalid formula should raise an exception"
+    except InvalidScoringFormula:
+        pass
+
+
+def reload_test():
+    engine = make_engine()
+    engine.load([make_team(0, {0: (1, 0, 1), 1: (0, 0, 0)}, [(0, OK)]), make_team(1, {0: (0, -1, 0)}, [(1, OK)])])
+    arrays = (engine.atk, engine.dfn, engine.sla, engine.checks)
+    # the points of team 1 for service 1 appear, the ones of a removed service are ignored
+    engine.load([make_team(0, {0: (2, 0, 1), 1: (0, 0, 0), 5: (9, 9, 9)}, [(0, OK), (0, DOWN)]),
+                 make_team(1, {1: (1, 0, 0), 0: (0, -2, 0)}, [(1, OK)])])
+    assert all(a is b for a, b in zip(arrays, (engine.atk, engine.dfn, engine.sla, engine.checks))), \
+        "The arrays should be reused while the teams don't change"
+    assert engine.atk.tolist() == [[2, 0], [0, 1]] and engine.dfn.tolist() == [[0, 0], [-2, 0]], \
+        "The points should be the ones of the last load"
+    assert engine.checks.tolist() == [[2, 0], [0, 1]], "Only the new checks should be added"
+
+
+def event_points_test():
+    engine = make_engine()
+    teams = [make_team(0, {0: (1, 0, 1), 1: (0, 0, 0)}, [(0, OK)]), make_team(1, {0: (0, -1, 0), 1: (0, 0, 0)}, [])]
+    assert engine.needsPoints([0, 1]), "The points should be read at the first load"
+    engine.load(teams)
+    engine.addPoints({(0, 1): {"atk_pts": 2}, (1, 1): {"def_pts": -2, "sla_pts": 1}, (0, 5): {"atk_pts": 9}})
+    assert not engine.needsPoints([0, 1]), "The points should be kept while the teams don't change"
+    engine.load(teams, withPoints=False)
+    assert engine.atk.tolist() == [[1, 2], [0, 0]] and engine.dfn.tolist() == [[0, 0], [-1, -2]] and \
+        engine.sla.tolist() == [[1, 0], [0, 1]], "The increments should be added to the loaded points"
+    assert engine.scores().overall.tolist() == [1000 + 10 + 80 + 20, 1000 - 10 - 20 + 80], \
+        "The scores should include the increments"
+    engine.addPoints(None)
+    assert engine.needsPoints([0, 1]), "The points should be read again after a failed write"
+    engine.addPoints({(0, 0): {"atk_pts": 1}})
+    engine.load(teams)
+    assert engine.atk.tolist() == [[1, 0], [0, 0]], "The points should be the ones of the documents"
+    assert engine.needsPoints([0, 1, 2]), "The points should be read again when the teams change"
+
+
+tests = [linear_test, ranks_and_sla_test, formulas_test, reload_test, event_points_test]
+
+if __name__ == "__main__":
+    for test in tests:
+        log(f"Starting test: {test.__name__}")
+        try:
+            test()
+        except AssertionError as e:
+            log(f"Test {test.__name__} failed: {e.args}")
+            continue
+        log(f"Test {test.__name__} completed successfully")
@@ -1,8 +1,9 @@
 import mongomock
+import threading
 import time
 import datetime
 
-from services import Services
+from services import Services, Startup
 import project_utils
 from checker_lib import OK, CORRUPT
 from mongo_utils import get_db_manager, get_flag_for_round
@@ -38,7 +39,7 @@ config = {
         "max_flags_per_submission": 20,
         "scoreboard_cache_update_latency": 2,
         "base_score": 1000,
-        "dispatch_frequency": 2
+        "dispatch_max_delay": 0.1
     }
 }
 
@@ -48,6 +49,13 @@ def to_time_str(timestamp: int):
     return datetime.datetime.fromtimestamp(timestamp).strftime(fmt)
 
 
+def sleep_until_end_of_checks(start: int, round_num: int):
+    # the checks of a round are completed in its first 2/3, and round i starts at start + i * round_time:
+    # the stats are read in the last part of the round, after its checks
+    roundTime = config['misc']['round_time']
+    time.sleep(max(start + round_num * roundTime + 0.8 * roundTime - time.time(), 0))
+
+
 def check_team_stats(team, round_num, expected_overall_score, n_checks: list):
     # this function is to make some refactoring among different tests, it doesn't check all the stats
     i = round_num
@@ -68,10 +76,12 @@ def check_team_stats(team, round_num, expected_overall_score, n_checks: list):
 
 @mongomock.patch(servers=(('mock.mongodb.com', 27017),))
 def only_checkers_test():
-    config['misc']['start_time'] = to_time_str(int(time.time()) + 3)
-    config['misc']['end_time'] = to_time_str(int(time.time()) + 35)
+    start = int(time.time()) + 3
+    config['misc']['start_time'] = to_time_str(start)
+    # 3 rounds: the checks and the flag submission of the last one are completed before the end time
+    config['misc']['end_time'] = to_time_str(start + 35)
     config['misc']['round_time'] = 9
-    config['misc']['dispatch_frequency'] = 0.01
+    config['misc']['dispatch_max_delay'] = 0.01
     project_utils.init_or_resume_mongo(config)
     adServices = Services(config)
     assert adServices.checkScheduler.maxRounds == 3, "Incorrect computation of number of rounds"
@@ -80,10 +90,9 @@ def only_checkers_test():
         assert team['overall_score'] == adServices.scoreboardCache.baseScore, \
             f"At start, all scores should be equal to base score"
         assert len(team['service_status']) == 0, "At start, services should not have any status"
-    time.sleep(3)
     n_checks = [0, 1, 3, 6]
     for i in range(1, 4):
-        time.sleep(10)
+        sleep_until_end_of_checks(start, i)
         teams = adServices.scoreboardCache.getStats()
         for team in teams:
             # 2 OK and 1 CORRUPT for each round, plus the rounds in flagLifetime window
@@ -97,10 +106,12 @@ def only_checkers_test():
 
 @mongomock.patch(servers=(('mock.mongodb.com', 27017),))
 def check_and_flag_submit_test():
-    config['misc']['start_time'] = to_time_str(int(time.time()) + 3)
-    config['misc']['end_time'] = to_time_str(int(time.time()) + 35)
+    start = int(time.time()) + 3
+    config['misc']['start_time'] = to_time_str(start)
+    # 3 rounds: the checks and the flag submission of the last one are completed before the end time
+    config['misc']['end_time'] = to_time_str(start + 35)
     config['misc']['round_time'] = 9
-    config['misc']['dispatch_frequency'] = 0.01
+    config['misc']['dispatch_max_delay'] = 0.01
     project_utils.init_or_resume_mongo(config)
     db, _ = get_db_manager(config['mongo'])
     token = "c2e192800a294acbb2ac7dd188502edb"
@@ -111,13 +122,12 @@ def check_and_flag_submit_test():
         assert team['overall_score'] == adServices.scoreboardCache.baseScore, \
             f"At start, all scores should be equal to base score"
         assert len(team['service_status']) == 0, "At start, services should not have any status"
-    time.sleep(3)
     n_checks = [0, 1, 3, 6]
     for i in range(1, 4):
-        time.sleep(9)
+        sleep_until_end_of_checks(start, i)
         flag = get_flag_for_round(db, round_num=i, team_id=1, service_id=0)['flag_data']
         adServices.submissionService.submitFlags(team_token=token, flags=[flag])
-        time.sleep(1)
+        time.sleep(0.5)
         teams = adServices.scoreboardCache.getStats()
         for team in teams:
             sla_score = n_checks[i] * adServices.scoreboardCache.slaWeight
@@ -141,7 +151,39 @@ def check_and_flag_submit_test():
     adServices.stop()
 
 
-tests = [only_checkers_test, check_and_flag_submit_test]
+@mongomock.patch(servers=(('mock.mongodb.com', 27017),))
+def startup_test():
+    config['misc']['start_time'] = to_time_str(int(time.time()) + 3)
+    config['misc']['end_time'] = to_time_str(int(time.time()) + 35)
+    config['misc']['round_time'] = 9
+    startup = Startup(config)
+    assert not startup.ready.is_set() and startup.services is None, "Services should not be ready before the startup"
+    startup.start()
+    assert startup.ready.wait(timeout=10), "Services should be ready after the startup"
+    assert {"services", "resume_points", "start_services"} <= set(startup.phases.keys()), \
+        "The phases should have been measured"
+    teams = startup.services.scoreboardCache.getStats()
+    assert len(teams) == len(config['teams']), "The DB should have been initialized before starting the services"
+    startup.services.stop()
+
+
+@mongomock.patch(servers=(('mock.mongodb.com', 27017),))
+def startup_failure_test():
+    # the scheduler can't be initialized with an end time before the start time
+    failing_config = dict(config, misc=dict(config['misc'], start_time=to_time_str(int(time.time()) + 35),
+                                            end_time=to_time_str(int(time.time()) + 3), startup_attempts=2,
+                                            startup_retry_delay=0.5))
+    failed = threading.Event()
+    startup = Startup(failing_config, onFailure=failed.set)
+    start = time.time()
+    startup.start()
+    assert failed.wait(timeout=10), "The failure should be reported after the last attempt"
+    assert time.time() - start >= 0.5, "The startup should be retried after the delay"
+    assert startup.failed and not startup.ready.is_set() and startup.services is None, \
+        "The startup should be failed and the services not ready"
+
+
+tests = [only_checkers_test, check_and_flag_submit_test, startup_test, startup_failure_test]
 
 
 if __name__ == "__main__":
@@ -0,0 +1,105 @@
+import threading
+import time
+
+from stagger_planner import StaggerPlanner, ACTIONS
+from game_clock import REAL_CLOCK
+from project_utils import log
+
+teams = {i: {"id": i, "host": f"10.0.0.{i + 1}", "name": f"team_{i}"} for i in range(10)}
+services = {i: {"id": i, "port": 7331 + i, "name": f"service_{i}"} for i in range(4)}
+
+
+def make_config(**misc):
+    return {"misc": dict({"stagger_secret": "secret"}, **misc)}
+
+
+def make_jobs(round_num, flag_lifetime=2):
+    jobs = [(team_id, service_id, round_num, False) for team_id in teams for service_id in services]
+    for flag_round in range(max(round_num - flag_lifetime, 1), round_num):
+        jobs += [(team_id, service_id, flag_round, True) for team_id in teams for service_id in services]
+    return jobs
+
+
+def deterministic_plan_test():
+    jobs = make_jobs(5)
+    plan = StaggerPlanner(make_config(), teams, services).plan(5, jobs, 1000, 60)
+    same_plan = StaggerPlanner(make_config(), teams, services).plan(5, jobs, 1000, 60)
+    other_plan = StaggerPlanner(make_config(stagger_secret="other"), teams, services).plan(5, jobs, 1000, 60)
+    next_round_plan = StaggerPlanner(make_config(), teams, services).plan(6, jobs, 1000, 60)
+    assert plan == same_plan, "The plan should be deterministic for the same secret"
+    assert plan != other_plan, "The plan should depend on the secret"
+    assert plan != next_round_plan, "The plan should change at each round"
+
+
+def even_spread_test():
+    jobs = make_jobs(5)
+    window = 60
+    plan = StaggerPlanner(make_config(), teams, services).plan(5, jobs, 1000, window)
+    phase = window / len(ACTIONS)
+    for i, action in enumerate(ACTIONS):
+        starts = sorted(p[action] for p in plan.values() if action in p)
+        expected = len(teams) * len(services) if action == "put" else len(jobs)
+        assert len(starts) == expected, f"There should be {expected} planned {action} actions"
+        slot = phase / len(starts)
+        for rank, start in enumerate(starts):
+            assert 1000 + i * phase + rank * slot <= start < 1000 + i * phase + (rank + 1) * slot, \
+                f"Each {action} action should start in its own slot of the {action} phase"
+    for (_, _, flag_round), p in plan.items():
+        assert p["check"] < p.get("put", p["get"]) <= p["get"], "Actions of a checker should be in order"
+        assert ("put" in p) == (flag_round == 5), "Only the flags of the current round should be put"
+
+
+def max_in_flight_test():
+    planner = StaggerPlanner(make_config(max_inflight_per_team=1, max_inflight_per_service=3), teams, services)
+    jobs = make_jobs(1)
+    planner.plan(1, jobs, time.time(), 0)
+    mutex = threading.Lock()
+    in_flight = {"teams": {}, "services": {}}
+    max_in_flight = {"teams": 0, "services": 0}
+
+    def action(team_id, service_id):
+        with planner.slot(1, team_id, service_id, 1, "check", time.time(), REAL_CLOCK):
+            with mutex:
+                for kind, key in (("teams", team_id), ("services", service_id)):
+                    in_flight[kind][key] = in_flight[kind].get(key, 0) + 1
+                    max_in_flight[kind] = max(max_in_flight[kind], in_flight[kind][key])
+            time.sleep(0.01)
+            with mutex:
+                in_flight["teams"][team_id] -= 1
+                in_flight["services"][service_id] -= 1
+    threads = [threading.Thread(target=action, args=(team_id, service_id)) for team_id, service_id, _, _ in jobs]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert max_in_flight["teams"] <= 1, "There should be at most 1 in-flight action for each team host"
+    assert max_in_flight["services"] <= 3, "There should be at most 3 in-flight actions for each service"
+    assert planner.summary(1)["actions"] == len(jobs), "All the actions should be in the timeline"
+    assert planner.summary(1)["max_in_flight"] <= len(teams), "Limits should bound the in-flight actions"
+
+
+def timeline_test():
+    planner = StaggerPlanner(make_config(), teams, services)
+    now = time.time()
+    planner.plan(1, make_jobs(1), now, 0)
+    with planner.slot(1, 0, 0, 1, "check", now - 2, REAL_CLOCK):
+        pass
+    timeline = planner.timeline(1)
+    assert len(timeline) == 1, "The timeline should contain the started actions"
+    assert timeline[0]["planned"] == now - 2 and timeline[0]["lag"] >= 2, "The timeline should report the lag"
+    for round_num in range(2, 20):
+        planner.plan(round_num, make_jobs(round_num), now, 0)
+    assert planner.timeline(1) == [], "Only the timelines of the last rounds should be kept"
+
+
+tests = [deterministic_plan_test, even_spread_test, max_in_flight_test, timeline_test]
+
+if __name__ == "__main__":
+    for test in tests:
+        log(f"Starting test: {test.__name__}")
+        try:
+            test()
+        except AssertionError as e:
+            log(f"Test {test.__name__} failed: {e.args}")
+            continue
+        log(f"Test {test.__name__} completed successfully")
@@ -1,12 +1,14 @@
 import mongomock
 import datetime
 
+import submission_service
 from submission_service import *
 from mongo_utils import get_db_manager, insert_team_if_not_exists, insert_service_if_not_exists, insert_flag, \
     check_stolen_flag
 from event_queue import EventQueue, EVENT_ATTACK
 from checker_lib import gen_flag, gen_seed
 from project_utils import log
+from game_clock import SimulatedClock
 
 config = {
     "teams": [
@@ -115,10 +117,10 @@ def common_flags_test():
     events = []
     while not eventQueue.empty():
         event = eventQueue.get()
-        assert event['type'] == EVENT_ATTACK, "Each event should be an attack"
-        assert event['team'] == 0, "Submitter team should have id 0"
-        assert event['attacked_team'] == 1, "Attacked team should have id 1"
-        assert event['service'] in [0, 1], "Service id should be among [0, 1]"
+        assert event.type == EVENT_ATTACK, "Each event should be an attack"
+        assert event.team == 0, "Submitter team should have id 0"
+        assert event.attacked_team == 1, "Attacked team should have id 1"
+        assert event.service in [0, 1], "Service id should be among [0, 1]"
         events.append(event)
     assert len(events) == 2, "There should be 2 events"
     for i in range(2):
@@ -332,10 +334,105 @@ def start_after_end_test():
     assert error, "Submission service should throw error if start time is after end time"
 
 
+@mongomock.patch(servers=(('mock.mongodb.com', 27017),))
+def stream_test():
+    db, eventQueue, flags = prepare_test()
+    checkScheduler = MockCheckScheduler(round_num=FIRST_ROUND)
+    submissionService = SubmissionService(eventQueue, config, checkScheduler)
+    token = "c2e192800a294acbb2ac7dd188502edb"
+    body = [f"{flags[0]}\n".encode(), b"\n", f'"{flags[2]}"\n'.encode(), f"{flags[2]}\n".encode(), b"not a flag\n"]
+    results = list(submissionService.submitFlagStream(token, parse_flag_lines(body)))
+    verdicts = [(result['flag'], result['verdict']) for result in results[:-1]]
+    assert verdicts == [(flags[0], SELF_FLAGS), (flags[2], ACCEPTED), (flags[2], ALREADY_SUBMITTED),
+                        ("not a flag", INVALID)], f"Unexpected verdicts {verdicts}"
+    summary = results[-1]['summary']
+    assert summary['num_accepted'] == 1 and summary['num_already_submitted'] == 1, "Wrong summary of the stream"
+    assert eventQueue.qsize() == 1, "A repeated flag should generate a single attack event"
+    # streams are not rate limited per request
+    results = list(submissionService.submitFlagStream(token, [flags[3]]))
+    assert results[0]['verdict'] == ACCEPTED, "A second stream should not be rate limited"
+    error = False
+    try:
+        submissionService.submitFlagStream("invalid", [flags[3]])
+    except InvalidToken:
+        error = True
+    assert error, "InvalidToken exception should have been thrown before streaming"
+
+
+@mongomock.patch(servers=(('mock.mongodb.com', 27017),))
+def stream_budget_test():
+    db, eventQueue, flags = prepare_test()
+    checkScheduler = MockCheckScheduler(round_num=FIRST_ROUND)
+    clock = SimulatedClock(time.time(), 100)
+    config['misc']['flags_per_second'] = 2
+    config['misc']['flags_burst'] = 4
+    try:
+        submissionService = SubmissionService(eventQueue, config, checkScheduler, clock)
+    finally:
+        del config['misc']['flags_per_second']
+        del config['misc']['flags_burst']
+    token = "c2e192800a294acbb2ac7dd188502edb"
+    sub_flags = [gen_flag(config['misc']['flag_header'], config['misc']['flag_body_len']) for _ in range(12)]
+    start = clock.time()
+    results = list(submissionService.submitFlagStream(token, sub_flags))
+    elapsed = clock.time() - start
+    assert len(results) == 13, "There should be a verdict for each flag, plus the summary"
+    # the first 4 flags are the burst, the other 8 take 4 seconds
+    assert 3.5 <= elapsed <= 6, f"The stream should have taken about 4 seconds, not {elapsed}"
+
+
+@mongomock.patch(servers=(('mock.mongodb.com', 27017),))
+def concurrent_streams_test():
+    db, eventQueue, flags = prepare_test()
+    checkScheduler = MockCheckScheduler(round_num=FIRST_ROUND)
+    # without a budget of flags per second, the streams are not serialized by it
+    config['misc']['flags_per_second'] = 0
+    try:
+        submissionService = SubmissionService(eventQueue, config, checkScheduler)
+    finally:
+        del config['misc']['flags_per_second']
+    token = "c2e192800a294acbb2ac7dd188502edb"
+    # the flags of the other team, submitted at the same time by more streams and by a submission
+    stolen = [flags[2], flags[3]]
+    for i in range(config['misc']['max_flags_per_submission'] - 2):
+        stolen.append(gen_flag(config['misc']['flag_header'], config['misc']['flag_body_len']))
+        insert_flag(db, stolen[-1], gen_seed(), round_num=FIRST_ROUND, team_id=1, service_id=i % 2)
+    verdicts = []
+
+    def stream():
+        verdicts.extend(result['verdict'] for result in submissionService.submitFlagStream(token, stolen)
+                        if 'verdict' in result)
+
+    def submit():
+        msg = submissionService.submitFlags(token, stolen)
+        verdicts.extend([ACCEPTED] * msg['num_accepted'] + [ALREADY_SUBMITTED] * msg['num_already_submitted'])
+    real_push_stolen_flag = submission_service.push_stolen_flag
+
+    def slow_push_stolen_flag(*args):
+        # widens the window between the checks of a flag and its push, as with a loaded DB
+        time.sleep(0.01)
+        return real_push_stolen_flag(*args)
+    submission_service.push_stolen_flag = slow_push_stolen_flag
+    threads = [threading.Thread(target=target) for target in [stream, stream, stream, submit]]
+    try:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        submission_service.push_stolen_flag = real_push_stolen_flag
+    assert verdicts.count(ACCEPTED) == len(stolen) and verdicts.count(ALREADY_SUBMITTED) == 3 * len(stolen), \
+        f"Each flag should be accepted by a single submission, not {verdicts.count(ACCEPTED)} times"
+    assert eventQueue.qsize() == len(stolen), "There should be an attack event for each flag"
+    team = db.get_collection("team").find_one({"token": token})
+    assert len(team['stolen_flags']) == len(stolen), "Each flag should be stolen once"
+
+
 tests = [invalid_token_test, common_flags_test, not_existent_flag_test, invalid_flag_pattern_test, old_flag_test,
          already_submitted_flag_test, rate_limit_test, multiple_teams_with_rate_limit_test,
          service_mutex_dynamic_rate_limit_test, reliability_handler_test, discard_flags_test,
-         submit_before_start_test, submit_after_end_test, start_after_end_test]
+         submit_before_start_test, submit_after_end_test, start_after_end_test, stream_test, stream_budget_test,
+         concurrent_streams_test]
 
 
 if __name__ == "__main__":